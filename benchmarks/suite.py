@@ -0,0 +1,322 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmark the execution and export hot paths on synthetic notebooks
+
+Usage: python benchmarks/suite.py [--baseline FILE] [--save FILE]
+
+Each benchmark reports the best time of several repeats. With --baseline,
+results are compared against a stored run and the script exits with status
+1 if any benchmark is slower than the baseline by more than --threshold.
+Baselines are only comparable on the machine that recorded them, so
+refresh the stored baseline with --save when the benchmark machine changes.
+"""
+import argparse
+import base64
+import collections
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from bs4 import BeautifulSoup
+import nbformat
+
+from nbsampleutils import export
+from nbsampleutils import preprocessors
+from nbsampleutils import replace
+from nbsampleutils import styles
+from nbsampleutils import utils
+
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+def make_dataframe_html(rows):
+    lines = [
+        "<div>",
+        '<style scoped="">',
+        "    .dataframe tbody tr th {",
+        "        vertical-align: top;",
+        "    }",
+        "</style>",
+        '<table border="1" class="dataframe">',
+        '  <thead><tr style="text-align: right;">'
+        "<th></th><th>name</th><th>count</th></tr></thead>",
+        "  <tbody>",
+    ]
+    for row in range(rows):
+        lines.append(
+            "    <tr><th>{0}</th><td>name{0}</td><td>{1}</td></tr>".format(
+                row, row * 7919))
+    lines.extend(["  </tbody>", "</table>", "</div>", ""])
+    return "\n".join(lines)
+
+
+def make_notebook(
+        cells=100,
+        output_size=200,
+        images=0,
+        image_size=50000,
+        dataframe_rows=0,
+        replacement_keys=(),
+):
+    """Generate a notebook with synthetic sources and outputs
+
+    Args:
+        cells (int): Number of code cells.
+        output_size (int): Characters of stream output per cell.
+        images (int): Number of cells with a PNG output.
+        image_size (int): Bytes per PNG output before encoding.
+        dataframe_rows (int):
+            Rows of dataframe HTML in each cell's output, or 0 for none.
+        replacement_keys (list(str)):
+            Strings to mention in the cell sources, so replacements match.
+    """
+    rng = random.Random(0)
+    image_data = base64.b64encode(
+        PNG_HEADER + bytes(rng.getrandbits(8) for _ in range(image_size))
+    ).decode("ascii")
+    html = make_dataframe_html(dataframe_rows) if dataframe_rows else None
+
+    notebook_node = nbformat.v4.new_notebook()
+    for index in range(cells):
+        source = ["value_{} = {}".format(index, index)]
+        if replacement_keys:
+            source.append("print({!r})".format(
+                replacement_keys[index % len(replacement_keys)]))
+        if index % 10 == 0:
+            source.insert(0, "# TEST_CELL")
+        cell = nbformat.v4.new_code_cell("\n".join(source))
+        cell.outputs.append(nbformat.v4.new_output(
+            "stream", text=("x" * 79 + "\n") * (output_size // 80)))
+        data = {"text/plain": "<Figure>"}
+        if index < images:
+            data["image/png"] = image_data
+        if html is not None:
+            data["text/html"] = html
+        if len(data) > 1:
+            cell.outputs.append(
+                nbformat.v4.new_output("display_data", data=data))
+        notebook_node.cells.append(cell)
+    return notebook_node
+
+
+def _replacements(count):
+    return {
+        "PLACEHOLDER_{:04d}".format(index): "value-{}".format(index)
+        for index in range(count)
+    }
+
+
+def bench_load(tmp_dir):
+    filepath = os.path.join(tmp_dir, "load.ipynb")
+    with open(filepath, "w") as notebook_file:
+        nbformat.write(
+            make_notebook(cells=2000, images=20, dataframe_rows=20),
+            notebook_file)
+    return lambda: utils.get_notebook_from_filepath(filepath)
+
+
+def bench_load_lazy(tmp_dir):
+    filepath = os.path.join(tmp_dir, "load_lazy.ipynb")
+    with open(filepath, "w") as notebook_file:
+        nbformat.write(
+            make_notebook(cells=2000, images=20, dataframe_rows=20),
+            notebook_file)
+    return lambda: utils.get_notebook_from_filepath(
+        filepath, lazy_outputs=True)
+
+
+def bench_replace_inputs(tmp_dir):
+    replacements = _replacements(500)
+    notebook_node = make_notebook(
+        cells=2000, replacement_keys=list(replacements))
+    processor = preprocessors.ReplaceCodeInputStringsPreprocessor(
+        string_replacements=replacements)
+    return lambda: processor.preprocess(
+        nbformat.from_dict(notebook_node), {})
+
+
+def bench_remove_tagged_cells(tmp_dir):
+    notebook_node = make_notebook(cells=20000, output_size=0)
+    cells = list(notebook_node.cells)
+    processor = preprocessors.RemoveTaggedCellsPreprocessor(
+        tag_string=["# TEST_CELL", "# SETUP_CELL"])
+
+    def run():
+        # The preprocessor only replaces the list of cells
+        notebook_node.cells = list(cells)
+        processor.preprocess(notebook_node, {})
+    return run
+
+
+def bs4_strip_styles(html):
+    # The original implementation, kept as the reference result
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup.find_all("style"):
+        tag.decompose()
+    for tag in soup.find_all(["table", "tr"]):
+        tag.attrs = {}
+    return str(soup)
+
+
+def _lines(text):
+    return [line.strip() for line in text.splitlines()]
+
+
+def bench_strip_styles(tmp_dir):
+    html = "".join(make_dataframe_html(200) for _ in range(50))
+    return lambda: styles.strip_styles(html)
+
+
+def bench_strip_styles_bs4(tmp_dir):
+    html = "".join(make_dataframe_html(200) for _ in range(50))
+    # BeautifulSoup also drops indentation inside tables, which does not
+    # change how the HTML renders
+    assert _lines(styles.strip_styles(html)) == _lines(bs4_strip_styles(html))
+    return lambda: bs4_strip_styles(html)
+
+
+def bench_replace_outputs(tmp_dir):
+    replacements = _replacements(500)
+    text = " ".join(
+        "{} lorem ipsum".format(key) for key in replacements) * 20
+    replacer = replace.as_replacer(replacements, regex=True)
+    return lambda: replacer.replace(text)
+
+
+def bench_export(tmp_dir):
+    notebook_node = make_notebook(cells=200, images=20, dataframe_rows=50)
+    exporter = export.Exporter()
+    output_dir = os.path.join(tmp_dir, "export")
+    return lambda: exporter.export_from_node(
+        notebook_node, "export", output_dir)
+
+
+def bench_export_streaming(tmp_dir):
+    notebook_node = make_notebook(cells=200, images=20, dataframe_rows=50)
+    exporter = export.Exporter(stream_outputs=True)
+    output_dir = os.path.join(tmp_dir, "export_streaming")
+    return lambda: exporter.export_from_node(
+        notebook_node, "export", output_dir)
+
+
+def bench_execute(tmp_dir):
+    notebook_node = utils.make_notebook_node(
+        ["value = {}\nprint(value)".format(index) for index in range(50)])
+    return lambda: utils.run_notebook_node(
+        nbformat.from_dict(notebook_node))
+
+
+BENCHMARKS = collections.OrderedDict([
+    ("load", bench_load),
+    ("load_lazy", bench_load_lazy),
+    ("replace_inputs", bench_replace_inputs),
+    ("remove_tagged_cells", bench_remove_tagged_cells),
+    ("strip_styles", bench_strip_styles),
+    ("strip_styles_bs4", bench_strip_styles_bs4),
+    ("replace_outputs", bench_replace_outputs),
+    ("export", bench_export),
+    ("export_streaming", bench_export_streaming),
+    ("execute", bench_execute),
+])
+
+
+def run_benchmarks(names, repeat, min_time=0.2):
+    """Run benchmarks and return the best time of each in seconds
+
+    Fast benchmarks are called several times per sample so each sample
+    takes at least ``min_time`` seconds, which keeps timer and scheduling
+    noise small relative to the measurement.
+    """
+    results = collections.OrderedDict()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for name in names:
+            run = BENCHMARKS[name](tmp_dir)
+            # The first call warms up caches and calibrates the loop count
+            start = time.perf_counter()
+            run()
+            number = max(1, int(min_time / (time.perf_counter() - start)))
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                for _ in range(number):
+                    run()
+                timings.append((time.perf_counter() - start) / number)
+            results[name] = min(timings)
+            print("{:<22} {:10.4f}s".format(name, results[name]))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the benchmarks slower than the baseline by over threshold"""
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        ratio = seconds / baseline[name]
+        print("{:<22} {:10.4f}s  baseline {:10.4f}s  {:6.2f}x".format(
+            name, seconds, baseline[name], ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help="Benchmarks to run (defaults to all): {}.".format(
+            ", ".join(BENCHMARKS)))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--baseline", help="JSON file of results to compare against.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown as a fraction of the baseline (default: "
+             "0.25).")
+    parser.add_argument("--save", help="Write the results to a JSON file.")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+
+    results = run_benchmarks(args.benchmarks or list(BENCHMARKS), args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump({"benchmarks": results}, results_file, indent=1)
+            results_file.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["benchmarks"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Slower than baseline: {}".format(", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1 +1,4 @@
 name = "nbsampleutils"
+
+# Key under which nbsampleutils stores its notebook and cell metadata
+METADATA_KEY = "nbsampleutils"
@@ -0,0 +1,290 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Utilities for executing many notebooks in parallel"""
+
+import asyncio
+import collections
+import concurrent.futures
+import glob
+import multiprocessing
+import os
+import time
+
+from nbsampleutils import deadlines
+from nbsampleutils import utils
+
+
+NotebookResult = collections.namedtuple(
+    "NotebookResult", ["filepath", "notebook_node", "error", "duration"])
+NotebookResult.__doc__ = """Outcome of executing a single notebook in a batch
+
+Attributes:
+    filepath (str): Path to the executed notebook.
+    notebook_node (nbformat.NotebookNode):
+        The executed notebook node, or :data:`None` if execution failed.
+    error (str):
+        Description of the error raised while executing the notebook, or
+        :data:`None` if execution succeeded.
+    duration (float):
+        Wall time in seconds spent executing the notebook. Notebooks
+        cancelled before they could report a result record 0.
+"""
+
+_CANCELLED_ERROR = "{}: Notebook execution was cancelled".format(
+    deadlines.ExecutionCancelled.__name__)
+
+
+def find_notebooks(paths):
+    """Expand directories and glob patterns into a list of notebook paths
+
+    Args:
+        paths (str or list(str)):
+            Notebook paths, directories to search recursively for `.ipynb`
+            files, or glob patterns (``**`` is supported).
+
+    Returns:
+        list(str): Sorted, de-duplicated list of notebook file paths.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+
+    filepaths = set()
+    for path in paths:
+        if os.path.isfile(path):
+            # Existing files are taken as-is, even if their names contain
+            # glob characters such as ``[``
+            filepaths.add(path)
+            continue
+        if os.path.isdir(path):
+            pattern = os.path.join(glob.escape(path), "**", "*.ipynb")
+        else:
+            pattern = path
+        for filepath in glob.glob(pattern, recursive=True):
+            if ".ipynb_checkpoints" in filepath.split(os.sep):
+                continue
+            filepaths.add(filepath)
+    return sorted(filepaths)
+
+
+def run_batch(
+        paths,
+        max_workers=None,
+        input_string_replacements=None,
+        fail_fast=False,
+        **execute_kwargs
+):
+    """Execute many notebooks in a pool of worker processes
+
+    Errors raised while executing a notebook (for example
+    ``CellExecutionError``) are recorded on that notebook's result instead of
+    aborting the rest of the batch, unless ``fail_fast`` is set.
+
+    Kernels are shut down without waiting for them to exit cleanly, unless
+    ``shutdown_kernel`` is passed in ``execute_kwargs``.
+
+    Args:
+        paths (str or list(str)):
+            Notebook paths, directories or glob patterns. See
+            :func:`find_notebooks`.
+        max_workers (int, optional):
+            Maximum number of notebooks to execute at once. Defaults to the
+            number of processors on the machine.
+        input_string_replacements (dict(str, str), optional):
+            Mapping of strings in cell inputs to replace before each notebook
+            is executed.
+        fail_fast (bool):
+            If :data:`True`, cancel the rest of the batch after the first
+            notebook fails. Notebooks already executing have their kernels
+            killed. Cancelled notebooks are recorded with an
+            ``ExecutionCancelled`` error.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to
+            :func:`nbsampleutils.utils.run_from_filepath`, such as
+            ``timeout`` and ``notebook_timeout``.
+
+    Returns:
+        list(NotebookResult): One result per notebook, in path order.
+    """
+    filepaths = find_notebooks(paths)
+    if not filepaths:
+        return []
+
+    execute_kwargs.setdefault("shutdown_kernel", "immediate")
+    manager = None
+    cancel_event = None
+    if fail_fast:
+        # A managed event can be shared with the worker processes
+        manager = multiprocessing.Manager()
+        cancel_event = manager.Event()
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    _run_notebook,
+                    filepath,
+                    input_string_replacements,
+                    cancel_event,
+                    execute_kwargs,
+                )
+                for filepath in filepaths
+            ]
+            if fail_fast:
+                for future in concurrent.futures.as_completed(futures):
+                    if future.result().error is not None:
+                        cancel_event.set()
+                        for other in futures:
+                            other.cancel()
+                        break
+            return [
+                _cancelled_result(filepath) if future.cancelled()
+                else future.result()
+                for filepath, future in zip(filepaths, futures)
+            ]
+    finally:
+        if manager is not None:
+            manager.shutdown()
+
+
+async def async_run_batch(
+        paths,
+        max_concurrency=8,
+        input_string_replacements=None,
+        fail_fast=False,
+        **execute_kwargs
+):
+    """Execute many notebooks concurrently on the running event loop
+
+    Unlike :func:`run_batch`, all kernels are driven from the current thread
+    with :func:`nbsampleutils.utils.async_run_from_filepath`. Cancelling the
+    batch shuts down the kernels of any notebooks still executing.
+
+    Kernels are shut down without waiting for them to exit cleanly, unless
+    ``shutdown_kernel`` is passed in ``execute_kwargs``.
+
+    Args:
+        paths (str or list(str)):
+            Notebook paths, directories or glob patterns. See
+            :func:`find_notebooks`.
+        max_concurrency (int):
+            Maximum number of notebooks to execute at once.
+        input_string_replacements (dict(str, str), optional):
+            Mapping of strings in cell inputs to replace before each notebook
+            is executed.
+        fail_fast (bool):
+            If :data:`True`, cancel the rest of the batch after the first
+            notebook fails. Cancelled notebooks are recorded with an
+            ``ExecutionCancelled`` error.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to
+            :func:`nbsampleutils.utils.async_run_from_filepath`, such as
+            ``timeout`` and ``notebook_timeout``.
+
+    Returns:
+        list(NotebookResult): One result per notebook, in path order.
+    """
+    execute_kwargs.setdefault("shutdown_kernel", "immediate")
+    semaphore = asyncio.Semaphore(max_concurrency)
+    filepaths = find_notebooks(paths)
+    if not fail_fast:
+        return await asyncio.gather(*[
+            _async_run_notebook(
+                filepath, semaphore, input_string_replacements, execute_kwargs)
+            for filepath in filepaths
+        ])
+
+    tasks = [
+        asyncio.ensure_future(_async_run_notebook(
+            filepath, semaphore, input_string_replacements, execute_kwargs))
+        for filepath in filepaths
+    ]
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(task.result().error is not None for task in done):
+                break
+    finally:
+        # Also runs if the batch itself is cancelled
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+    return [
+        _cancelled_result(filepath) if task.cancelled() else task.result()
+        for filepath, task in zip(filepaths, tasks)
+    ]
+
+
+async def _async_run_notebook(
+        filepath, semaphore, input_string_replacements, execute_kwargs):
+    start = time.perf_counter()
+    try:
+        notebook_node = await utils.async_run_from_filepath(
+            filepath,
+            input_string_replacements=input_string_replacements,
+            semaphore=semaphore,
+            **execute_kwargs)
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        return NotebookResult(
+            filepath=filepath,
+            notebook_node=None,
+            error="{}: {}".format(type(exc).__name__, exc),
+            duration=time.perf_counter() - start,
+        )
+    return NotebookResult(
+        filepath=filepath,
+        notebook_node=notebook_node,
+        error=None,
+        duration=time.perf_counter() - start,
+    )
+
+
+def _run_notebook(
+        filepath, input_string_replacements, cancel_event, execute_kwargs):
+    # Runs in a worker process. Exceptions are converted to strings because
+    # nbconvert's exception types do not all survive pickling.
+    start = time.perf_counter()
+    try:
+        notebook_node = utils.run_from_filepath(
+            filepath,
+            input_string_replacements=input_string_replacements,
+            cancel_event=cancel_event,
+            **execute_kwargs)
+    except Exception as exc:
+        return NotebookResult(
+            filepath=filepath,
+            notebook_node=None,
+            error="{}: {}".format(type(exc).__name__, exc),
+            duration=time.perf_counter() - start,
+        )
+    return NotebookResult(
+        filepath=filepath,
+        notebook_node=notebook_node,
+        error=None,
+        duration=time.perf_counter() - start,
+    )
+
+
+def _cancelled_result(filepath):
+    return NotebookResult(
+        filepath=filepath,
+        notebook_node=None,
+        error=_CANCELLED_ERROR,
+        duration=0.0,
+    )
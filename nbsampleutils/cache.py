@@ -0,0 +1,191 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""On-disk cache of executed notebooks"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import nbformat
+
+
+class ExecutionCache(object):
+    """Content-addressed store of executed notebook nodes
+
+    Entries are keyed by a hash of everything that determines the result of
+    executing a notebook: cell types, sources and tags, the input string
+    replacements, the kernel name, the execution options, and an optional
+    fingerprint of the environment (for example a hash of installed package
+    versions).
+
+    Args:
+        cache_dir (str): Directory to store executed notebooks in.
+        max_size (int, optional):
+            Maximum total size in bytes of the cache. The least recently used
+            entries are removed when it is exceeded.
+        max_age (float, optional):
+            Seconds since last use after which an entry is removed.
+        fingerprint (str, optional):
+            Environment fingerprint to include in every key.
+    """
+
+    def __init__(
+            self, cache_dir, max_size=None, max_age=None, fingerprint=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+        self.fingerprint = fingerprint
+
+    def key(
+            self,
+            notebook_node,
+            input_string_replacements=None,
+            kernel_name=None,
+            execute_kwargs=None,
+    ):
+        """Compute the cache key for executing a notebook
+
+        Args:
+            notebook_node (nbformat.NotebookNode):
+                The notebook before input strings are replaced.
+            input_string_replacements (dict(str, str), optional):
+                Mapping of strings in cell inputs to replace before the
+                notebook is executed.
+            kernel_name (str, optional):
+                Kernel to execute with. Defaults to the notebook's kernelspec.
+            execute_kwargs (dict, optional):
+                Options passed to the execute preprocessor.
+
+        Returns:
+            str: Hex digest identifying the execution.
+        """
+        if kernel_name is None:
+            kernel_name = notebook_node.metadata.get(
+                "kernelspec", {}).get("name")
+        cells = [
+            [cell.cell_type, cell.source, cell.metadata.get("tags", [])]
+            for cell in notebook_node.cells
+        ]
+        key_data = {
+            "cells": cells,
+            "replacements": sorted((input_string_replacements or {}).items()),
+            "kernel_name": kernel_name,
+            "execute_kwargs": sorted(
+                (name, repr(value))
+                for name, value in (execute_kwargs or {}).items()),
+            "fingerprint": self.fingerprint,
+        }
+        encoded = json.dumps(key_data, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def get(self, key):
+        """Return the executed notebook stored for ``key``
+
+        Args:
+            key (str): A key returned by :meth:`key`.
+
+        Returns:
+            nbformat.NotebookNode:
+                The stored executed notebook, or :data:`None` on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path) as notebook_file:
+                notebook_node = nbformat.read(notebook_file, as_version=4)
+        except (IOError, OSError):
+            return None
+
+        if self.max_age is not None:
+            if os.path.getmtime(path) < time.time() - self.max_age:
+                self._remove(path)
+                return None
+        # Mark the entry as recently used for size-based eviction
+        os.utime(path)
+        return notebook_node
+
+    def put(self, key, notebook_node):
+        """Store an executed notebook and evict old entries
+
+        Args:
+            key (str): A key returned by :meth:`key`.
+            notebook_node (nbformat.NotebookNode): The executed notebook.
+        """
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first so readers never see partial entries
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as notebook_file:
+                nbformat.write(notebook_node, notebook_file)
+            os.replace(temp_path, path)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Remove entries that are too old or exceed the size limit"""
+        entries = []
+        for path in self._entry_paths():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        if self.max_age is not None:
+            cutoff = time.time() - self.max_age
+            for mtime, _, path in entries:
+                if mtime < cutoff:
+                    self._remove(path)
+            entries = [entry for entry in entries if entry[0] >= cutoff]
+
+        if self.max_size is not None:
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                self._remove(path)
+                total_size -= size
+
+    def clear(self):
+        """Remove every entry from the cache"""
+        for path in self._entry_paths():
+            self._remove(path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".ipynb")
+
+    def _entry_paths(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for prefix in os.listdir(self.cache_dir):
+            directory = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if name.endswith(".ipynb"):
+                    yield os.path.join(directory, name)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
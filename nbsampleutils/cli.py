@@ -0,0 +1,585 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Command line interface for nbsampleutils"""
+
+import argparse
+import sys
+
+from nbsampleutils import batch
+from nbsampleutils import history
+from nbsampleutils import limits
+from nbsampleutils import profiling
+from nbsampleutils import schedule
+from nbsampleutils import shards
+from nbsampleutils import verify
+from nbsampleutils import watch
+
+
+def _parse_replacement(value):
+    old_text, separator, new_text = value.partition("=")
+    if not separator:
+        raise argparse.ArgumentTypeError(
+            "expected OLD=NEW, got {!r}".format(value))
+    return old_text, new_text
+
+
+def _parse_size(value):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    multiplier = units.get(value[-1:].upper(), 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        size = int(float(value) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected a size such as 500K or 2M, got {!r}".format(value))
+    if size < 0:
+        raise argparse.ArgumentTypeError("size must not be negative")
+    return size
+
+
+def _add_kernel_arguments(parser):
+    # Options shared by every command that executes notebooks
+    parser.add_argument(
+        "--replace",
+        metavar="OLD=NEW",
+        type=_parse_replacement,
+        action="append",
+        default=[],
+        help="Replace OLD with NEW in code cell inputs before executing.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=None,
+        help="Maximum time in seconds to wait for a single cell. Cells can "
+             "override it in their metadata.",
+    )
+    parser.add_argument(
+        "--kernel-name",
+        default=None,
+        help="Kernel to execute notebooks with (defaults to each notebook's "
+             "kernelspec).",
+    )
+    parser.add_argument(
+        "--allow-errors",
+        action="store_true",
+        help="Continue executing a notebook after a cell raises an error.",
+    )
+
+
+def _add_execute_arguments(parser):
+    _add_kernel_arguments(parser)
+    parser.add_argument(
+        "--notebook-timeout",
+        type=float,
+        default=None,
+        help="Maximum time in seconds to execute a whole notebook.",
+    )
+    parser.add_argument(
+        "--max-cell-output",
+        metavar="SIZE",
+        type=_parse_size,
+        default=None,
+        help="Truncate the outputs of a cell beyond SIZE bytes (K, M and G "
+             "suffixes are accepted).",
+    )
+    parser.add_argument(
+        "--max-notebook-output",
+        metavar="SIZE",
+        type=_parse_size,
+        default=None,
+        help="Truncate the outputs of a notebook beyond SIZE bytes.",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        default=None,
+        help="Write truncated outputs to files in SPILL_DIR instead of "
+             "discarding them.",
+    )
+
+
+def _kernel_kwargs(args):
+    execute_kwargs = {}
+    if args.timeout is not None:
+        execute_kwargs["timeout"] = args.timeout
+    if args.kernel_name is not None:
+        execute_kwargs["kernel_name"] = args.kernel_name
+    if args.allow_errors:
+        execute_kwargs["allow_errors"] = True
+    return execute_kwargs
+
+
+def _execute_kwargs(args):
+    execute_kwargs = _kernel_kwargs(args)
+    if args.notebook_timeout is not None:
+        execute_kwargs["notebook_timeout"] = args.notebook_timeout
+    if (args.max_cell_output is not None
+            or args.max_notebook_output is not None):
+        execute_kwargs["output_limits"] = limits.OutputLimits(
+            cell_bytes=args.max_cell_output,
+            notebook_bytes=args.max_notebook_output,
+            spill_dir=args.spill_dir,
+        )
+    elif args.spill_dir is not None:
+        raise SystemExit(
+            "--spill-dir requires --max-cell-output or --max-notebook-output")
+    return execute_kwargs
+
+
+def _run(args):
+    sharded = args.shard_count is not None
+    if sharded != (args.shard_index is not None):
+        raise SystemExit(
+            "--shard-index and --shard-count must be used together")
+    paths = args.paths
+    if sharded:
+        if args.dependencies:
+            raise SystemExit(
+                "--dependencies cannot be combined with sharding")
+        timings = shards.load_timings(args.timings) if args.timings else {}
+        try:
+            paths = shards.select_shard(
+                batch.find_notebooks(paths),
+                args.shard_index,
+                args.shard_count,
+                timings,
+            )
+        except ValueError as exc:
+            raise SystemExit(str(exc))
+        if not paths:
+            print("shard {} of {} is empty".format(
+                args.shard_index, args.shard_count))
+
+    if args.dependencies:
+        run = schedule.run_graph
+    else:
+        run = batch.run_batch
+    results = run(
+        paths,
+        max_workers=args.jobs,
+        input_string_replacements=dict(args.replace) or None,
+        fail_fast=args.fail_fast,
+        **_execute_kwargs(args))
+
+    if args.results:
+        shards.write_results(
+            results,
+            args.results,
+            shard_index=args.shard_index or 0,
+            shard_count=args.shard_count or 1,
+        )
+    if args.timings and not sharded:
+        shards.write_timings(results, args.timings)
+
+    failures = _report(results)
+    if args.history:
+        _record_history(results, args.history)
+    if args.dependencies and not failures:
+        path, total = schedule.critical_path(
+            schedule.build_graph([result.filepath for result in results]),
+            {result.filepath: result.duration for result in results})
+        print("critical path {:.2f}s: {}".format(total, " -> ".join(path)))
+    print("{} notebooks, {} failed".format(len(results), failures))
+    return 1 if failures else 0
+
+
+def _record_history(results, path):
+    with history.ResultStore(path) as store:
+        for result in results:
+            store.record_result(result)
+        for result in results:
+            for change in store.changes(result.filepath):
+                if change.kind == "duration":
+                    detail = "{:.2f}s -> {:.2f}s".format(
+                        change.baseline, change.current)
+                elif change.kind == "status":
+                    detail = "{} -> {}".format(change.baseline, change.current)
+                else:
+                    detail = "output changed"
+                print("CHANGED {}:{}  {}  {}".format(
+                    change.notebook, change.cell_index, change.kind, detail))
+
+
+def _report(results):
+    failures = 0
+    for result in results:
+        if result.error is None:
+            status = "ok"
+        else:
+            status = "FAILED"
+            failures += 1
+        print("{:<6} {:8.2f}s  {}".format(
+            status, result.duration, result.filepath))
+        if result.error is not None:
+            print("       {}".format(result.error.splitlines()[0]))
+        usage = None
+        if result.notebook_node is not None:
+            usage = limits.output_usage(result.notebook_node)
+        if usage is not None and usage.omitted_bytes:
+            print("       output truncated in {} cells, {} omitted".format(
+                len(usage.truncated_cells),
+                _format_bytes(usage.omitted_bytes)))
+    return failures
+
+
+def _merge(args):
+    try:
+        results = shards.merge_results(args.results)
+    except ValueError as exc:
+        raise SystemExit(str(exc))
+    if args.timings:
+        shards.write_timings(results, args.timings)
+    failures = _report(results)
+    print("{} notebooks, {} failed".format(len(results), failures))
+    return 1 if failures else 0
+
+
+def _verify(args):
+    normalizers = dict(verify.DEFAULT_NORMALIZERS)
+    normalizers.update(args.normalize)
+    results = verify.verify_batch(
+        args.paths,
+        max_workers=args.jobs,
+        normalizers=normalizers,
+        input_string_replacements=dict(args.replace) or None,
+        **_execute_kwargs(args))
+
+    failures = 0
+    for result in results:
+        if result.error is not None:
+            status = "FAILED"
+        elif result.diffs:
+            status = "DIFF"
+        else:
+            status = "ok"
+        if status != "ok":
+            failures += 1
+        print("{:<6} {:8.2f}s  {}".format(
+            status, result.duration, result.filepath))
+        if result.error is not None:
+            print("       {}".format(result.error.splitlines()[0]))
+        for diff in result.diffs:
+            print("       cell {}:".format(diff.cell_index))
+            for line in diff.diff.splitlines():
+                print("         {}".format(line))
+
+    print("{} notebooks, {} differ or failed".format(len(results), failures))
+    return 1 if failures else 0
+
+
+def _watch(args):
+    def on_build(result):
+        if result.error is not None:
+            status = "FAILED"
+        else:
+            status = "built"
+        print("{:<6} {:8.2f}s  {}".format(
+            status, result.duration, result.filepath))
+        if result.error is not None:
+            print("       {}".format(result.error.splitlines()[0]))
+        sys.stdout.flush()
+
+    try:
+        watcher = watch.NotebookWatcher(
+            args.root,
+            output_dir=args.output_dir,
+            execute=not args.no_execute,
+            input_string_replacements=dict(args.replace) or None,
+            debounce=args.debounce,
+            poll_interval=args.poll_interval,
+            use_inotify=False if args.poll else None,
+            **_kernel_kwargs(args))
+    except ImportError as exc:
+        raise SystemExit(str(exc))
+    print("watching {} (press Ctrl+C to stop)".format(args.root))
+    with watcher:
+        try:
+            watcher.watch(on_build=on_build)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    return "{:.2f}s".format(seconds)
+
+
+def _format_bytes(size):
+    if size is None:
+        return "-"
+    if size >= 1024 * 1024:
+        return "{:.1f}MB".format(size / (1024 * 1024))
+    if size >= 1024:
+        return "{:.1f}KB".format(size / 1024)
+    return "{}B".format(size)
+
+
+def _profile(args):
+    results = batch.run_batch(
+        args.paths,
+        max_workers=args.jobs,
+        input_string_replacements=dict(args.replace) or None,
+        profile=True,
+        **_execute_kwargs(args))
+
+    profiles = []
+    failures = 0
+    for result in results:
+        if result.error is not None:
+            failures += 1
+            print("FAILED {}".format(result.filepath))
+            print("       {}".format(result.error.splitlines()[0]))
+            continue
+        profiles.extend(profiling.cell_profiles(
+            result.notebook_node, filepath=result.filepath))
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            profiling.write_json(profiles, json_file)
+    if args.csv:
+        with open(args.csv, "w", newline="") as csv_file:
+            profiling.write_csv(profiles, csv_file)
+
+    print("{:>9} {:>9} {:>9} {:>9}  {}".format(
+        "wall", "queue", "memory", "output", "cell"))
+    for profile in profiling.slowest(profiles, args.top):
+        print("{:>9} {:>9} {:>9} {:>9}  {}:{}  {}".format(
+            _format_seconds(profile.wall_time),
+            _format_seconds(profile.queue_wait),
+            _format_bytes(profile.peak_memory),
+            _format_bytes(profile.output_size),
+            profile.filepath,
+            profile.cell_index,
+            profile.source[:40],
+        ))
+
+    print("{} cells in {} notebooks, {} failed".format(
+        len(profiles), len(results), failures))
+    return 1 if failures else 0
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog="nbsampleutils",
+        description="Run, test, and export sample/tutorial notebooks.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser(
+        "run", help="Execute notebooks in parallel.")
+    run_parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Notebook files, directories or glob patterns to execute.",
+    )
+    run_parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of notebooks to execute at once (defaults to the "
+             "number of processors).",
+    )
+    run_parser.add_argument(
+        "--dependencies",
+        action="store_true",
+        help="Execute notebooks after the notebooks they depend on, as "
+             "declared in their metadata.",
+    )
+    run_parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stop executing the remaining notebooks after the first "
+             "failure.",
+    )
+    run_parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=None,
+        help="Only execute the notebooks in this shard, counting from 0.",
+    )
+    run_parser.add_argument(
+        "--shard-count",
+        type=int,
+        default=None,
+        help="Number of shards to split the notebooks into.",
+    )
+    run_parser.add_argument(
+        "--timings",
+        metavar="FILE",
+        default=None,
+        help="JSON file of notebook runtimes. Shards are balanced using it, "
+             "and unsharded runs update it.",
+    )
+    run_parser.add_argument(
+        "--history",
+        metavar="FILE",
+        default=None,
+        help="Record the results in the SQLite database FILE and list cells "
+             "that got slower or whose output changed.",
+    )
+    run_parser.add_argument(
+        "--results",
+        metavar="FILE",
+        default=None,
+        help="Write the result of each notebook to FILE as JSON, for the "
+             "merge command.",
+    )
+    _add_execute_arguments(run_parser)
+    run_parser.set_defaults(func=_run)
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="Combine the results files of sharded runs.")
+    merge_parser.add_argument(
+        "results",
+        nargs="+",
+        help="Results files written by run --results.",
+    )
+    merge_parser.add_argument(
+        "--timings",
+        metavar="FILE",
+        default=None,
+        help="Update FILE with the runtimes of the merged notebooks.",
+    )
+    merge_parser.set_defaults(func=_merge)
+
+    verify_parser = subparsers.add_parser(
+        "verify",
+        help="Execute notebooks and compare their outputs with the outputs "
+             "saved in them.")
+    verify_parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Notebook files, directories or glob patterns to verify.",
+    )
+    verify_parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of notebooks to execute at once (defaults to the "
+             "number of processors).",
+    )
+    verify_parser.add_argument(
+        "--normalize",
+        metavar="PATTERN=REPLACEMENT",
+        type=_parse_replacement,
+        action="append",
+        default=[],
+        help="Replace matches of the regular expression PATTERN in outputs "
+             "before comparing them, in addition to the default normalizers "
+             "for addresses, timestamps and timings.",
+    )
+    _add_execute_arguments(verify_parser)
+    verify_parser.set_defaults(func=_verify)
+
+    profile_parser = subparsers.add_parser(
+        "profile", help="Execute notebooks and rank their slowest cells.")
+    profile_parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Notebook files, directories or glob patterns to execute.",
+    )
+    profile_parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=None,
+        help="Number of notebooks to execute at once (defaults to the "
+             "number of processors).",
+    )
+    profile_parser.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        help="Number of slowest cells to list (default: 20).",
+    )
+    profile_parser.add_argument(
+        "--json",
+        metavar="FILE",
+        default=None,
+        help="Write the profile of every executed cell to FILE as JSON.",
+    )
+    profile_parser.add_argument(
+        "--csv",
+        metavar="FILE",
+        default=None,
+        help="Write the profile of every executed cell to FILE as CSV.",
+    )
+    _add_execute_arguments(profile_parser)
+    profile_parser.set_defaults(func=_profile)
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Re-execute and re-export notebooks to markdown whenever they "
+             "change.")
+    watch_parser.add_argument(
+        "root",
+        help="Directory of notebooks to watch, including subdirectories.",
+    )
+    watch_parser.add_argument(
+        "-o", "--output-dir",
+        default=None,
+        help="Directory to write markdown files to (defaults to each "
+             "notebook's directory).",
+    )
+    watch_parser.add_argument(
+        "--no-execute",
+        action="store_true",
+        help="Export notebooks with their saved outputs instead of "
+             "executing them.",
+    )
+    watch_parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.5,
+        help="Seconds without changes to wait before rebuilding "
+             "(default: 0.5).",
+    )
+    watch_parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="Poll for changes even if inotify is available.",
+    )
+    watch_parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between checks for changes when polling "
+             "(default: 1).",
+    )
+    _add_kernel_arguments(watch_parser)
+    watch_parser.set_defaults(func=_watch)
+
+    return parser
+
+
+def main(argv=None):
+    """Entry point for the ``nbsampleutils`` command
+
+    Args:
+        argv (list(str), optional):
+            Command line arguments, not including the program name. Defaults
+            to ``sys.argv[1:]``.
+
+    Returns:
+        int: Exit status; non-zero if any notebook failed.
+    """
+    args = make_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
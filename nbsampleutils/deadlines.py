@@ -0,0 +1,189 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Cell timeouts, notebook deadlines and cancellation of execution"""
+
+import threading
+import time
+
+from nbclient.exceptions import CellTimeoutError
+
+from nbsampleutils import METADATA_KEY
+
+
+# Smallest timeout handed to nbclient, which treats 0 as "no timeout"
+_MIN_TIMEOUT = 0.01
+
+
+class ExecutionCancelled(Exception):
+    """Raised when execution of a notebook is cancelled"""
+
+
+class NotebookTimeoutError(CellTimeoutError):
+    """Raised when a notebook runs past its deadline"""
+
+
+def cell_timeout(cell, default=None):
+    """Return the timeout for a cell, honouring its metadata override
+
+    A cell can set its own timeout in seconds with
+    ``metadata["nbsampleutils"]["timeout"]``, for example for a known slow
+    training step. ``None`` or a negative value disables the timeout.
+
+    Args:
+        cell (nbformat.NotebookNode): The cell to execute.
+        default (float, optional): Timeout of cells without an override.
+
+    Returns:
+        float: Timeout in seconds, or :data:`None` for no timeout.
+    """
+    timeout = cell.get("metadata", {}).get(METADATA_KEY, {}).get(
+        "timeout", default)
+    if timeout is None or timeout < 0:
+        return None
+    return timeout
+
+
+class Deadline(object):
+    """Timeout policy for executing one notebook
+
+    Use :meth:`timeout_func` as nbclient's ``timeout_func``. Each cell gets
+    its own timeout (see :func:`cell_timeout`), shortened to the time left
+    before the notebook's deadline. Setting ``cancel_event`` stops the
+    notebook before its next cell starts; use :meth:`watch` to also stop a
+    cell that is already running.
+
+    Args:
+        cell_timeout (float, optional):
+            Default timeout in seconds for each cell.
+        notebook_timeout (float, optional):
+            Maximum time in seconds for the whole notebook, counted from
+            when the ``Deadline`` is created.
+        cancel_event (threading.Event, optional):
+            Event which cancels execution when set. Any object with
+            ``is_set()`` and ``wait(timeout)`` methods works, such as a
+            ``multiprocessing.Manager().Event()`` shared between processes.
+    """
+
+    def __init__(
+            self, cell_timeout=None, notebook_timeout=None, cancel_event=None):
+        self.cell_timeout = cell_timeout
+        self.notebook_timeout = notebook_timeout
+        self.cancel_event = cancel_event
+        if notebook_timeout is None:
+            self.expires = None
+        else:
+            self.expires = time.monotonic() + notebook_timeout
+
+    def check(self):
+        """Raise if execution was cancelled or the deadline has passed
+
+        Raises:
+            ExecutionCancelled: If ``cancel_event`` is set.
+            NotebookTimeoutError: If the notebook's deadline has passed.
+        """
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ExecutionCancelled("Notebook execution was cancelled")
+        if self.expired():
+            raise self._timeout_error()
+
+    def expired(self):
+        """Return whether the notebook's deadline has passed"""
+        return self.expires is not None and time.monotonic() >= self.expires
+
+    def _timeout_error(self):
+        return NotebookTimeoutError(
+            "Notebook execution timed out after {} seconds".format(
+                self.notebook_timeout))
+
+    def timeout_func(self, cell):
+        """Return the timeout for ``cell``, for use as nbclient's hook"""
+        self.check()
+        timeout = cell_timeout(cell, self.cell_timeout)
+        if self.expires is not None:
+            remaining = max(_MIN_TIMEOUT, self.expires - time.monotonic())
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+        return timeout
+
+    def watch(self, client):
+        """Watch the execution of a notebook for cancellation and timeouts
+
+        Returns a context manager to execute the notebook in. If
+        ``cancel_event`` is set, a watcher thread kills the kernel process
+        as soon as the event is set, so a hung cell fails at once with a
+        dead kernel instead of waiting for its timeout. The resulting error
+        is raised as :class:`ExecutionCancelled`, and a cell timing out
+        because the notebook ran out of time is raised as
+        :class:`NotebookTimeoutError`.
+
+        Args:
+            client (nbclient.NotebookClient): The client executing the
+                notebook.
+
+        Returns:
+            contextlib.AbstractContextManager: The watcher.
+        """
+        return _Watcher(self, client)
+
+
+class _Watcher(object):
+
+    # Seconds between checks of whether execution has finished
+    poll_interval = 0.1
+
+    def __init__(self, deadline, client):
+        self.deadline = deadline
+        self.client = client
+        self.cancelled = False
+        self._done = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.deadline.cancel_event is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+        if exc_type is None:
+            return
+        if self.cancelled:
+            raise ExecutionCancelled(
+                "Notebook execution was cancelled") from exc_value
+        if (issubclass(exc_type, CellTimeoutError)
+                and not issubclass(exc_type, NotebookTimeoutError)
+                and self.deadline.expired()):
+            raise self.deadline._timeout_error() from exc_value
+
+    def _run(self):
+        cancel_event = self.deadline.cancel_event
+        while not self._done.is_set():
+            if cancel_event.wait(self.poll_interval):
+                break
+        if self._done.is_set():
+            return
+        self.cancelled = True
+        _kill_kernel(self.client.km)
+
+
+def _kill_kernel(kernel_manager):
+    # Kill the kernel process directly, since the kernel manager belongs to
+    # the thread running the notebook's event loop
+    provisioner = getattr(kernel_manager, "provisioner", None)
+    process = getattr(provisioner, "process", None)
+    if process is not None:
+        process.kill()
@@ -13,17 +13,28 @@
 # limitations under the License.
 """Utilities for exporting notebooks to markdown"""
 
+import asyncio
+import functools
 import os
-import re
+import threading
 
-from bs4 import BeautifulSoup
 import nbconvert
+import traitlets.config
 
+from nbsampleutils import manifest as manifest_module
+from nbsampleutils import preprocessors
+from nbsampleutils import replace
+from nbsampleutils import styles
 from nbsampleutils import utils
 
 
 def export_from_filepath(
-    filepath, execute=False, output_dir=None, output_string_replacements=None
+    filepath,
+    execute=False,
+    output_dir=None,
+    output_string_replacements=None,
+    cache=None,
+    manifest=None,
 ):
     """Utility to export a given notebook to markdown
 
@@ -36,29 +47,115 @@ def export_from_filepath(
             Path to the directory to output the exported markdown file
         output_string_replacements (dict(str, str), optional):
             Mapping of strings to replace in the output file
+        cache (nbsampleutils.cache.ExecutionCache, optional):
+            Cache of executed notebooks to use when ``execute`` is
+            :data:`True`.
+        manifest (nbsampleutils.manifest.BuildManifest, optional):
+            Build manifest of the output directory. If given, the export is
+            skipped when the notebook file, ``execute`` and
+            ``output_string_replacements`` are unchanged since the recorded
+            export, and output files are only rewritten when their bytes
+            change.
     """
-    notebook_name, _ = os.path.splitext(os.path.basename(filepath))
-    notebook_path, _ = os.path.split(filepath)
+    _default_exporter.export_from_filepath(
+        filepath,
+        execute=execute,
+        output_dir=output_dir,
+        output_string_replacements=output_string_replacements,
+        cache=cache,
+        manifest=manifest,
+    )
+
+
+async def async_export_from_filepath(
+    filepath,
+    execute=False,
+    output_dir=None,
+    output_string_replacements=None,
+    semaphore=None,
+):
+    """Asynchronously export a given notebook to markdown
 
+    Args:
+        filepath (string): Path to the notebook file to export to markdown
+        execute (bool):
+            If :data:`True`, the notebook will be executed with
+            :func:`nbsampleutils.utils.async_run_from_filepath` before it is
+            exported to markdown. Defaults to :data:`false`.
+        output_dir (string):
+            Path to the directory to output the exported markdown file
+        output_string_replacements (dict(str, str), optional):
+            Mapping of strings to replace in the output file
+        semaphore (asyncio.Semaphore, optional):
+            Semaphore to hold while the notebook executes.
+    """
     if execute:
-        notebook_node = utils.run_from_filepath(filepath)
+        notebook_node = await utils.async_run_from_filepath(
+            filepath, semaphore=semaphore)
     else:
         notebook_node = utils.get_notebook_from_filepath(filepath)
 
+    md_name, output_dir = _output_location(filepath, output_dir)
+
+    await async_export_from_node(
+        notebook_node, md_name, output_dir, output_string_replacements)
+
+
+def _output_location(filepath, output_dir):
+    # Returns the markdown name and output directory for a notebook file
+    notebook_name, _ = os.path.splitext(os.path.basename(filepath))
+    notebook_path, _ = os.path.split(filepath)
+
     if output_dir is None:
         output_dir = notebook_path
 
     md_name = notebook_name.replace(" ", "-").lower()
-
-    export_from_node(
-        notebook_node, md_name, output_dir, output_string_replacements)
+    return md_name, output_dir
 
 
 def export_from_node(
-    notebook_node, md_name, output_dir, output_string_replacements=None
+    notebook_node,
+    md_name,
+    output_dir,
+    output_string_replacements=None,
+    manifest=None,
 ):
     """Utility to export a given notebook node to markdown
 
+    Args:
+        notebook_node (nbformat.NotebookNode):
+            Notebook node to convert to markdown
+        md_name (string):
+            Filename (without extension) for the exported markdown file
+        output_dir (string):
+            Path to the directory to output the exported markdown file
+        output_string_replacements (dict(str, str), optional):
+            Mapping of strings to replace in the output file. Keys are
+            regular expressions. A compiled
+            :class:`nbsampleutils.replace.StringReplacer` may be passed
+            instead to reuse it across exports.
+        manifest (nbsampleutils.manifest.BuildManifest, optional):
+            Build manifest of the output directory. If given, output files
+            are only rewritten when their bytes change, and resource files
+            from a previous export that are no longer produced are removed.
+    """
+    _default_exporter.export_from_node(
+        notebook_node,
+        md_name,
+        output_dir,
+        output_string_replacements,
+        manifest=manifest,
+    )
+
+
+async def async_export_from_node(
+    notebook_node, md_name, output_dir, output_string_replacements=None
+):
+    """Asynchronously export a given notebook node to markdown
+
+    Rendering is CPU bound, so it runs in the event loop's default executor
+    to keep the loop free for kernel I/O.
+
     Args:
         notebook_node (nbformat.NotebookNode):
             Notebook node to convert to markdown
@@ -69,32 +166,208 @@ def export_from_node(
         output_string_replacements (dict(str, str), optional):
             Mapping of strings to replace in the output file
     """
-    resources = {
-        "unique_key": md_name,
-        "output_files_dir": "{}-resources".format(md_name),
-    }
-    exporter = nbconvert.exporters.MarkdownExporter()
-    output, resources = exporter.from_notebook_node(
-        notebook_node, resources=resources)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, functools.partial(
+        export_from_node,
+        notebook_node,
+        md_name,
+        output_dir,
+        output_string_replacements=output_string_replacements,
+    ))
+
+
+class Exporter(object):
+    """Reusable session for exporting many notebooks to markdown
+
+    Creating an nbconvert exporter loads its Jinja templates and traitlets
+    configuration, which costs far more than rendering a small notebook. An
+    ``Exporter`` creates its markdown exporter and files writer once per
+    thread and reuses them for every export, so it is safe to share one
+    session between threads.
+
+    The module-level :func:`export_from_node` and
+    :func:`export_from_filepath` functions use a shared default session.
+
+    With ``stream_outputs``, images and other extracted outputs are written
+    to the ``<name>-resources`` directory one cell at a time as they are
+    decoded (see
+    :class:`nbsampleutils.preprocessors.SpillOutputsPreprocessor`), and only
+    their filenames are kept in memory. Peak memory then stays roughly
+    constant as the number of images in a notebook grows.
+
+    Args:
+        config (traitlets.config.Config, optional):
+            Configuration for the nbconvert exporter and writer.
+        stream_outputs (bool):
+            If :data:`True`, write extracted outputs as they are decoded
+            instead of collecting them all before writing. Defaults to
+            :data:`False`.
+    """
+
+    def __init__(self, config=None, stream_outputs=False):
+        self.config = config
+        self.stream_outputs = stream_outputs
+        self._local = threading.local()
+
+    @property
+    def markdown_exporter(self):
+        """nbconvert.exporters.MarkdownExporter: This thread's exporter"""
+        exporter = getattr(self._local, "markdown_exporter", None)
+        if exporter is None:
+            config = traitlets.config.Config(self.config or {})
+            if self.stream_outputs:
+                config.ExtractOutputPreprocessor.enabled = False
+            exporter = nbconvert.exporters.MarkdownExporter(config=config)
+            # GitHub ignores CSS styles, so strip them from cells
+            exporter.register_preprocessor(
+                preprocessors.StripStylesPreprocessor(), enabled=True)
+            if self.stream_outputs:
+                exporter.register_preprocessor(
+                    preprocessors.SpillOutputsPreprocessor(), enabled=True)
+            self._local.markdown_exporter = exporter
+        return exporter
+
+    @property
+    def writer(self):
+        """nbconvert.writers.FilesWriter: This thread's files writer"""
+        writer = getattr(self._local, "writer", None)
+        if writer is None:
+            writer = nbconvert.writers.files.FilesWriter(config=self.config)
+            self._local.writer = writer
+        return writer
+
+    def export_from_filepath(
+        self,
+        filepath,
+        execute=False,
+        output_dir=None,
+        output_string_replacements=None,
+        cache=None,
+        manifest=None,
+    ):
+        """Export a given notebook to markdown
+
+        See :func:`nbsampleutils.export.export_from_filepath`.
+        """
+        md_name, output_dir = _output_location(filepath, output_dir)
 
-    # Strip CSS styles from output because they are ignored for GitHub render
-    output = strip_styles(output)
+        inputs_hash = None
+        if manifest is not None:
+            inputs_hash = manifest_module.hash_inputs(
+                filepath, execute, output_string_replacements)
+            if manifest.is_current(output_dir, md_name, inputs_hash):
+                return
 
-    # Make output string replacements, if any
-    if output_string_replacements:
-        for old_text, new_text in output_string_replacements.items():
-            output = re.sub(old_text, new_text, output)
+        if execute:
+            notebook_node = utils.run_from_filepath(filepath, cache=cache)
+        else:
+            notebook_node = utils.get_notebook_from_filepath(filepath)
 
-    writer = nbconvert.writers.files.FilesWriter(build_directory=output_dir)
-    writer.write(output, resources, notebook_name=md_name)
+        self._export(
+            notebook_node,
+            md_name,
+            output_dir,
+            output_string_replacements,
+            manifest,
+            inputs_hash,
+        )
+
+    def export_from_node(
+        self,
+        notebook_node,
+        md_name,
+        output_dir,
+        output_string_replacements=None,
+        manifest=None,
+        inputs_hash=None,
+    ):
+        """Export a given notebook node to markdown
+
+        See :func:`nbsampleutils.export.export_from_node`. If ``manifest``
+        is given, ``inputs_hash`` (see
+        :func:`nbsampleutils.manifest.hash_inputs`) is recorded for the
+        export.
+        """
+        self._export(
+            notebook_node,
+            md_name,
+            output_dir,
+            output_string_replacements,
+            manifest,
+            inputs_hash,
+        )
+
+    def _export(
+        self,
+        notebook_node,
+        md_name,
+        output_dir,
+        output_string_replacements,
+        manifest,
+        inputs_hash,
+    ):
+        resources = {
+            "unique_key": md_name,
+            "output_files_dir": "{}-resources".format(md_name),
+        }
+        if manifest is not None:
+            files = manifest.open_export(output_dir, md_name, inputs_hash)
+        elif self.stream_outputs:
+            files = _DirectoryWriter(output_dir)
+        else:
+            files = None
+        if self.stream_outputs:
+            resources["output_writer"] = files
+
+        output, resources = self.markdown_exporter.from_notebook_node(
+            notebook_node, resources=resources)
+
+        # Make output string replacements, if any
+        if output_string_replacements:
+            replacer = replace.as_replacer(
+                output_string_replacements, regex=True)
+            output = replacer.replace(output)
+
+        if files is None:
+            writer = self.writer
+            writer.build_directory = output_dir
+            writer.write(output, resources, notebook_name=md_name)
+            return
+
+        with files:
+            if not self.stream_outputs:
+                for filename, data in resources.get("outputs", {}).items():
+                    files.write(filename, data)
+            markdown_filename = (
+                md_name + resources.get("output_extension", ""))
+            files.write(markdown_filename, output.encode("utf-8"))
+
+
+class _DirectoryWriter(object):
+    # Writes files below a directory as they are produced
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def write(self, filename, data):
+        path = os.path.join(self.output_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as output_file:
+            output_file.write(data)
+
+
+_default_exporter = Exporter()
 
 
 def strip_styles(html):
-    soup = BeautifulSoup(html, "html.parser")
-    # Completely remove style tags and contents
-    for tag in soup.find_all("style"):
-        tag.decompose()
-    # Remove all tag attributes from tables (removes dataframe styles)
-    for tag in soup.find_all(["table", "tr"]):
-        tag.attrs = {}
-    return str(soup)
+    """Remove CSS styling from HTML embedded in a markdown document
+
+    See :func:`nbsampleutils.styles.strip_styles`.
+    """
+    return styles.strip_styles(html)
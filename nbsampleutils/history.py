@@ -0,0 +1,445 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""History of notebook executions, for spotting slow or drifting cells"""
+
+import collections
+import datetime
+import hashlib
+import json
+import sqlite3
+import statistics
+import time
+
+from jupyter_client.jsonutil import parse_date
+
+from nbsampleutils import METADATA_KEY
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    notebook TEXT NOT NULL,
+    notebook_hash INTEGER,
+    started REAL NOT NULL,
+    duration REAL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_notebook ON runs (notebook, started);
+CREATE INDEX IF NOT EXISTS runs_by_started ON runs (started);
+CREATE TABLE IF NOT EXISTS cells (
+    run_id INTEGER NOT NULL,
+    cell_index INTEGER NOT NULL,
+    source_hash INTEGER NOT NULL,
+    duration REAL,
+    output_hash INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (run_id, cell_index)
+) WITHOUT ROWID;
+"""
+
+
+RunRecord = collections.namedtuple(
+    "RunRecord",
+    ["run_id", "notebook", "notebook_hash", "started", "duration", "status"],
+)
+RunRecord.__doc__ = """A recorded execution of a notebook
+
+Attributes:
+    run_id (int): Identifier of the run in the store.
+    notebook (str): Name of the notebook, usually its path.
+    notebook_hash (int):
+        Hash of the notebook's code cell sources, or :data:`None` if the
+        notebook could not be read.
+    started (float): Start time of the run, in seconds since the epoch.
+    duration (float): Seconds the run took, or :data:`None` if not known.
+    status (str): ``"ok"`` or ``"error"``.
+"""
+
+CellRecord = collections.namedtuple(
+    "CellRecord",
+    [
+        "run_id",
+        "started",
+        "cell_index",
+        "source_hash",
+        "duration",
+        "output_hash",
+        "status",
+    ],
+)
+CellRecord.__doc__ = """A recorded execution of a code cell
+
+Attributes:
+    run_id (int): Identifier of the run in the store.
+    started (float): Start time of the run, in seconds since the epoch.
+    cell_index (int): Index of the cell in the notebook.
+    source_hash (int): Hash of the cell's source.
+    duration (float): Seconds the cell took, or :data:`None` if not known.
+    output_hash (int): Hash of the cell's outputs.
+    status (str): ``"ok"`` or ``"error"`` if the cell has an error output.
+"""
+
+CellChange = collections.namedtuple(
+    "CellChange",
+    ["notebook", "run_id", "cell_index", "kind", "baseline", "current"],
+)
+CellChange.__doc__ = """A cell whose latest run differs from its history
+
+Attributes:
+    notebook (str): Name of the notebook.
+    run_id (int): The latest run of the notebook.
+    cell_index (int): Index of the cell in the notebook.
+    kind (str):
+        ``"duration"`` if the cell got slower, ``"output"`` if its outputs
+        changed, or ``"status"`` if it started raising an error.
+    baseline: Median duration, previous output hash, or previous status.
+    current: Duration, output hash, or status in the latest run.
+"""
+
+
+def _hash(data):
+    # 64-bit hashes are stored as SQLite integers, which take at most 8 bytes
+    digest = hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _output_hash(outputs):
+    # Execution counts change from run to run without the output changing
+    stable = [
+        {key: value for key, value in output.items()
+         if key != "execution_count"}
+        for output in outputs
+    ]
+    return _hash(json.dumps(stable, sort_keys=True))
+
+
+def _timestamp(value):
+    if isinstance(value, str):
+        value = parse_date(value)
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return None
+
+
+def _cell_duration(cell):
+    profile = cell.metadata.get(METADATA_KEY, {}).get("profile", {})
+    if profile.get("wall_time") is not None:
+        return profile["wall_time"]
+    execution = cell.metadata.get("execution", {})
+    start = _timestamp(execution.get("iopub.execute_input"))
+    end = _timestamp(execution.get("shell.execute_reply"))
+    if start is None or end is None:
+        return None
+    return end - start
+
+
+def notebook_hash(notebook_node):
+    """Return a hash of the code cell sources of a notebook
+
+    Args:
+        notebook_node (nbformat.NotebookNode): A notebook.
+
+    Returns:
+        int: A 64-bit hash.
+    """
+    sources = [
+        cell.source for cell in notebook_node.cells
+        if cell.cell_type == "code"
+    ]
+    return _hash(json.dumps(sources))
+
+
+class ResultStore(object):
+    """SQLite database of notebook runs and per-cell results
+
+    Each run records a hash of the notebook's sources, its status and
+    duration, and for every executed code cell the hashes of its source and
+    outputs, its status and its duration. Cell durations come from the
+    profile recorded with ``profile=True`` or, by default, from the
+    execution timestamps nbclient stores in cell metadata. Only hashes are
+    stored, so queries never read the notebooks again.
+
+    Use the store as a context manager, or call :meth:`close` when done::
+
+        with ResultStore("history.sqlite") as store:
+            notebook_node = utils.run_from_filepath(
+                "sample.ipynb", result_store=store)
+            for change in store.changes("sample.ipynb"):
+                print(change)
+
+    Args:
+        path (str): Database file. It is created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the database connection"""
+        self._connection.close()
+
+    def record(
+            self,
+            notebook,
+            notebook_node=None,
+            status="ok",
+            duration=None,
+            started=None,
+    ):
+        """Record a run of a notebook
+
+        Args:
+            notebook (str): Name of the notebook, usually its path.
+            notebook_node (nbformat.NotebookNode, optional):
+                The executed notebook. Cells without an execution count are
+                not recorded. If :data:`None`, only the run is recorded.
+            status (str): ``"ok"`` or ``"error"``.
+            duration (float, optional): Seconds the run took.
+            started (float, optional):
+                Start time in seconds since the epoch. Defaults to now minus
+                ``duration``.
+
+        Returns:
+            int: Identifier of the run.
+        """
+        if started is None:
+            started = time.time() - (duration or 0.0)
+        cells = []
+        if notebook_node is not None:
+            for cell_index, cell in enumerate(notebook_node.cells):
+                if (cell.cell_type != "code"
+                        or cell.get("execution_count") is None):
+                    continue
+                outputs = cell.get("outputs", [])
+                errored = any(
+                    output.get("output_type") == "error"
+                    for output in outputs)
+                cells.append((
+                    cell_index,
+                    _hash(cell.source),
+                    _cell_duration(cell),
+                    _output_hash(outputs),
+                    "error" if errored else "ok",
+                ))
+
+        with self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO runs "
+                "(notebook, notebook_hash, started, duration, status) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    notebook,
+                    None if notebook_node is None
+                    else notebook_hash(notebook_node),
+                    started,
+                    duration,
+                    status,
+                ),
+            )
+            run_id = cursor.lastrowid
+            self._connection.executemany(
+                "INSERT INTO cells (run_id, cell_index, source_hash, "
+                "duration, output_hash, status) VALUES (?, ?, ?, ?, ?, ?)",
+                [(run_id,) + cell for cell in cells],
+            )
+        return run_id
+
+    def record_result(self, result):
+        """Record the result of a batch run
+
+        Args:
+            result (nbsampleutils.batch.NotebookResult): A notebook's result.
+
+        Returns:
+            int: Identifier of the run.
+        """
+        return self.record(
+            result.filepath,
+            result.notebook_node,
+            status="ok" if result.error is None else "error",
+            duration=result.duration,
+        )
+
+    def notebooks(self):
+        """Return the names of all recorded notebooks, sorted"""
+        return [row[0] for row in self._connection.execute(
+            "SELECT DISTINCT notebook FROM runs ORDER BY notebook")]
+
+    def runs(self, notebook=None, since=None, limit=None):
+        """Return recorded runs, most recent first
+
+        Args:
+            notebook (str, optional): Only return runs of this notebook.
+            since (float, optional):
+                Only return runs started at or after this time, in seconds
+                since the epoch.
+            limit (int, optional): Maximum number of runs to return.
+
+        Returns:
+            list(RunRecord): The runs.
+        """
+        conditions = []
+        parameters = []
+        if notebook is not None:
+            conditions.append("notebook = ?")
+            parameters.append(notebook)
+        if since is not None:
+            conditions.append("started >= ?")
+            parameters.append(since)
+        query = "SELECT * FROM runs"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY started DESC, id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        return [
+            RunRecord(*row)
+            for row in self._connection.execute(query, parameters)
+        ]
+
+    def cells(self, run_id):
+        """Return the recorded cells of a run, in notebook order
+
+        Args:
+            run_id (int): Identifier of the run.
+
+        Returns:
+            list(CellRecord): The cells.
+        """
+        return [CellRecord(*row) for row in self._connection.execute(
+            "SELECT cells.run_id, runs.started, cell_index, source_hash, "
+            "cells.duration, output_hash, cells.status "
+            "FROM cells JOIN runs ON runs.id = cells.run_id "
+            "WHERE run_id = ? ORDER BY cell_index",
+            (run_id,))]
+
+    def cell_history(self, notebook, cell_index, limit=None):
+        """Return the recorded runs of one cell, most recent first
+
+        Args:
+            notebook (str): Name of the notebook.
+            cell_index (int): Index of the cell.
+            limit (int, optional): Maximum number of runs to return.
+
+        Returns:
+            list(CellRecord): The cell's results.
+        """
+        query = (
+            "SELECT cells.run_id, runs.started, cell_index, source_hash, "
+            "cells.duration, output_hash, cells.status "
+            "FROM runs JOIN cells ON cells.run_id = runs.id "
+            "WHERE runs.notebook = ? AND cells.cell_index = ? "
+            "ORDER BY runs.started DESC, runs.id DESC")
+        parameters = [notebook, cell_index]
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        return [
+            CellRecord(*row)
+            for row in self._connection.execute(query, parameters)
+        ]
+
+    def changes(
+            self,
+            notebook=None,
+            window=10,
+            threshold=0.5,
+            min_duration=0.1,
+    ):
+        """Find cells whose latest run differs from their recent history
+
+        The latest run of each notebook is compared with up to ``window``
+        earlier runs. Cells are only compared with earlier runs of the same
+        source, so editing a cell does not count as a change.
+
+        Args:
+            notebook (str, optional):
+                Only check this notebook. Defaults to every notebook.
+            window (int): Number of earlier runs to compare against.
+            threshold (float):
+                Flag cells slower than the median of earlier runs by more
+                than this fraction.
+            min_duration (float):
+                Ignore slowdowns of fewer seconds than this, which are
+                usually noise.
+
+        Returns:
+            list(CellChange): The changed cells.
+        """
+        if notebook is None:
+            notebooks = self.notebooks()
+        else:
+            notebooks = [notebook]
+
+        changes = []
+        for name in notebooks:
+            run_ids = [row[0] for row in self._connection.execute(
+                "SELECT id FROM runs WHERE notebook = ? "
+                "ORDER BY started DESC, id DESC LIMIT ?",
+                (name, window + 1))]
+            if len(run_ids) < 2:
+                continue
+            latest = run_ids[0]
+            age = {run_id: index for index, run_id in enumerate(run_ids)}
+            history = collections.defaultdict(list)
+            current = {}
+            rows = self._connection.execute(
+                "SELECT run_id, cell_index, source_hash, duration, "
+                "output_hash, status FROM cells WHERE run_id IN ({})".format(
+                    ", ".join("?" * len(run_ids))),
+                run_ids)
+            for row in rows:
+                run_id = row[0]
+                # Only compare runs of the same cell source
+                key = (row[1], row[2])
+                if run_id == latest:
+                    current[key] = row[3:]
+                else:
+                    history[key].append((age[run_id],) + row[3:])
+
+            for key in sorted(current):
+                if key not in history:
+                    continue
+                duration, output, status = current[key]
+                earlier = sorted(history[key])
+                _, _, previous_output, previous_status = earlier[0]
+                durations = [
+                    value for _, value, _, _ in earlier if value is not None]
+                cell_index = key[0]
+                if status != previous_status and status == "error":
+                    changes.append(CellChange(
+                        name, latest, cell_index, "status",
+                        previous_status, status))
+                elif output != previous_output:
+                    changes.append(CellChange(
+                        name, latest, cell_index, "output",
+                        previous_output, output))
+                if duration is not None and durations:
+                    baseline = statistics.median(durations)
+                    if (duration > baseline * (1 + threshold)
+                            and duration - baseline >= min_duration):
+                        changes.append(CellChange(
+                            name, latest, cell_index, "duration",
+                            baseline, duration))
+        return changes
@@ -0,0 +1,259 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental re-execution of notebooks from the first changed cell"""
+
+import hashlib
+import json
+import os
+
+from jupyter_client.manager import KernelManager
+import nbclient
+from nbclient.exceptions import CellExecutionError
+import nbformat
+
+from nbsampleutils import kernels
+from nbsampleutils import preprocessors
+
+
+def cell_hashes(notebook_node, input_string_replacements=None):
+    """Compute a chained hash for every cell in a notebook
+
+    The hash of each code cell covers its own source and the sources of all
+    code cells before it, so a cell's hash changes whenever the cell or any
+    earlier code cell changes. Other cell types share the hash of the code
+    cell before them.
+
+    Args:
+        notebook_node (nbformat.NotebookNode): The notebook to hash.
+        input_string_replacements (dict(str, str), optional):
+            Replacements that are applied to the notebook before execution.
+
+    Returns:
+        list(str): One hex digest per cell.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(
+        sorted((input_string_replacements or {}).items())).encode("utf-8"))
+    current = digest.hexdigest()
+
+    hashes = []
+    for cell in notebook_node.cells:
+        if cell.cell_type == "code":
+            digest = hashlib.sha256(current.encode("utf-8"))
+            digest.update(cell.source.encode("utf-8"))
+            current = digest.hexdigest()
+        hashes.append(current)
+    return hashes
+
+
+class IncrementalRunner(object):
+    """Executes a notebook, re-running only cells that changed since last run
+
+    The runner keeps a kernel alive between calls to :meth:`run` and records
+    the outputs of every executed code cell by its chained hash (see
+    :func:`cell_hashes`). On the next run, cells whose hash was recorded get
+    their stored outputs back and execution starts at the first code cell
+    whose source, or any earlier code cell's source, changed.
+
+    If the live kernel has not executed the unchanged prefix (for example
+    after a restart of the process, or when an earlier cell changed), the
+    kernel is restarted and the prefix is replayed before execution
+    continues. The outputs of the replay are discarded and the stored outputs
+    of the prefix are kept, but the replay advances the kernel's execution
+    count, so the following cells are numbered as in a fresh run.
+
+    Args:
+        state_path (str, optional):
+            JSON file in which to persist the recorded outputs between
+            processes. Defaults to keeping them in memory only.
+        notebook_path (str, optional):
+            Working directory for the kernel.
+        kernel_name (str, optional):
+            Kernel to execute with. Defaults to the notebook's kernelspec.
+        strict (bool):
+            If :data:`True` (the default), the kernel is restarted and the
+            prefix replayed whenever the kernel has executed cells beyond the
+            unchanged prefix, so outputs match a fresh run. If
+            :data:`False`, changed cells are executed on top of the kernel's
+            existing state, as when re-running a cell in Jupyter. Outputs of
+            cells executed that way are not recorded, because they depend on
+            cells that ran before.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to ``nbclient.NotebookClient``.
+    """
+
+    def __init__(
+            self,
+            state_path=None,
+            notebook_path=None,
+            kernel_name=None,
+            strict=True,
+            **execute_kwargs
+    ):
+        self.state_path = state_path
+        self.notebook_path = notebook_path
+        self.kernel_name = kernel_name
+        self.strict = strict
+        self.execute_kwargs = execute_kwargs
+        self.executed_from = None
+        self._kernel_manager = None
+        # Chained hashes of the code cells the live kernel has executed
+        self._kernel_history = []
+        self._outputs = self._load_state()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def run(self, notebook_node, input_string_replacements=None):
+        """Execute the cells of a notebook that changed since the last run
+
+        Args:
+            notebook_node (nbformat.v4.NotebookNode):
+                A notebook node to execute. It is modified in place.
+            input_string_replacements (dict(str, str), optional):
+                Mapping of strings in cell inputs to replace before the
+                notebook is executed.
+
+        Returns:
+            nbformat.NotebookNode: The executed notebook node.
+        """
+        hashes = cell_hashes(notebook_node, input_string_replacements)
+
+        if self.notebook_path:
+            resources = {"metadata": {"path": self.notebook_path}}
+        else:
+            resources = {}
+        if input_string_replacements:
+            preprocessor = preprocessors.ReplaceCodeInputStringsPreprocessor(
+                string_replacements=input_string_replacements
+            )
+            preprocessor.preprocess(notebook_node, resources)
+
+        start = self._restore_outputs(notebook_node, hashes)
+        self.executed_from = start
+        if start == len(notebook_node.cells):
+            return notebook_node
+
+        client = nbclient.NotebookClient(
+            notebook_node,
+            km=self._get_kernel_manager(notebook_node),
+            resources=resources,
+            **self.execute_kwargs)
+        try:
+            with client.setup_kernel():
+                record = self._prepare_kernel(client, hashes, start)
+                for index in range(start, len(notebook_node.cells)):
+                    cell = notebook_node.cells[index]
+                    if cell.cell_type != "code":
+                        continue
+                    self._kernel_history.append(hashes[index])
+                    cell = client.execute_cell(cell, index, store_history=True)
+                    if record:
+                        self._outputs[hashes[index]] = {
+                            "outputs": cell.outputs,
+                            "execution_count": cell.execution_count,
+                        }
+        finally:
+            if client.kc is not None:
+                client.kc.stop_channels()
+            self._save_state(hashes)
+
+        return notebook_node
+
+    def shutdown(self):
+        """Shut down the runner's kernel"""
+        if self._kernel_manager is not None:
+            self._kernel_manager.shutdown_kernel(now=True)
+            self._kernel_manager = None
+        self._kernel_history = []
+
+    def _restore_outputs(self, notebook_node, hashes):
+        # Returns the index of the first cell that must be executed
+        for index, cell in enumerate(notebook_node.cells):
+            if cell.cell_type != "code":
+                continue
+            recorded = self._outputs.get(hashes[index])
+            if recorded is None:
+                return index
+            cell.outputs = nbformat.from_dict(recorded["outputs"])
+            cell.execution_count = recorded["execution_count"]
+        return len(notebook_node.cells)
+
+    def _get_kernel_manager(self, notebook_node):
+        if self._kernel_manager is None:
+            kernel_name = (
+                self.kernel_name
+                or notebook_node.metadata.get("kernelspec", {}).get("name")
+                or kernels.DEFAULT_KERNEL_NAME
+            )
+            self._kernel_manager = KernelManager(kernel_name=kernel_name)
+            self._kernel_history = []
+        return self._kernel_manager
+
+    def _prepare_kernel(self, client, hashes, start):
+        # Bring the kernel to the state after the unchanged prefix. Returns
+        # whether the kernel has executed exactly the prefix, so outputs of
+        # the following cells can be recorded under their chained hashes.
+        prefix = [
+            index for index in range(start)
+            if client.nb.cells[index].cell_type == "code"
+        ]
+        prefix_hash = hashes[prefix[-1]] if prefix else None
+        if prefix_hash is None:
+            exact = not self._kernel_history
+        else:
+            exact = self._kernel_history[-1:] == [prefix_hash]
+        if exact:
+            return True
+        if not self.strict and prefix_hash in self._kernel_history:
+            return False
+
+        if self._kernel_history:
+            self._kernel_manager.restart_kernel(now=True)
+            client.kc.wait_for_ready(timeout=client.startup_timeout)
+            self._kernel_history = []
+
+        for index in prefix:
+            cell = client.nb.cells[index]
+            self._kernel_history.append(hashes[index])
+            # Not silent, so the execution count advances as in a fresh run.
+            # The client ignores the outputs, which belong to another request.
+            msg_id = client.kc.execute(cell.source, store_history=True)
+            reply = client.wait_for_reply(msg_id, cell)
+            if reply is not None and reply["content"]["status"] == "error":
+                raise CellExecutionError.from_cell_and_msg(
+                    cell, reply["content"])
+        return True
+
+    def _load_state(self):
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as state_file:
+            return json.load(state_file)["cells"]
+
+    def _save_state(self, hashes):
+        # Only keep outputs for cells that are still in the notebook
+        current = set(hashes)
+        self._outputs = {
+            cell_hash: recorded
+            for cell_hash, recorded in self._outputs.items()
+            if cell_hash in current
+        }
+        if self.state_path is None:
+            return
+        with open(self.state_path, "w") as state_file:
+            json.dump({"cells": self._outputs}, state_file)
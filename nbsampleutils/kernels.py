@@ -0,0 +1,287 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Pool of pre-started Jupyter kernels"""
+
+import collections
+import contextlib
+import os
+import threading
+import time
+
+from jupyter_client.manager import KernelManager
+from nbconvert.preprocessors.execute import CellExecutionError
+
+
+DEFAULT_KERNEL_NAME = "python3"
+
+_PooledKernel = collections.namedtuple(
+    "_PooledKernel", ["kernel_manager", "uses", "idle_since"])
+
+
+class KernelPool(object):
+    """Pool of warm kernels that can be reused between notebook executions
+
+    Kernels are started ahead of time (or on first use) and handed out by
+    :meth:`acquire`. When a kernel is given back with :meth:`release`, its
+    namespace is reset so the next notebook starts from a clean state. Kernels
+    that fail to reset, that have been used ``max_uses`` times, or that have
+    been idle for longer than ``max_idle`` seconds are shut down and replaced.
+
+    The default reset and change-directory code assume IPython kernels.
+
+    Args:
+        max_size (int):
+            Maximum number of idle kernels to keep per kernel name.
+        max_idle (float, optional):
+            Seconds a kernel may sit idle in the pool before it is shut down.
+            :data:`None` keeps idle kernels indefinitely.
+        max_uses (int, optional):
+            Number of notebooks a kernel may execute before it is replaced
+            with a fresh one. :data:`None` reuses kernels indefinitely.
+        startup_timeout (float):
+            Seconds to wait for a newly started kernel to become ready.
+        reset_code (str):
+            Code executed in a kernel when it is released to clear its
+            namespace and restart its execution count, so notebooks run on
+            a reused kernel match notebooks run on a fresh one.
+        chdir_code (str):
+            Code template executed when a kernel is acquired to change the
+            kernel's working directory. ``{path!r}`` is replaced with the
+            directory.
+    """
+
+    def __init__(
+            self,
+            max_size=4,
+            max_idle=600,
+            max_uses=None,
+            startup_timeout=60,
+            reset_code=(
+                "%reset -f\n"
+                "get_ipython().execution_count = 1"
+            ),
+            chdir_code='__import__("os").chdir({path!r})',
+    ):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.startup_timeout = startup_timeout
+        self.reset_code = reset_code
+        self.chdir_code = chdir_code
+        self._default_cwd = os.getcwd()
+        self._idle = collections.defaultdict(list)
+        self._in_use = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def prestart(self, kernel_name=DEFAULT_KERNEL_NAME, count=1):
+        """Start kernels ahead of time so the first notebooks don't wait
+
+        Args:
+            kernel_name (str): Name of the kernelspec to start.
+            count (int):
+                Number of kernels to start, capped at ``max_size`` idle
+                kernels.
+        """
+        for _ in range(count):
+            with self._lock:
+                if len(self._idle[kernel_name]) >= self.max_size:
+                    return
+            kernel_manager = self._start_kernel(kernel_name)
+            with self._lock:
+                self._idle[kernel_name].append(
+                    _PooledKernel(kernel_manager, 0, time.monotonic()))
+
+    def acquire(self, kernel_name=DEFAULT_KERNEL_NAME, cwd=None):
+        """Take a kernel from the pool, starting one if none are idle
+
+        Args:
+            kernel_name (str): Name of the kernelspec to use.
+            cwd (str, optional):
+                Working directory for the kernel. Defaults to the working
+                directory the pool was created in.
+
+        Returns:
+            jupyter_client.KernelManager:
+                Manager of a running kernel. Return it with :meth:`release`.
+
+        Raises:
+            RuntimeError:
+                If a freshly started kernel cannot change to ``cwd``, for
+                example because the directory does not exist.
+        """
+        self._reap_idle()
+        pooled = None
+        with self._lock:
+            if self._idle[kernel_name]:
+                pooled = self._idle[kernel_name].pop()
+        if pooled is None:
+            pooled = _PooledKernel(
+                self._start_kernel(kernel_name), 0, time.monotonic())
+
+        kernel_manager = pooled.kernel_manager
+        path = cwd or self._default_cwd
+        chdir_code = self.chdir_code.format(path=path)
+        if not self._execute(kernel_manager, chdir_code):
+            # The kernel may have died while idle, so try a fresh one once
+            self._shutdown_kernel(kernel_manager)
+            pooled = _PooledKernel(
+                self._start_kernel(kernel_name), 0, time.monotonic())
+            kernel_manager = pooled.kernel_manager
+            if not self._execute(kernel_manager, chdir_code):
+                self._shutdown_kernel(kernel_manager)
+                raise RuntimeError(
+                    "Could not change the kernel's working directory to "
+                    "{!r}".format(path))
+
+        with self._lock:
+            self._in_use[id(kernel_manager)] = pooled
+        return kernel_manager
+
+    def release(self, kernel_manager, recycle=False):
+        """Return a kernel to the pool
+
+        Args:
+            kernel_manager (jupyter_client.KernelManager):
+                A kernel manager returned by :meth:`acquire`.
+            recycle (bool):
+                If :data:`True`, shut the kernel down instead of resetting
+                and reusing it.
+        """
+        with self._lock:
+            pooled = self._in_use.pop(id(kernel_manager))
+        uses = pooled.uses + 1
+        kernel_name = kernel_manager.kernel_name
+
+        if (
+            recycle
+            or (self.max_uses is not None and uses >= self.max_uses)
+            or not self._execute(kernel_manager, self.reset_code)
+        ):
+            self._shutdown_kernel(kernel_manager)
+            return
+
+        with self._lock:
+            idle = self._idle[kernel_name]
+            if len(idle) < self.max_size:
+                idle.append(
+                    _PooledKernel(kernel_manager, uses, time.monotonic()))
+                return
+        self._shutdown_kernel(kernel_manager)
+
+    @contextlib.contextmanager
+    def kernel(self, kernel_name=DEFAULT_KERNEL_NAME, cwd=None):
+        """Context manager that acquires a kernel and releases it afterwards
+
+        The kernel is recycled rather than reused if the block raises an
+        exception other than a cell execution error.
+
+        Args:
+            kernel_name (str): Name of the kernelspec to use.
+            cwd (str, optional): Working directory for the kernel.
+
+        Yields:
+            jupyter_client.KernelManager: Manager of a running kernel.
+        """
+        kernel_manager = self.acquire(kernel_name, cwd=cwd)
+        recycle = False
+        try:
+            yield kernel_manager
+        except CellExecutionError:
+            raise
+        except BaseException:
+            recycle = True
+            raise
+        finally:
+            self.release(kernel_manager, recycle=recycle)
+
+    def idle_count(self, kernel_name=DEFAULT_KERNEL_NAME):
+        """Number of idle kernels in the pool for ``kernel_name``"""
+        with self._lock:
+            return len(self._idle[kernel_name])
+
+    def shutdown(self):
+        """Shut down all idle and in-use kernels"""
+        with self._lock:
+            kernel_managers = [
+                pooled.kernel_manager
+                for idle in self._idle.values()
+                for pooled in idle
+            ]
+            kernel_managers.extend(
+                pooled.kernel_manager for pooled in self._in_use.values())
+            self._idle.clear()
+            self._in_use.clear()
+        for kernel_manager in kernel_managers:
+            self._shutdown_kernel(kernel_manager)
+
+    def _reap_idle(self):
+        if self.max_idle is None:
+            return
+        cutoff = time.monotonic() - self.max_idle
+        expired = []
+        with self._lock:
+            for idle in self._idle.values():
+                expired.extend(
+                    pooled for pooled in idle if pooled.idle_since < cutoff)
+                idle[:] = [
+                    pooled for pooled in idle if pooled.idle_since >= cutoff]
+        for pooled in expired:
+            self._shutdown_kernel(pooled.kernel_manager)
+
+    def _start_kernel(self, kernel_name):
+        kernel_manager = KernelManager(kernel_name=kernel_name)
+        kernel_manager.start_kernel(cwd=self._default_cwd)
+        client = kernel_manager.client()
+        client.start_channels()
+        try:
+            client.wait_for_ready(timeout=self.startup_timeout)
+        except RuntimeError:
+            client.stop_channels()
+            self._shutdown_kernel(kernel_manager)
+            raise
+        client.stop_channels()
+        return kernel_manager
+
+    def _execute(self, kernel_manager, code):
+        # Returns whether the code ran successfully in the kernel
+        if not kernel_manager.is_alive():
+            return False
+        client = kernel_manager.client()
+        client.start_channels()
+        try:
+            reply = client.execute_interactive(
+                code,
+                silent=True,
+                store_history=False,
+                timeout=self.startup_timeout,
+                output_hook=lambda msg: None,
+            )
+        except TimeoutError:
+            return False
+        finally:
+            client.stop_channels()
+        return reply["content"]["status"] == "ok"
+
+    def _shutdown_kernel(self, kernel_manager):
+        try:
+            kernel_manager.shutdown_kernel(now=True)
+        except RuntimeError:
+            # The kernel already exited
+            pass
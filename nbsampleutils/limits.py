@@ -0,0 +1,313 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Limits on the size of the outputs captured while executing notebooks"""
+
+import base64
+import collections
+import json
+import mimetypes
+import os
+import uuid
+
+from nbsampleutils import METADATA_KEY
+
+
+# Mime types stored as text rather than base64 in notebooks
+_TEXT_MIMETYPES = ("image/svg+xml",)
+
+
+OutputUsage = collections.namedtuple(
+    "OutputUsage",
+    ["bytes", "omitted_bytes", "omitted_outputs", "truncated_cells"],
+)
+OutputUsage.__doc__ = """Output size counters of an executed notebook
+
+Attributes:
+    bytes (int): Size of the outputs kept in the notebook.
+    omitted_bytes (int): Size of the outputs truncated or dropped.
+    omitted_outputs (int):
+        Number of outputs replaced by a marker or dropped. Truncated stream
+        outputs are not counted.
+    truncated_cells (list(int)): Indexes of the cells with truncated outputs.
+"""
+
+
+class OutputLimits(object):
+    """Per-cell and per-notebook budgets for captured outputs
+
+    Outputs are checked as the kernel sends them, so a cell that prints
+    millions of lines or displays a huge table never holds more than the
+    budget in memory, and exports of the notebook stay as small. Stream
+    text is cut off at the budget and followed by a marker line. Rich
+    outputs, such as HTML and images, that do not fit are replaced by a
+    ``text/plain`` marker. Once a cell is over budget, its further outputs
+    are dropped. Error outputs are always kept, so tracebacks are not lost.
+
+    If ``spill_dir`` is given, the content left out is written to files in
+    it instead of being discarded, and the markers name the files.
+
+    Counters are recorded under ``metadata["nbsampleutils"]
+    ["output_limits"]`` of the notebook and of each truncated cell. See
+    :func:`output_usage`.
+
+    Sizes are in bytes of the stored output, so images count with their
+    base64 encoding. Updates to an existing display (``update_display``)
+    are not checked.
+
+    Args:
+        cell_bytes (int, optional): Budget for the outputs of one cell.
+        notebook_bytes (int, optional):
+            Budget for the outputs of the whole notebook.
+        spill_dir (str, optional):
+            Directory to write truncated content to. Created if needed.
+    """
+
+    def __init__(self, cell_bytes=None, notebook_bytes=None, spill_dir=None):
+        self.cell_bytes = cell_bytes
+        self.notebook_bytes = notebook_bytes
+        self.spill_dir = spill_dir
+
+    def __repr__(self):
+        return "OutputLimits(cell_bytes={!r}, notebook_bytes={!r}, " \
+            "spill_dir={!r})".format(
+                self.cell_bytes, self.notebook_bytes, self.spill_dir)
+
+    def attach(self, client):
+        """Check the outputs a notebook client captures against the budgets
+
+        Args:
+            client (nbclient.NotebookClient): The client to limit.
+        """
+        _OutputBudget(self, client).attach()
+
+
+class _CellState(object):
+
+    def __init__(self):
+        self.bytes = 0
+        self.count = 0
+        self.truncated = False
+        self.omitted_bytes = 0
+        self.omitted_outputs = 0
+        self.spilled = []
+        self.spilled_outputs = 0
+
+
+class _OutputBudget(object):
+    # Tracks the captured output size of one execution
+
+    def __init__(self, limits, client):
+        self.limits = limits
+        self._client = client
+        self._output = None
+        self._cells = {}
+        self._bytes = 0
+        self._prefix = uuid.uuid4().hex[:12]
+
+    def attach(self):
+        self._output = self._client.output
+        self._client.output = self.output
+
+    def output(self, outs, msg, display_id, cell_index):
+        out = self._output(outs, msg, display_id, cell_index)
+        if out is None:
+            return out
+
+        state = self._cells.setdefault(cell_index, _CellState())
+        if len(outs) != state.count + 1:
+            # The cell's outputs were cleared, so count what is left
+            self._bytes -= state.bytes
+            state.bytes = sum(_output_size(output) for output in outs[:-1])
+            self._bytes += state.bytes
+
+        size = _output_size(out)
+        allowed = self._allowed(state)
+        if (allowed is not None and size > allowed
+                and out.output_type != "error"):
+            self._truncate(outs, out, display_id, cell_index, state, allowed)
+            size = _output_size(out) if outs and outs[-1] is out else 0
+
+        state.bytes += size
+        state.count = len(outs)
+        self._bytes += size
+        self._record(cell_index, state)
+        return out
+
+    def _allowed(self, state):
+        remaining = []
+        if self.limits.cell_bytes is not None:
+            remaining.append(self.limits.cell_bytes - state.bytes)
+        if self.limits.notebook_bytes is not None:
+            remaining.append(self.limits.notebook_bytes - self._bytes)
+        if not remaining:
+            return None
+        return max(0, min(remaining))
+
+    def _limit_name(self, state):
+        if self.limits.notebook_bytes is None or (
+                self.limits.cell_bytes is not None
+                and self.limits.cell_bytes - state.bytes
+                <= self.limits.notebook_bytes - self._bytes):
+            return "cell output limit of {} bytes".format(
+                self.limits.cell_bytes)
+        return "notebook output limit of {} bytes".format(
+            self.limits.notebook_bytes)
+
+    def _truncate(self, outs, out, display_id, cell_index, state, allowed):
+        omitted = _output_size(out)
+        if out.output_type == "stream":
+            text = out.text
+            if not state.truncated:
+                kept = text.encode("utf-8")[:allowed].decode(
+                    "utf-8", "ignore")
+                text = text[len(kept):]
+            spilled = self._spill_stream(cell_index, out.name, text, state)
+            if state.truncated:
+                outs.pop()
+            else:
+                out.text = kept + _marker(
+                    self._limit_name(state), spilled, newline=True)
+            omitted = len(text.encode("utf-8"))
+        else:
+            spilled = self._spill_data(cell_index, out, state)
+            if state.truncated and not display_id:
+                outs.pop()
+            else:
+                # Outputs with a display id stay, so updates find them
+                out.data = {
+                    "text/plain": _marker(self._limit_name(state), spilled)}
+                out.metadata = {}
+            state.omitted_outputs += 1
+
+        state.truncated = True
+        state.omitted_bytes += omitted
+
+    def _spill_stream(self, cell_index, name, text, state):
+        if self.limits.spill_dir is None:
+            return None
+        path = self._spill_path(cell_index, name, ".txt")
+        with open(path, "a", encoding="utf-8") as spill_file:
+            spill_file.write(text)
+        if path not in state.spilled:
+            state.spilled.append(path)
+        return path
+
+    def _spill_data(self, cell_index, out, state):
+        if self.limits.spill_dir is None:
+            return None
+        state.spilled_outputs += 1
+        paths = []
+        for mimetype, value in sorted(out.get("data", {}).items()):
+            path = self._spill_path(
+                cell_index,
+                "output{}".format(state.spilled_outputs),
+                mimetypes.guess_extension(mimetype) or ".txt",
+                mimetype,
+            )
+            if isinstance(value, (dict, list)):
+                contents = json.dumps(value).encode("utf-8")
+            elif (mimetype.startswith("image/")
+                    and mimetype not in _TEXT_MIMETYPES):
+                contents = base64.b64decode(value)
+            else:
+                contents = value.encode("utf-8")
+            with open(path, "wb") as spill_file:
+                spill_file.write(contents)
+            paths.append(path)
+        state.spilled.extend(paths)
+        return ", ".join(paths) or None
+
+    def _spill_path(self, cell_index, name, extension, mimetype=None):
+        os.makedirs(self.limits.spill_dir, exist_ok=True)
+        if mimetype is not None:
+            name = "{}-{}".format(name, mimetype.replace("/", "-"))
+        filename = "{}-cell{}-{}{}".format(
+            self._prefix, cell_index, name, extension)
+        return os.path.join(self.limits.spill_dir, filename)
+
+    def _record(self, cell_index, state):
+        notebook_node = self._client.nb
+        counters = _limits_metadata(notebook_node)
+        counters["bytes"] = self._bytes
+        if not state.truncated:
+            return
+        _limits_metadata(notebook_node.cells[cell_index]).update({
+            "omitted_bytes": state.omitted_bytes,
+            "omitted_outputs": state.omitted_outputs,
+            "spilled": list(state.spilled),
+        })
+        truncated = [
+            (index, cell) for index, cell in sorted(self._cells.items())
+            if cell.truncated
+        ]
+        counters.update({
+            "omitted_bytes": sum(cell.omitted_bytes for _, cell in truncated),
+            "omitted_outputs": sum(
+                cell.omitted_outputs for _, cell in truncated),
+            "truncated_cells": [index for index, _ in truncated],
+        })
+
+
+def _limits_metadata(node):
+    return node.metadata.setdefault(
+        METADATA_KEY, {}).setdefault("output_limits", {})
+
+
+def _marker(limit_name, spilled, newline=False):
+    text = "[output truncated: {} reached".format(limit_name)
+    if spilled:
+        text += "; the rest was written to {}".format(spilled)
+    text += "]"
+    if newline:
+        return "\n" + text + "\n"
+    return text
+
+
+def _output_size(output):
+    if output.output_type == "stream":
+        return len(output.text.encode("utf-8"))
+    if output.output_type == "error":
+        return sum(
+            len(line.encode("utf-8")) for line in output.get("traceback", []))
+    size = 0
+    for value in output.get("data", {}).values():
+        if isinstance(value, str):
+            size += len(value.encode("utf-8"))
+        else:
+            size += len(json.dumps(value))
+    return size
+
+
+def output_usage(notebook_node):
+    """Return the output size counters of a notebook executed with limits
+
+    Args:
+        notebook_node (nbformat.NotebookNode):
+            A notebook executed with :class:`OutputLimits`.
+
+    Returns:
+        OutputUsage:
+            The counters, or :data:`None` if the notebook was not executed
+            with limits.
+    """
+    counters = notebook_node.metadata.get(METADATA_KEY, {}).get(
+        "output_limits")
+    if counters is None:
+        return None
+    return OutputUsage(
+        bytes=counters.get("bytes", 0),
+        omitted_bytes=counters.get("omitted_bytes", 0),
+        omitted_outputs=counters.get("omitted_outputs", 0),
+        truncated_cells=counters.get("truncated_cells", []),
+    )
@@ -0,0 +1,275 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Build manifest for skipping unchanged exports"""
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+from nbsampleutils import replace
+
+
+MANIFEST_FILENAME = ".nbsampleutils-manifest.json"
+
+
+def hash_inputs(
+        filepath, execute=False, output_string_replacements=None, extra=None):
+    """Hash everything that determines the export of a notebook file
+
+    Args:
+        filepath (str): Path to the notebook file.
+        execute (bool): Whether the notebook is executed before export.
+        output_string_replacements (dict(str, str), optional):
+            Mapping of strings to replace in the output file, or a compiled
+            :class:`nbsampleutils.replace.StringReplacer`.
+        extra (optional):
+            Other JSON serializable inputs of the export, such as the options
+            used to execute the notebook.
+
+    Returns:
+        str: Hex digest of the inputs.
+    """
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as notebook_file:
+        for block in iter(lambda: notebook_file.read(1 << 16), b""):
+            digest.update(block)
+    if isinstance(output_string_replacements, replace.StringReplacer):
+        output_string_replacements = output_string_replacements.replacements
+    inputs = {
+        "execute": bool(execute),
+        "replacements": sorted((output_string_replacements or {}).items()),
+    }
+    if extra is not None:
+        inputs["extra"] = extra
+    digest.update(json.dumps(inputs, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class BuildManifest(object):
+    """Record of the inputs and output files of exported notebooks
+
+    The manifest is stored as ``.nbsampleutils-manifest.json`` in ``root``
+    and has one entry per exported markdown file below ``root``. Each entry
+    records a hash of the export's inputs and the hash and size of every file
+    it wrote. Exports use it to skip notebooks whose inputs are unchanged,
+    to leave output files alone when their bytes have not changed, and to
+    remove resource files that an export no longer produces.
+
+    Use the manifest as a context manager, or call :meth:`save`, to write it
+    back to disk. A manifest should only be written by one process at a time.
+
+    Args:
+        root (str): Directory containing the exported files.
+
+    Attributes:
+        skipped (list(str)): Keys of exports skipped as unchanged.
+        written (list(str)): Paths of files that were written.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_FILENAME)
+        self.skipped = []
+        self.written = []
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as manifest_file:
+                self._entries = json.load(manifest_file)["exports"]
+        except (IOError, OSError, ValueError, KeyError):
+            self._entries = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+
+    def is_current(self, output_dir, md_name, inputs_hash):
+        """Return whether an export is up to date
+
+        Args:
+            output_dir (str): Directory the markdown file is written to.
+            md_name (str): Filename (without extension) of the markdown file.
+            inputs_hash (str): Hash returned by :func:`hash_inputs`.
+
+        Returns:
+            bool:
+                :data:`True` if the export was recorded with the same inputs
+                and all of its files still exist with the recorded sizes.
+        """
+        key = self._key(output_dir, md_name)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.get("inputs") != inputs_hash:
+            return False
+        for filename, recorded in entry["files"].items():
+            path = os.path.join(output_dir, filename)
+            try:
+                if os.path.getsize(path) != recorded["size"]:
+                    return False
+            except OSError:
+                return False
+        with self._lock:
+            self.skipped.append(key)
+        return True
+
+    def write_files(self, output_dir, md_name, files, inputs_hash=None):
+        """Write the files of an export, skipping unchanged ones
+
+        A file is only written if its bytes differ from the recorded hash or
+        from the file on disk. Files recorded for the previous export that
+        are not in ``files`` are removed.
+
+        Args:
+            output_dir (str): Directory to write the files to.
+            md_name (str): Filename (without extension) of the markdown file.
+            files (dict(str, bytes)):
+                Mapping of paths relative to ``output_dir`` to file contents.
+            inputs_hash (str, optional): Hash returned by :func:`hash_inputs`.
+        """
+        with self.open_export(output_dir, md_name, inputs_hash) as export:
+            for filename, data in files.items():
+                export.write(filename, data)
+
+    def open_export(self, output_dir, md_name, inputs_hash=None):
+        """Start writing the files of an export one at a time
+
+        Use the returned writer as a context manager. Files are written as
+        with :meth:`write_files`, and the export is recorded (and stale files
+        removed) when the context exits without an error.
+
+        Args:
+            output_dir (str): Directory to write the files to.
+            md_name (str): Filename (without extension) of the markdown file.
+            inputs_hash (str, optional): Hash returned by :func:`hash_inputs`.
+
+        Returns:
+            ExportWriter: Writer for the export's files.
+        """
+        return ExportWriter(self, output_dir, md_name, inputs_hash)
+
+    def save(self):
+        """Write the manifest to disk"""
+        with self._lock:
+            contents = json.dumps(
+                {"exports": self._entries}, indent=1, sort_keys=True)
+        _write_atomic(self.path, contents.encode("utf-8"))
+
+    def _key(self, output_dir, md_name):
+        path = os.path.relpath(os.path.join(output_dir, md_name), self.root)
+        return path.replace(os.sep, "/")
+
+
+class ExportWriter(object):
+    """Writes the files of one export and records them in a manifest
+
+    Create writers with :meth:`BuildManifest.open_export`.
+    """
+
+    def __init__(self, manifest, output_dir, md_name, inputs_hash):
+        self.manifest = manifest
+        self.output_dir = output_dir
+        self.inputs_hash = inputs_hash
+        self._key = manifest._key(output_dir, md_name)
+        with manifest._lock:
+            previous = manifest._entries.get(self._key, {})
+        self._previous = previous.get("files", {})
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def __deepcopy__(self, memo):
+        # nbconvert copies the resources of an export, which may hold the
+        # writer; every copy must still record into the same manifest
+        return self
+
+    def write(self, filename, data):
+        """Write a file unless its bytes are unchanged
+
+        Args:
+            filename (str): Path relative to the output directory.
+            data (bytes): Contents of the file.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        self._files[filename] = {"sha256": digest, "size": len(data)}
+        path = os.path.join(self.output_dir, filename)
+        if self._previous.get(filename, {}).get("sha256") == digest:
+            if _file_size(path) == len(data):
+                return
+        if _file_bytes_equal(path, data):
+            return
+        _write_atomic(path, data)
+        with self.manifest._lock:
+            self.manifest.written.append(path)
+
+    def close(self):
+        """Remove stale files and record the export in the manifest"""
+        for filename in set(self._previous) - set(self._files):
+            try:
+                os.remove(os.path.join(self.output_dir, filename))
+            except OSError:
+                pass
+
+        with self.manifest._lock:
+            self.manifest._entries[self._key] = {
+                "inputs": self.inputs_hash,
+                "files": self._files,
+            }
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _file_bytes_equal(path, data):
+    if _file_size(path) != len(data):
+        return False
+    with open(path, "rb") as existing_file:
+        return existing_file.read() == data
+
+
+def _copy_mode(source, destination):
+    # Keep the mode of the file being replaced
+    try:
+        mode = os.stat(source).st_mode & 0o777
+    except OSError:
+        return
+    os.chmod(destination, mode)
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, ".{}.{}.tmp".format(
+        os.path.basename(path), uuid.uuid4().hex[:8]))
+    # Like open(), this creates the file with the mode allowed by the umask
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as output_file:
+            output_file.write(data)
+        _copy_mode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,169 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Indexed access to the output text of executed notebooks"""
+
+import collections
+import re
+
+
+# Separates the text of consecutive cells in the index buffer
+_CELL_SEPARATOR = "\x00"
+
+
+OutputMatch = collections.namedtuple(
+    "OutputMatch", ["cell_index", "start", "end", "text"])
+OutputMatch.__doc__ = """A match found in the output text of a cell
+
+Attributes:
+    cell_index (int): Index of the cell in the notebook.
+    start (int): Offset of the match in the cell's output text.
+    end (int): Offset of the end of the match in the cell's output text.
+    text (str): The matched text.
+"""
+
+
+class OutputIndex(object):
+    """Output text of every cell in a notebook, extracted in one pass
+
+    The text of each cell is the same as returned by
+    :func:`nbsampleutils.utils.get_output_text` (stream text followed by
+    ``text/plain`` data, in output order), plus ``"ename: evalue"`` for
+    error outputs if ``include_errors`` is :data:`True`. All of it is stored
+    in a single string, so searches scan the notebook's outputs once instead
+    of joining them again for every assertion.
+
+    Args:
+        notebook_node (nbformat.NotebookNode): An executed notebook.
+        include_errors (bool):
+            Whether to include the name and value of error outputs.
+            Defaults to :data:`True`.
+
+    Attributes:
+        text (str):
+            Output text of all cells, separated by ``"\\x00"`` characters.
+    """
+
+    def __init__(self, notebook_node, include_errors=True):
+        parts = []
+        starts = []
+        ends = []
+        tags = collections.defaultdict(list)
+        position = 0
+        for cell_index, cell in enumerate(notebook_node.cells):
+            cell_text = "".join(_output_text(cell, include_errors))
+            parts.append(cell_text)
+            starts.append(position)
+            position += len(cell_text)
+            ends.append(position)
+            position += len(_CELL_SEPARATOR)
+            for tag in cell.get("metadata", {}).get("tags", []):
+                tags[tag].append(cell_index)
+
+        self.text = _CELL_SEPARATOR.join(parts)
+        self._starts = starts
+        self._ends = ends
+        self._tags = dict(tags)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, cell_index):
+        """Return the output text of the cell at ``cell_index``"""
+        return self.text[self._starts[cell_index]:self._ends[cell_index]]
+
+    def cells_with_tag(self, tag):
+        """Return the indices of cells with a metadata tag
+
+        Args:
+            tag (str): Cell metadata tag.
+
+        Returns:
+            list(int): Indices of the tagged cells, in notebook order.
+        """
+        return list(self._tags.get(tag, []))
+
+    def contains(self, substring, cell_index=None, tag=None):
+        """Return whether the output text contains ``substring``
+
+        Args:
+            substring (str): Text to look for.
+            cell_index (int, optional): Only look in this cell's output.
+            tag (str, optional): Only look in the output of cells with a tag.
+
+        Returns:
+            bool: :data:`True` if the text was found.
+        """
+        if cell_index is None and tag is None:
+            return substring in self.text
+        for index in self._cell_indices(cell_index, tag):
+            start, end = self._starts[index], self._ends[index]
+            if self.text.find(substring, start, end) != -1:
+                return True
+        return False
+
+    def search(self, pattern, cell_index=None, tag=None, flags=0):
+        """Find every match of a regular expression in the output text
+
+        Matches never span more than one cell.
+
+        Args:
+            pattern (str or re.Pattern): Regular expression to search for.
+            cell_index (int, optional): Only search this cell's output.
+            tag (str, optional): Only search the output of cells with a tag.
+            flags (int): Flags for compiling ``pattern``.
+
+        Returns:
+            list(OutputMatch): Matches in notebook order.
+        """
+        pattern = re.compile(pattern, flags)
+        if cell_index is None and tag is None:
+            indices = range(len(self))
+        else:
+            indices = self._cell_indices(cell_index, tag)
+
+        # Each cell's text is searched on its own, so greedy patterns stop at
+        # the end of the cell and "^" matches at its start
+        matches = []
+        for index in indices:
+            for match in pattern.finditer(self[index]):
+                matches.append(OutputMatch(
+                    cell_index=index,
+                    start=match.start(),
+                    end=match.end(),
+                    text=match.group(),
+                ))
+        return matches
+
+    def _cell_indices(self, cell_index, tag):
+        if cell_index is not None:
+            if cell_index < 0:
+                cell_index += len(self)
+            indices = [cell_index]
+        else:
+            indices = range(len(self))
+        if tag is not None:
+            tagged = set(self._tags.get(tag, []))
+            indices = [index for index in indices if index in tagged]
+        return indices
+
+
+def _output_text(cell, include_errors):
+    for output in cell.get("outputs", []):
+        if "text" in output:
+            yield output["text"]
+        data = output.get("data")
+        if data and "text/plain" in data:
+            yield data["text/plain"]
+        if include_errors and output.get("output_type") == "error":
+            yield "{}: {}".format(output.get("ename"), output.get("evalue"))
@@ -0,0 +1,212 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Fused notebook processing pipelines"""
+
+import collections
+import os
+import threading
+import time
+
+from nbsampleutils import export
+from nbsampleutils import utils
+
+
+class Pipeline(object):
+    """Prepares, executes, cleans and exports notebooks in few passes
+
+    Chaining preprocessors with their own ``preprocess`` methods walks every
+    cell of the notebook once per preprocessor. A pipeline instead applies
+    all of its ``prepare`` transforms in one traversal before execution, and
+    all of its ``clean`` transforms in one traversal after it.
+
+    A transform is an nbconvert preprocessor, or any object with a
+    ``preprocess_cell(cell, resources, index)`` method returning
+    ``(cell, resources)``. A plain function with the same signature works
+    too. A transform may return :data:`None` in place of the cell to remove
+    it, as :class:`nbsampleutils.preprocessors.RemoveTaggedCellsPreprocessor`
+    does. Later transforms are not applied to removed cells.
+
+    Args:
+        prepare (list, optional): Transforms to apply before execution.
+        clean (list, optional): Transforms to apply after execution.
+        execute (bool):
+            If :data:`True`, notebooks are executed between the prepare and
+            clean traversals. Defaults to :data:`False`.
+        exporter (nbsampleutils.export.Exporter, optional):
+            Session to export notebooks with. Defaults to the shared session.
+        kernel_pool (nbsampleutils.kernels.KernelPool, optional):
+            Pool to take warm kernels from when executing.
+        cache (nbsampleutils.cache.ExecutionCache, optional):
+            Cache of executed notebooks.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to
+            ``nbconvert.preprocessors.execute.ExecutePreprocessor``.
+
+    Attributes:
+        timings (collections.OrderedDict(str, float)):
+            Seconds spent in each stage, summed over every notebook
+            processed. Transforms are named after their class (or function)
+            and execution and export are named ``"execute"`` and
+            ``"export"``.
+    """
+
+    def __init__(
+            self,
+            prepare=None,
+            clean=None,
+            execute=False,
+            exporter=None,
+            kernel_pool=None,
+            cache=None,
+            **execute_kwargs
+    ):
+        self.prepare = list(prepare or [])
+        self.clean = list(clean or [])
+        self.execute = execute
+        self.exporter = exporter or export._default_exporter
+        self.kernel_pool = kernel_pool
+        self.cache = cache
+        self.execute_kwargs = execute_kwargs
+        self.timings = collections.OrderedDict()
+        self._timings_lock = threading.Lock()
+
+    def run(self, notebook_node, notebook_path=None):
+        """Prepare, execute and clean a notebook node
+
+        Args:
+            notebook_node (nbformat.v4.NotebookNode):
+                The notebook to process. It is modified in place.
+            notebook_path (str, optional):
+                File path to use for executing the notebook.
+
+        Returns:
+            nbformat.NotebookNode: The processed notebook node.
+        """
+        if notebook_path:
+            resources = {"metadata": {"path": notebook_path}}
+        else:
+            resources = {}
+
+        self.apply(self.prepare, notebook_node, resources)
+
+        if self.execute:
+            start = time.perf_counter()
+            utils.run_notebook_node(
+                notebook_node,
+                notebook_path=notebook_path,
+                kernel_pool=self.kernel_pool,
+                cache=self.cache,
+                **self.execute_kwargs)
+            self._record("execute", time.perf_counter() - start)
+
+        self.apply(self.clean, notebook_node, resources)
+        return notebook_node
+
+    def run_from_filepath(self, filepath, output_dir=None, **export_kwargs):
+        """Process a notebook file and export it to markdown
+
+        Args:
+            filepath (str): Path to the notebook file.
+            output_dir (str, optional):
+                Directory to write the markdown file to. Defaults to the
+                notebook's directory.
+            export_kwargs (dict, optional):
+                Key word arguments to pass to :meth:`export`.
+
+        Returns:
+            nbformat.NotebookNode: The processed notebook node.
+        """
+        md_name, output_dir = export._output_location(filepath, output_dir)
+        notebook_path, _ = os.path.split(filepath)
+        notebook_node = utils.get_notebook_from_filepath(filepath)
+        self.run(notebook_node, notebook_path=notebook_path)
+        self.export(notebook_node, md_name, output_dir, **export_kwargs)
+        return notebook_node
+
+    def export(
+            self,
+            notebook_node,
+            md_name,
+            output_dir,
+            output_string_replacements=None,
+            manifest=None,
+    ):
+        """Export a processed notebook node to markdown
+
+        See :func:`nbsampleutils.export.export_from_node`.
+        """
+        start = time.perf_counter()
+        self.exporter.export_from_node(
+            notebook_node,
+            md_name,
+            output_dir,
+            output_string_replacements,
+            manifest=manifest,
+        )
+        self._record("export", time.perf_counter() - start)
+
+    def apply(self, transforms, notebook_node, resources):
+        """Apply transforms to every cell of a notebook in one traversal
+
+        Args:
+            transforms (list): Transforms to apply, in order.
+            notebook_node (nbformat.v4.NotebookNode):
+                The notebook to transform. It is modified in place.
+            resources (dict): Resources passed to each transform.
+
+        Returns:
+            nbformat.NotebookNode: The transformed notebook node.
+        """
+        if not transforms:
+            return notebook_node
+
+        stages = [
+            (_stage_name(transform),
+             getattr(transform, "preprocess_cell", transform))
+            for transform in transforms
+        ]
+        elapsed = [0.0] * len(stages)
+        clock = time.perf_counter
+
+        cells = []
+        for index, cell in enumerate(notebook_node.cells):
+            for stage, (_, preprocess_cell) in enumerate(stages):
+                start = clock()
+                cell, resources = preprocess_cell(cell, resources, index)
+                elapsed[stage] += clock() - start
+                if cell is None:
+                    break
+            else:
+                cells.append(cell)
+        notebook_node.cells = cells
+
+        for (name, _), seconds in zip(stages, elapsed):
+            self._record(name, seconds)
+        return notebook_node
+
+    def reset_timings(self):
+        """Clear the accumulated :attr:`timings`"""
+        with self._timings_lock:
+            self.timings.clear()
+
+    def _record(self, name, seconds):
+        with self._timings_lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+
+def _stage_name(transform):
+    name = getattr(transform, "__name__", None)
+    if name is None:
+        name = type(transform).__name__
+    return name
@@ -13,42 +13,161 @@
 # limitations under the License.
 """Custom nbconvert preprocessors"""
 
+import collections
+import hashlib
+import threading
+
+from nbconvert.preprocessors import ExtractOutputPreprocessor
 from nbconvert.preprocessors import Preprocessor
 
+from nbsampleutils import replace
+from nbsampleutils import styles
+
 
 class ReplaceCodeInputStringsPreprocessor(Preprocessor):
     """Preprocessor to replace given strings in code inputs in a notebook"""
 
     def __init__(self, string_replacements=None):
-        self.string_replacements = string_replacements or {}
+        # Compile the mapping once so each cell is scanned in a single pass
+        self.replacer = replace.as_replacer(string_replacements)
+        self.string_replacements = self.replacer.replacements
         super().__init__()
 
     def preprocess_cell(self, cell, resources, index):
-        if cell.cell_type == "code":
-            for old_value, new_value in self.string_replacements.items():
-                cell.source = cell.source.replace(old_value, new_value)
+        if cell.cell_type == "code" and self.replacer:
+            cell.source = self.replacer.replace(cell.source)
         return cell, resources
 
 
 class RemoveTaggedCellsPreprocessor(Preprocessor):
-    """Preprocessor to remove code cells containing a given string"""
+    """Preprocessor to remove code cells containing a given string
+
+    Cells are removed in a single pass that rebuilds the notebook's list of
+    cells. The preprocessor keeps no state between notebooks, so one
+    instance can be reused, or shared between threads, for a whole batch.
 
-    def __init__(self, tag_string=None):
+    Args:
+        tag_string (str or list(str), optional):
+            String, or strings, marking code cells to remove. All strings
+            are matched in one scan of each cell's source.
+        tags (list(str), optional):
+            Cell metadata tags marking cells (of any type) to remove.
+    """
+
+    def __init__(self, tag_string=None, tags=None):
+        if isinstance(tag_string, str):
+            tag_strings = [tag_string]
+        else:
+            tag_strings = list(tag_string or [])
         self.tag_string = tag_string
-        self.indices_to_delete = []
+        self.tags = frozenset(tags or [])
+        self._tag_pattern = replace.compile_literals(tag_strings)
         super().__init__()
 
-    def preprocess_cell(self, cell, resources, index):
-        # The cells must be deleted from the end to the beginning of the
-        # notebook to avoid shifting indices as cells are deleted
-        if cell.cell_type == "code":
-            if self.tag_string in cell.source:
-                self.indices_to_delete.insert(0, index)
+    def is_tagged(self, cell):
+        """Return whether ``cell`` should be removed"""
+        if self.tags and self.tags.intersection(
+                cell.get("metadata", {}).get("tags", [])):
+            return True
+        return (
+            self._tag_pattern is not None
+            and cell.cell_type == "code"
+            and self._tag_pattern.search(cell.source) is not None
+        )
 
+    def preprocess_cell(self, cell, resources, index):
+        # Returning None drops the cell in a nbsampleutils.pipeline.Pipeline
+        if self.is_tagged(cell):
+            return None, resources
         return cell, resources
 
     def preprocess(self, nb, resources):
-        super().preprocess(nb, resources)
+        nb.cells = [cell for cell in nb.cells if not self.is_tagged(cell)]
+        return nb, resources
 
-        for index in self.indices_to_delete:
-            del nb.cells[index]
+
+class StripStylesPreprocessor(Preprocessor):
+    """Preprocessor to remove CSS styles from HTML outputs and markdown cells
+
+    Cleaned HTML is cached by the hash of its contents and shared between
+    instances, so outputs that are unchanged between exports (for example
+    the same dataframe rendered on every build) are only cleaned once. The
+    cache holds at most ``cache_bytes`` of cleaned HTML, evicting the least
+    recently used entries, so long-running processes stay bounded.
+    """
+
+    cache_bytes = 16 * 1024 * 1024
+
+    _cache = collections.OrderedDict()
+    _cache_used = 0
+    _cache_lock = threading.Lock()
+
+    def preprocess_cell(self, cell, resources, index):
+        if cell.cell_type in ("markdown", "raw"):
+            cell.source = self.strip_styles(cell.source)
+        for output in cell.get("outputs", []):
+            data = output.get("data", {})
+            if "text/html" in data:
+                html = data["text/html"]
+                if isinstance(html, list):
+                    html = "".join(html)
+                data["text/html"] = self.strip_styles(html)
+        return cell, resources
+
+    def strip_styles(self, html):
+        """Return ``html`` without styles, using the shared cache"""
+        if "<" not in html:
+            return html
+        key = hashlib.sha1(html.encode("utf-8")).digest()
+        cls = StripStylesPreprocessor
+        with self._cache_lock:
+            if key in cls._cache:
+                cls._cache.move_to_end(key)
+                return cls._cache[key]
+
+        stripped = styles.strip_styles(html)
+        size = len(stripped)
+        if size > self.cache_bytes:
+            return stripped
+
+        with self._cache_lock:
+            if key not in cls._cache:
+                cls._cache[key] = stripped
+                cls._cache_used += size
+            while cls._cache_used > self.cache_bytes:
+                _, evicted = cls._cache.popitem(last=False)
+                cls._cache_used -= len(evicted)
+        return stripped
+
+
+class SpillOutputsPreprocessor(ExtractOutputPreprocessor):
+    """Preprocessor to write extracted outputs to files as they are decoded
+
+    Outputs are extracted the same way as by nbconvert's
+    ``ExtractOutputPreprocessor``, but instead of collecting every decoded
+    file in ``resources["outputs"]``, each cell's files are passed to
+    ``resources["output_writer"].write(filename, data)`` as soon as they are
+    decoded. The extracted data in the notebook is then replaced with an
+    empty string, since templates only need the filename. This keeps one
+    cell's outputs in memory at a time instead of every output at once.
+
+    Filenames of written outputs stay in ``resources["outputs"]`` (mapped to
+    :data:`None`) so duplicate filenames are still detected.
+    """
+
+    def preprocess_cell(self, cell, resources, cell_index):
+        cell, resources = super().preprocess_cell(cell, resources, cell_index)
+
+        # The cell's own outputs name the files extracted from it, so only
+        # this cell's files are visited
+        outputs = resources["outputs"]
+        writer = resources["output_writer"]
+        for output in cell.get("outputs", []):
+            filenames = output.get("metadata", {}).get("filenames", {})
+            for mime_type, filename in filenames.items():
+                data = outputs.get(filename)
+                if data is not None:
+                    writer.write(filename, data)
+                    outputs[filename] = None
+                output["data"][mime_type] = ""
+        return cell, resources
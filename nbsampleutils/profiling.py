@@ -0,0 +1,252 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-cell execution profiling"""
+
+import collections
+import csv
+import datetime
+import json
+import time
+
+from jupyter_client.jsonutil import parse_date
+from nbclient.util import ensure_async
+from nbclient.util import run_hook
+
+from nbsampleutils import METADATA_KEY
+
+
+# Peak resident set size of the kernel process in bytes. ru_maxrss is in
+# kilobytes on Linux and in bytes on macOS.
+_PEAK_MEMORY_EXPRESSION = (
+    "__import__('resource').getrusage("
+    "__import__('resource').RUSAGE_SELF).ru_maxrss"
+    " * (1 if __import__('sys').platform == 'darwin' else 1024)"
+)
+
+
+CellProfile = collections.namedtuple(
+    "CellProfile",
+    [
+        "filepath",
+        "cell_index",
+        "wall_time",
+        "queue_wait",
+        "peak_memory",
+        "output_size",
+        "source",
+    ],
+)
+CellProfile.__doc__ = """Execution profile of a single code cell
+
+Attributes:
+    filepath (str): Path to the notebook, or :data:`None` if not known.
+    cell_index (int): Index of the cell in the notebook.
+    wall_time (float):
+        Seconds from sending the execute request until the reply and all
+        outputs were received.
+    queue_wait (float):
+        Seconds between sending the execute request and the kernel starting
+        to execute it, or :data:`None` if the kernel does not report it.
+    peak_memory (int):
+        Peak resident memory of the kernel process in bytes after the cell
+        ran, or :data:`None` if the kernel cannot report it.
+    output_size (int): Size in bytes of the cell's outputs as JSON.
+    source (str): First line of the cell's source.
+"""
+
+
+class CellProfiler(object):
+    """Records per-cell timings through nbclient's execution hooks
+
+    Attach a profiler to an ``nbclient.NotebookClient`` (or nbconvert's
+    ``ExecutePreprocessor``) before executing a notebook. Kernel startup
+    time is stored in the notebook's metadata and each code cell's profile
+    in the cell's metadata, under ``metadata["nbsampleutils"]["profile"]``.
+    Hooks already set on the client are still called.
+
+    Python kernels report their peak memory through a silent request after
+    each cell. Other kernels record :data:`None`.
+
+    Args:
+        memory (bool):
+            Whether to query the kernel's peak memory after each cell.
+            Defaults to :data:`True`.
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self._client = None
+        self._start = None
+        self._submitted = {}
+        self._hooks = {}
+
+    def attach(self, client):
+        """Install the profiler's hooks on a notebook client
+
+        Args:
+            client (nbclient.NotebookClient): The client to profile.
+        """
+        self._client = client
+        self._start = time.perf_counter()
+        for name in ("on_notebook_start", "on_cell_execute",
+                     "on_cell_executed"):
+            self._hooks[name] = getattr(client, name)
+            setattr(client, name, getattr(self, "_" + name))
+
+    async def _on_notebook_start(self, notebook):
+        _profile_metadata(notebook)["kernel_startup"] = (
+            time.perf_counter() - self._start)
+        await run_hook(self._hooks["on_notebook_start"], notebook=notebook)
+
+    async def _on_cell_execute(self, cell, cell_index):
+        self._submitted[cell_index] = (time.time(), time.perf_counter())
+        await run_hook(
+            self._hooks["on_cell_execute"], cell=cell, cell_index=cell_index)
+
+    async def _on_cell_executed(self, cell, cell_index, execute_reply):
+        submitted_at, submitted = self._submitted.pop(cell_index)
+        wall_time = time.perf_counter() - submitted
+
+        queue_wait = None
+        started = (execute_reply or {}).get("metadata", {}).get("started")
+        if started is not None:
+            if isinstance(started, str):
+                started = parse_date(started)
+            if isinstance(started, datetime.datetime):
+                queue_wait = max(0.0, started.timestamp() - submitted_at)
+
+        peak_memory = None
+        if self.memory:
+            peak_memory = await self._peak_memory()
+
+        _profile_metadata(cell).update({
+            "wall_time": wall_time,
+            "queue_wait": queue_wait,
+            "peak_memory": peak_memory,
+            "output_size": len(json.dumps(cell.get("outputs", []))),
+        })
+        await run_hook(
+            self._hooks["on_cell_executed"],
+            cell=cell,
+            cell_index=cell_index,
+            execute_reply=execute_reply,
+        )
+
+    async def _peak_memory(self):
+        language = self._client.nb.metadata.get(
+            "language_info", {}).get("name")
+        if language != "python":
+            return None
+        msg_id = await ensure_async(self._client.kc.execute(
+            "",
+            silent=True,
+            store_history=False,
+            user_expressions={"peak_memory": _PEAK_MEMORY_EXPRESSION},
+        ))
+        reply = await self._client.async_wait_for_reply(msg_id)
+        if reply is None:
+            return None
+        result = reply["content"].get(
+            "user_expressions", {}).get("peak_memory", {})
+        if result.get("status") != "ok":
+            # The kernel cannot report memory, so stop asking
+            self.memory = False
+            return None
+        return int(result["data"]["text/plain"])
+
+
+def _profile_metadata(node):
+    return node.metadata.setdefault(
+        METADATA_KEY, {}).setdefault("profile", {})
+
+
+def kernel_startup(notebook_node):
+    """Return the recorded kernel startup time of a profiled notebook
+
+    Args:
+        notebook_node (nbformat.NotebookNode): A profiled notebook.
+
+    Returns:
+        float: Seconds, or :data:`None` if the notebook was not profiled.
+    """
+    return notebook_node.metadata.get(METADATA_KEY, {}).get(
+        "profile", {}).get("kernel_startup")
+
+
+def cell_profiles(notebook_node, filepath=None):
+    """Return the profiles recorded in a notebook's cells
+
+    Args:
+        notebook_node (nbformat.NotebookNode): A profiled notebook.
+        filepath (str, optional): Path to record on each profile.
+
+    Returns:
+        list(CellProfile): Profiles of the executed code cells, in order.
+    """
+    profiles = []
+    for cell_index, cell in enumerate(notebook_node.cells):
+        profile = cell.metadata.get(METADATA_KEY, {}).get("profile")
+        if not profile:
+            continue
+        lines = cell.source.strip().splitlines()
+        profiles.append(CellProfile(
+            filepath=filepath,
+            cell_index=cell_index,
+            wall_time=profile.get("wall_time"),
+            queue_wait=profile.get("queue_wait"),
+            peak_memory=profile.get("peak_memory"),
+            output_size=profile.get("output_size"),
+            source=lines[0] if lines else "",
+        ))
+    return profiles
+
+
+def slowest(profiles, count=None):
+    """Rank cell profiles by wall time
+
+    Args:
+        profiles (iterable(CellProfile)): Profiles from any notebooks.
+        count (int, optional): Maximum number of profiles to return.
+
+    Returns:
+        list(CellProfile): The slowest profiles first.
+    """
+    ranked = sorted(profiles, key=lambda profile: -profile.wall_time)
+    if count is not None:
+        ranked = ranked[:count]
+    return ranked
+
+
+def write_json(profiles, output_file):
+    """Write cell profiles to a file as a JSON list of objects
+
+    Args:
+        profiles (iterable(CellProfile)): Profiles to write.
+        output_file (file): Text file to write to.
+    """
+    json.dump(
+        [profile._asdict() for profile in profiles], output_file, indent=1)
+
+
+def write_csv(profiles, output_file):
+    """Write cell profiles to a file as CSV with a header row
+
+    Args:
+        profiles (iterable(CellProfile)): Profiles to write.
+        output_file (file): Text file opened with ``newline=""``.
+    """
+    writer = csv.writer(output_file)
+    writer.writerow(CellProfile._fields)
+    for profile in profiles:
+        writer.writerow(profile)
@@ -0,0 +1,64 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Callbacks for following the execution of a notebook cell by cell"""
+
+from nbclient.util import run_hook
+
+
+class StopExecution(Exception):
+    """Raise from a cell callback to stop executing the notebook early
+
+    The notebook is returned with the cells executed so far.
+    """
+
+
+def attach_callback(client, on_cell):
+    """Call ``on_cell`` as soon as each code cell finishes executing
+
+    The callback is called with the ``cell`` and its ``cell_index``, after
+    the cell's outputs were received and before the next cell starts. It may
+    be a coroutine function. A hook already set as ``on_cell_executed`` on
+    the client is still called first.
+
+    Args:
+        client (nbclient.NotebookClient): The client executing the notebook.
+        on_cell (callable): The callback.
+    """
+    hook = client.on_cell_executed
+
+    async def on_cell_executed(cell, cell_index, execute_reply):
+        await run_hook(
+            hook,
+            cell=cell,
+            cell_index=cell_index,
+            execute_reply=execute_reply,
+        )
+        await run_hook(on_cell, cell=cell, cell_index=cell_index)
+
+    client.on_cell_executed = on_cell_executed
+
+
+def replay(notebook_node, on_cell):
+    """Call ``on_cell`` for each executed code cell of a finished notebook
+
+    Used when a notebook's results come from a cache instead of a kernel, so
+    callers see the same callbacks either way.
+
+    Args:
+        notebook_node (nbformat.NotebookNode): An executed notebook.
+        on_cell (callable): The callback. See :func:`attach_callback`.
+    """
+    for cell_index, cell in enumerate(notebook_node.cells):
+        if cell.cell_type == "code":
+            on_cell(cell=cell, cell_index=cell_index)
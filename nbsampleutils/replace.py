@@ -0,0 +1,166 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Single-pass string replacement for notebook inputs and outputs"""
+
+import re
+
+
+_REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+
+class StringReplacer(object):
+    """Applies a mapping of string replacements in a single pass
+
+    Literal keys are compiled once into a single pattern shaped like a
+    prefix tree, so applying the mapping costs one scan of the text however
+    many keys there are. Because every literal replacement is made in the
+    same pass, replaced text is never matched again by another key, and
+    where two keys match at the same position the longest one wins.
+
+    In ``regex`` mode, keys are applied one after another in the order of
+    the mapping, as with a sequence of ``re.sub`` calls. Each run of
+    consecutive keys without regular expression metacharacters is combined
+    into one pass as above; the other patterns are compiled once and applied
+    on their own. (Combining arbitrary patterns into one alternation is much
+    slower with Python's ``re`` module, because it defeats the engine's
+    literal prefix search.)
+
+    Args:
+        replacements (dict(str, str)):
+            Mapping of strings (or regular expressions, if ``regex`` is
+            :data:`True`) to their replacements. Empty keys are ignored.
+        regex (bool):
+            If :data:`True`, keys are regular expressions and replacements
+            may use ``re.sub`` template syntax such as ``\\g<0>``. Defaults
+            to literal matching.
+    """
+
+    def __init__(self, replacements, regex=False):
+        self.replacements = {
+            old: new for old, new in (replacements or {}).items() if old}
+        self.regex = regex
+
+        # A literal key always matches the same text, so any template in the
+        # replacement can be expanded once up front
+        self._literal_values = {}
+        # (pattern, replacement) pairs applied in order
+        self._passes = []
+        literal_keys = []
+        for key, new in self.replacements.items():
+            if regex and _REGEX_METACHARACTERS.intersection(key):
+                self._add_literal_pass(literal_keys)
+                literal_keys = []
+                self._passes.append((re.compile(key), new))
+                continue
+            if regex:
+                new = re.sub(re.escape(key), new, key)
+            self._literal_values[key] = new
+            literal_keys.append(key)
+        self._add_literal_pass(literal_keys)
+
+    def __bool__(self):
+        return bool(self.replacements)
+
+    def replace(self, text):
+        """Return ``text`` with every replacement applied
+
+        Args:
+            text (str): Text to make replacements in.
+
+        Returns:
+            str: The text after replacement.
+        """
+        for pattern, replacement in self._passes:
+            text = pattern.sub(replacement, text)
+        return text
+
+    def _add_literal_pass(self, keys):
+        pattern = compile_literals(keys)
+        if pattern is not None:
+            self._passes.append(
+                (pattern, lambda match: self._literal_values[match.group()]))
+
+
+def as_replacer(replacements, regex=False):
+    """Return a :class:`StringReplacer` for ``replacements``
+
+    Args:
+        replacements (dict(str, str) or StringReplacer):
+            A mapping of replacements, or an already compiled replacer which
+            is returned unchanged.
+        regex (bool): Whether keys of a mapping are regular expressions.
+
+    Returns:
+        StringReplacer: The compiled replacer.
+    """
+    if isinstance(replacements, StringReplacer):
+        return replacements
+    return StringReplacer(replacements, regex=regex)
+
+
+def compile_literals(strings):
+    """Compile strings into one pattern matching any of them
+
+    Args:
+        strings (iterable(str)): Literal strings to match. Empty strings are
+            ignored.
+
+    Returns:
+        re.Pattern:
+            Pattern matching the longest of the strings at any position, or
+            :data:`None` if there are no strings to match.
+    """
+    strings = [string for string in strings if string]
+    if not strings:
+        return None
+    return re.compile(_trie_pattern(strings))
+
+
+def _trie_pattern(keys):
+    # Build a regular expression matching any of the keys, with shared
+    # prefixes factored out so the engine does not retry every key at every
+    # position. Optional suffixes are greedy, so longer keys win.
+    trie = {}
+    for key in keys:
+        node = trie
+        for char in key:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return _node_pattern(trie)
+
+
+def _node_pattern(node):
+    branches = []
+    leaves = []
+    for char in sorted(node):
+        if not char:
+            continue
+        suffix = _node_pattern(node[char])
+        if suffix:
+            branches.append(re.escape(char) + suffix)
+        else:
+            leaves.append(re.escape(char))
+
+    if len(leaves) == 1:
+        branches.append(leaves[0])
+    elif leaves:
+        branches.append("[{}]".format("".join(leaves)))
+
+    if not branches:
+        return ""
+    terminal = "" in node
+    if len(branches) == 1 and not terminal:
+        return branches[0]
+    pattern = "(?:{})".format("|".join(branches))
+    return pattern + "?" if terminal else pattern
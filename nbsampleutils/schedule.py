@@ -0,0 +1,329 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Execute notebooks in the order of the dependencies between them
+
+A notebook that reads files written by other notebooks declares them in its
+metadata, with paths relative to the notebook::
+
+    {"metadata": {"nbsampleutils": {"depends_on": ["prepare_data.ipynb"]}}}
+"""
+
+import collections
+import concurrent.futures
+import heapq
+import multiprocessing
+import os
+
+from nbsampleutils import METADATA_KEY
+from nbsampleutils import batch
+from nbsampleutils import utils
+
+
+def read_dependencies(filepath):
+    """Return the notebooks that a notebook declares it depends on
+
+    Args:
+        filepath (str): Path to a notebook.
+
+    Returns:
+        list(str): Normalized paths of the prerequisite notebooks.
+    """
+    notebook_node = utils.get_notebook_from_filepath(
+        filepath, validate=False, lazy_outputs=True)
+    depends_on = notebook_node.metadata.get(METADATA_KEY, {}).get(
+        "depends_on", [])
+    if isinstance(depends_on, str):
+        depends_on = [depends_on]
+    directory = os.path.dirname(filepath)
+    return [
+        os.path.normpath(os.path.join(directory, dependency))
+        for dependency in depends_on
+    ]
+
+
+def build_graph(paths, dependencies=None):
+    """Build the dependency graph of a set of notebooks
+
+    Prerequisites of the given notebooks are added to the graph even if
+    ``paths`` does not include them.
+
+    Args:
+        paths (str or list(str)):
+            Notebook paths, directories or glob patterns. See
+            :func:`nbsampleutils.batch.find_notebooks`.
+        dependencies (dict(str, list(str)), optional):
+            Mapping of notebook paths to the paths of notebooks they depend
+            on, in addition to the dependencies declared in their metadata.
+
+    Returns:
+        collections.OrderedDict:
+            Mapping of each notebook path to the list of its prerequisites,
+            ordered so every notebook comes after its prerequisites.
+
+    Raises:
+        ValueError:
+            If a prerequisite does not exist or the dependencies contain a
+            cycle.
+    """
+    extra = collections.defaultdict(list)
+    for filepath, prerequisites in (dependencies or {}).items():
+        extra[os.path.normpath(filepath)].extend(
+            os.path.normpath(prerequisite) for prerequisite in prerequisites)
+
+    graph = {}
+    pending = [
+        os.path.normpath(filepath)
+        for filepath in batch.find_notebooks(paths)
+    ]
+    while pending:
+        filepath = pending.pop()
+        if filepath in graph:
+            continue
+        prerequisites = read_dependencies(filepath)
+        for prerequisite in extra.get(filepath, []):
+            if prerequisite not in prerequisites:
+                prerequisites.append(prerequisite)
+        for prerequisite in prerequisites:
+            if not os.path.isfile(prerequisite):
+                raise ValueError(
+                    "{} depends on {}, which does not exist".format(
+                        filepath, prerequisite))
+        graph[filepath] = prerequisites
+        pending.extend(prerequisites)
+    return _sort_graph(graph)
+
+
+def _sort_graph(graph):
+    waiting = {
+        filepath: set(prerequisites)
+        for filepath, prerequisites in graph.items()
+    }
+    dependents = _dependents(graph)
+    ready = sorted(
+        filepath for filepath, prerequisites in waiting.items()
+        if not prerequisites)
+    heapq.heapify(ready)
+    ordered = collections.OrderedDict()
+    while ready:
+        filepath = heapq.heappop(ready)
+        ordered[filepath] = graph[filepath]
+        for dependent in dependents[filepath]:
+            waiting[dependent].discard(filepath)
+            if not waiting[dependent]:
+                heapq.heappush(ready, dependent)
+    if len(ordered) < len(graph):
+        cycle = sorted(set(graph) - set(ordered))
+        raise ValueError("Dependency cycle between notebooks: {}".format(
+            ", ".join(cycle)))
+    return ordered
+
+
+def _dependents(graph):
+    dependents = collections.defaultdict(list)
+    for filepath, prerequisites in graph.items():
+        for prerequisite in prerequisites:
+            dependents[prerequisite].append(filepath)
+    return dependents
+
+
+def critical_path(graph, durations=None):
+    """Find the chain of dependent notebooks that takes the longest
+
+    With enough workers, the time to execute the whole graph is the length
+    of its critical path.
+
+    Args:
+        graph (collections.OrderedDict):
+            Dependency graph, as returned by :func:`build_graph`.
+        durations (dict(str, float), optional):
+            Seconds each notebook takes. Notebooks without a duration count
+            as 1, so by default the longest chain of notebooks is returned.
+
+    Returns:
+        tuple(list(str), float):
+            The notebooks on the critical path, in execution order, and its
+            total duration.
+    """
+    durations = durations or {}
+    finish = {}
+    previous = {}
+    for filepath, prerequisites in graph.items():
+        start = 0.0
+        previous[filepath] = None
+        for prerequisite in prerequisites:
+            if finish[prerequisite] > start:
+                start = finish[prerequisite]
+                previous[filepath] = prerequisite
+        finish[filepath] = start + durations.get(filepath, 1.0)
+    if not finish:
+        return [], 0.0
+
+    filepath = max(finish, key=finish.get)
+    total = finish[filepath]
+    path = []
+    while filepath is not None:
+        path.append(filepath)
+        filepath = previous[filepath]
+    path.reverse()
+    return path, total
+
+
+def _remaining_path(graph, durations):
+    # Longest duration from the start of each notebook to the end of the
+    # graph, used to start the notebooks on the critical path first
+    dependents = _dependents(graph)
+    remaining = {}
+    for filepath in reversed(graph):
+        remaining[filepath] = durations.get(filepath, 1.0) + max(
+            [remaining[dependent] for dependent in dependents[filepath]],
+            default=0.0)
+    return remaining
+
+
+def run_graph(
+        paths,
+        max_workers=None,
+        input_string_replacements=None,
+        dependencies=None,
+        durations=None,
+        fail_fast=False,
+        **execute_kwargs
+):
+    """Execute notebooks in parallel, respecting their dependencies
+
+    Each notebook starts as soon as all of its prerequisites have executed
+    successfully. When more notebooks are ready than there are workers, the
+    ones with the longest chain of dependents left start first. Notebooks
+    whose prerequisites failed are skipped.
+
+    Args:
+        paths (str or list(str)):
+            Notebook paths, directories or glob patterns. See
+            :func:`nbsampleutils.batch.find_notebooks`.
+        max_workers (int, optional):
+            Maximum number of notebooks to execute at once. Defaults to the
+            number of processors on the machine.
+        input_string_replacements (dict(str, str), optional):
+            Mapping of strings in cell inputs to replace before each notebook
+            is executed.
+        dependencies (dict(str, list(str)), optional):
+            Dependencies in addition to those declared in notebook metadata.
+            See :func:`build_graph`.
+        durations (dict(str, float), optional):
+            Expected seconds each notebook takes, for example from the
+            results of an earlier run, used to decide which ready notebooks
+            to start first.
+        fail_fast (bool):
+            If :data:`True`, cancel the rest of the graph after the first
+            notebook fails. See :func:`nbsampleutils.batch.run_batch`.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to
+            :func:`nbsampleutils.utils.run_from_filepath`.
+
+    Returns:
+        list(nbsampleutils.batch.NotebookResult):
+            One result per notebook in the graph, in dependency order.
+            Skipped notebooks have an error naming the failed prerequisite.
+
+    Raises:
+        ValueError:
+            If a prerequisite does not exist or the dependencies contain a
+            cycle.
+    """
+    graph = build_graph(paths, dependencies)
+    if not graph:
+        return []
+
+    execute_kwargs.setdefault("shutdown_kernel", "immediate")
+    max_workers = max_workers or os.cpu_count() or 1
+    priority = _remaining_path(graph, durations or {})
+    order = {filepath: index for index, filepath in enumerate(graph)}
+    dependents = _dependents(graph)
+    waiting = {
+        filepath: set(prerequisites)
+        for filepath, prerequisites in graph.items()
+    }
+    ready = [
+        (-priority[filepath], order[filepath], filepath)
+        for filepath, prerequisites in graph.items()
+        if not prerequisites
+    ]
+    heapq.heapify(ready)
+
+    manager = None
+    cancel_event = None
+    if fail_fast:
+        manager = multiprocessing.Manager()
+        cancel_event = manager.Event()
+
+    results = {}
+    running = {}
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers) as executor:
+            while ready or running:
+                while ready and len(running) < max_workers:
+                    _, _, filepath = heapq.heappop(ready)
+                    future = executor.submit(
+                        batch._run_notebook,
+                        filepath,
+                        input_string_replacements,
+                        cancel_event,
+                        execute_kwargs,
+                    )
+                    running[future] = filepath
+
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    filepath = running.pop(future)
+                    result = future.result()
+                    results[filepath] = result
+                    if result.error is not None:
+                        if fail_fast:
+                            cancel_event.set()
+                            ready = []
+                        _skip_dependents(filepath, dependents, results)
+                        continue
+                    for dependent in dependents[filepath]:
+                        waiting[dependent].discard(filepath)
+                        if not waiting[dependent] and dependent not in results:
+                            heapq.heappush(ready, (
+                                -priority[dependent],
+                                order[dependent],
+                                dependent,
+                            ))
+    finally:
+        if manager is not None:
+            manager.shutdown()
+
+    return [
+        results.get(filepath) or batch._cancelled_result(filepath)
+        for filepath in graph
+    ]
+
+
+def _skip_dependents(failed, dependents, results):
+    pending = list(dependents[failed])
+    while pending:
+        filepath = pending.pop()
+        if filepath in results:
+            continue
+        results[filepath] = batch.NotebookResult(
+            filepath=filepath,
+            notebook_node=None,
+            error="Skipped: prerequisite {} failed".format(failed),
+            duration=0.0,
+        )
+        pending.extend(dependents[filepath])
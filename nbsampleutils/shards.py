@@ -0,0 +1,197 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Split a batch of notebooks into shards to execute on separate machines
+
+Every runner computes the same partition from the same list of notebooks and
+the same timings file, so no coordination is needed between them. Each shard
+writes a results file, and :func:`merge_results` combines them afterwards.
+"""
+
+import json
+import os
+
+from nbsampleutils import batch
+
+
+def load_timings(path):
+    """Load the historical runtime of each notebook
+
+    Args:
+        path (str): JSON timings file written by :func:`write_timings`.
+
+    Returns:
+        dict(str, float):
+            Seconds each notebook took, by path. Empty if the file does not
+            exist yet.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as timings_file:
+        return json.load(timings_file)["notebooks"]
+
+
+def write_timings(results, path):
+    """Write the runtime of each notebook for balancing future shards
+
+    Only notebooks that ran successfully are recorded. Failed, cancelled
+    and skipped notebooks did not run to the end, so their earlier timings,
+    and timings of notebooks not in ``results``, are kept.
+
+    Args:
+        results (list(nbsampleutils.batch.NotebookResult)): Results of a run.
+        path (str): JSON timings file to update.
+    """
+    timings = load_timings(path)
+    for result in results:
+        if result.error is None:
+            timings[os.path.normpath(result.filepath)] = result.duration
+    with open(path, "w") as timings_file:
+        json.dump(
+            {"notebooks": timings}, timings_file, indent=1, sort_keys=True)
+        timings_file.write("\n")
+
+
+def partition(filepaths, shard_count, timings=None):
+    """Split notebooks into shards with similar total runtime
+
+    Notebooks are assigned longest first to the shard with the least work
+    so far. Notebooks without a recorded timing count as the average of
+    the recorded ones. The result only depends on the arguments, not on
+    their order.
+
+    Args:
+        filepaths (list(str)): Notebook paths.
+        shard_count (int): Number of shards.
+        timings (dict(str, float), optional):
+            Historical seconds per notebook, as from :func:`load_timings`.
+
+    Returns:
+        list(list(str)): The sorted notebook paths of each shard.
+    """
+    if shard_count < 1:
+        raise ValueError("shard_count must be at least 1")
+    timings = timings or {}
+    filepaths = sorted(set(os.path.normpath(path) for path in filepaths))
+    known = [timings[path] for path in filepaths if path in timings]
+    default = sum(known) / len(known) if known else 1.0
+
+    shards = [[] for _ in range(shard_count)]
+    totals = [0.0] * shard_count
+    for filepath in sorted(
+            filepaths, key=lambda path: (-timings.get(path, default), path)):
+        index = min(range(shard_count), key=lambda index: totals[index])
+        shards[index].append(filepath)
+        totals[index] += timings.get(filepath, default)
+    return [sorted(shard) for shard in shards]
+
+
+def select_shard(filepaths, shard_index, shard_count, timings=None):
+    """Return the notebooks that belong to one shard
+
+    Args:
+        filepaths (list(str)): All notebook paths in the batch.
+        shard_index (int): Index of the shard, from 0 to ``shard_count - 1``.
+        shard_count (int): Number of shards.
+        timings (dict(str, float), optional):
+            Historical seconds per notebook. See :func:`partition`.
+
+    Returns:
+        list(str): The sorted notebook paths of the shard.
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError("shard_index must be between 0 and {}".format(
+            shard_count - 1))
+    return partition(filepaths, shard_count, timings)[shard_index]
+
+
+def write_results(results, path, shard_index=0, shard_count=1):
+    """Write the results of one shard to a JSON file
+
+    Executed notebooks are not included, only their paths, errors and
+    durations.
+
+    Args:
+        results (list(nbsampleutils.batch.NotebookResult)):
+            Results of executing the shard.
+        path (str): File to write.
+        shard_index (int): Index of the shard.
+        shard_count (int): Number of shards.
+    """
+    with open(path, "w") as results_file:
+        json.dump(
+            {
+                "shard_index": shard_index,
+                "shard_count": shard_count,
+                "notebooks": [
+                    {
+                        "filepath": result.filepath,
+                        "error": result.error,
+                        "duration": result.duration,
+                    }
+                    for result in results
+                ],
+            },
+            results_file,
+            indent=1,
+        )
+        results_file.write("\n")
+
+
+def merge_results(paths):
+    """Combine the results files of all shards of a run
+
+    Args:
+        paths (list(str)): Results files written by :func:`write_results`.
+
+    Returns:
+        list(nbsampleutils.batch.NotebookResult):
+            Results of every notebook, sorted by path, without the executed
+            notebooks.
+
+    Raises:
+        ValueError:
+            If the files come from runs with different shard counts, or a
+            shard is missing or included twice.
+    """
+    shard_count = None
+    shard_indices = set()
+    results = []
+    for path in paths:
+        with open(path) as results_file:
+            shard = json.load(results_file)
+        if shard_count is None:
+            shard_count = shard["shard_count"]
+        elif shard["shard_count"] != shard_count:
+            raise ValueError(
+                "{} is one of {} shards, expected {}".format(
+                    path, shard["shard_count"], shard_count))
+        if shard["shard_index"] in shard_indices:
+            raise ValueError("Shard {} is included more than once".format(
+                shard["shard_index"]))
+        shard_indices.add(shard["shard_index"])
+        results.extend(
+            batch.NotebookResult(
+                filepath=notebook["filepath"],
+                notebook_node=None,
+                error=notebook["error"],
+                duration=notebook["duration"],
+            )
+            for notebook in shard["notebooks"]
+        )
+
+    missing = set(range(shard_count or 0)) - shard_indices
+    if missing:
+        raise ValueError("Missing results of shards: {}".format(
+            ", ".join(str(index) for index in sorted(missing))))
+    return sorted(results, key=lambda result: result.filepath)
@@ -0,0 +1,50 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Removal of CSS styling from notebook HTML"""
+
+import re
+
+
+_STYLE_TAG_RE = re.compile(r"<style\b[^>]*>.*?</style\s*>", re.I | re.S)
+# Opening <table> and <tr> tags, allowing ">" inside quoted attribute values
+_TABLE_TAG_RE = re.compile(
+    r"<(table|tr)"
+    r"""(?:\s+[^\s=>/]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'>]+))?)*"""
+    r"\s*>",
+    re.I,
+)
+
+
+def strip_styles(html):
+    """Remove CSS styling from HTML embedded in a markdown document
+
+    Removes ``<style>`` elements and all attributes of ``<table>`` and
+    ``<tr>`` tags (which carry dataframe styles). Only those tags are
+    rewritten; the rest of the document is returned byte for byte, so
+    markdown such as ``a < b`` in code blocks is left untouched.
+
+    Args:
+        html (str): Markdown or HTML text to strip styles from.
+
+    Returns:
+        str: The text without styles.
+    """
+    if "<" not in html:
+        return html
+    html = _STYLE_TAG_RE.sub("", html)
+    return _TABLE_TAG_RE.sub(_strip_attributes, html)
+
+
+def _strip_attributes(match):
+    return "<{}>".format(match.group(1).lower())
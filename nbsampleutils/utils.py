@@ -13,32 +13,93 @@
 # limitations under the License.
 """Utility functions for working with Jupyter notebooks in Python."""
 
+import asyncio
+import json
 import os
+import queue
+import threading
+import time
 
+import nbclient
 import nbconvert
 import nbformat
 
+from nbsampleutils import deadlines
+from nbsampleutils import kernels
 from nbsampleutils import preprocessors
+from nbsampleutils import profiling
+from nbsampleutils import progress
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def get_notebook_from_filepath(filepath):
+
+def get_notebook_from_filepath(filepath, validate=True, lazy_outputs=False):
     """Construct a nbformat.v4.NotebookNode from a local Jupyter notebook
 
+    Version 4 notebooks are parsed directly, with `orjson` if it is
+    installed, instead of going through ``nbformat.read``. Older notebook
+    formats are converted with ``nbformat.read``.
+
     Args:
         filepath (str):
             Local path to the `.ipynb` file to open and use to construct a
             nbformat.v4.NotebookNode instance.
+        validate (bool):
+            If :data:`True` (the default), the notebook is checked against
+            the notebook format schema and errors are logged, as with
+            ``nbformat.read``. Pass :data:`False` to skip the check for
+            trusted notebooks.
+        lazy_outputs (bool):
+            If :data:`True`, cell outputs are only converted to notebook
+            nodes (and validated) when a cell's outputs are first accessed.
+            Tools that only look at cell sources or metadata then skip the
+            work for large embedded outputs such as images.
 
     Returns:
         nbformat.v4.NotebookNode: NotebookNode constructed from the `filepath`.
     """
-    with open(filepath) as notebook_file:
-        return nbformat.read(notebook_file, as_version=4)
+    with open(filepath, "rb") as notebook_file:
+        contents = notebook_file.read()
+
+    notebook_dict = _loads_json(contents)
+    if notebook_dict.get("nbformat") != 4:
+        return nbformat.reads(contents.decode("utf-8"), as_version=4)
+
+    version_minor = notebook_dict.get("nbformat_minor")
+    if not lazy_outputs:
+        notebook_node = _normalize(nbformat.from_dict(notebook_dict))
+        if validate:
+            _validate(notebook_node, version_minor=version_minor)
+        return notebook_node
+
+    # Outputs are validated when they are materialized
+    cells = notebook_dict.setdefault("cells", [])
+    outputs = [cell.pop("outputs", None) for cell in cells]
+    if validate:
+        for cell, cell_outputs in zip(cells, outputs):
+            if cell_outputs is not None:
+                cell["outputs"] = []
+        _validate(notebook_dict, version_minor=version_minor)
+        for cell in cells:
+            cell.pop("outputs", None)
+
+    notebook_node = _normalize(nbformat.from_dict(notebook_dict))
+    notebook_node.cells = [
+        _lazy_cell(cell, cell_outputs, validate, version_minor)
+        for cell, cell_outputs in zip(notebook_node.cells, outputs)
+    ]
+    return notebook_node
 
 
 def get_output_text(cell):
     """Returns the output text of a cell.
 
+    To check the outputs of many cells, build a
+    :class:`nbsampleutils.outputs.OutputIndex` once instead.
+
     Args:
         cell (nbformat.NotebookNode):
             A cell from a NotebookNode (ex. `notebook_node.cells[0]`)
@@ -82,6 +143,14 @@ def make_notebook_node(code_cell_contents):
 def run_from_filepath(
         filepath,
         input_string_replacements=None,
+        kernel_pool=None,
+        cache=None,
+        profile=False,
+        notebook_timeout=None,
+        cancel_event=None,
+        result_store=None,
+        on_cell=None,
+        output_limits=None,
         **execute_kwargs
 ):
     """Utility to execute and export notebooks
@@ -91,6 +160,31 @@ def run_from_filepath(
         input_string_replacements (dict(str, str), optional):
             Mapping of strings in cell inputs to replace before the notebook is
             executed.
+        kernel_pool (nbsampleutils.kernels.KernelPool, optional):
+            Pool to take a warm kernel from instead of starting a new one.
+        cache (nbsampleutils.cache.ExecutionCache, optional):
+            Cache of executed notebooks. If the notebook was executed before
+            with the same inputs, the stored result is returned instead.
+        profile (bool):
+            If :data:`True`, record per-cell timings in the notebook's
+            metadata. See :class:`nbsampleutils.profiling.CellProfiler`.
+        notebook_timeout (float, optional):
+            Maximum time in seconds for executing the whole notebook. Each
+            cell's timeout is shortened to the time left.
+        cancel_event (threading.Event, optional):
+            Event which cancels execution when set. A running cell is
+            stopped by killing its kernel, and
+            :class:`nbsampleutils.deadlines.ExecutionCancelled` is raised.
+        result_store (nbsampleutils.history.ResultStore, optional):
+            Store in which to record the run, whether or not it succeeds.
+        on_cell (callable, optional):
+            Called with ``cell`` and ``cell_index`` as soon as each code cell
+            finishes executing. Raise
+            :class:`nbsampleutils.progress.StopExecution` from it to stop
+            early and return the cells executed so far.
+        output_limits (nbsampleutils.limits.OutputLimits, optional):
+            Budgets for the size of the captured outputs. Outputs over
+            budget are truncated as they arrive.
         execute_kwargs (dict, optional):
             Key word arguments to pass to
             ``nbconvert.preprocessors.execute.ExecutePreprocessor``.
@@ -101,10 +195,86 @@ def run_from_filepath(
     notebook_path, _ = os.path.split(filepath)
     notebook_node = get_notebook_from_filepath(filepath)
 
-    return run_notebook_node(
+    started = time.time()
+    status = "error"
+    try:
+        run_notebook_node(
+            notebook_node,
+            notebook_path=notebook_path,
+            input_string_replacements=input_string_replacements,
+            kernel_pool=kernel_pool,
+            cache=cache,
+            profile=profile,
+            notebook_timeout=notebook_timeout,
+            cancel_event=cancel_event,
+            on_cell=on_cell,
+            output_limits=output_limits,
+            **execute_kwargs)
+        status = "ok"
+    finally:
+        if result_store is not None:
+            result_store.record(
+                filepath,
+                notebook_node,
+                status=status,
+                duration=time.time() - started,
+                started=started,
+            )
+    return notebook_node
+
+
+async def async_run_from_filepath(
+        filepath,
+        input_string_replacements=None,
+        semaphore=None,
+        profile=False,
+        notebook_timeout=None,
+        on_cell=None,
+        output_limits=None,
+        **execute_kwargs
+):
+    """Asynchronously execute a notebook file
+
+    Args:
+        filepath (str): Path to the notebook file to execute
+        input_string_replacements (dict(str, str), optional):
+            Mapping of strings in cell inputs to replace before the notebook is
+            executed.
+        semaphore (asyncio.Semaphore, optional):
+            Semaphore to hold while the notebook executes. Share one semaphore
+            between calls to limit how many kernels run at once.
+        profile (bool):
+            If :data:`True`, record per-cell timings in the notebook's
+            metadata. See :class:`nbsampleutils.profiling.CellProfiler`.
+        notebook_timeout (float, optional):
+            Maximum time in seconds for executing the whole notebook. Each
+            cell's timeout is shortened to the time left.
+        on_cell (callable, optional):
+            Called with ``cell`` and ``cell_index`` as soon as each code cell
+            finishes executing, and awaited if it is a coroutine function.
+            Raise :class:`nbsampleutils.progress.StopExecution` from it to
+            stop early and return the cells executed so far.
+        output_limits (nbsampleutils.limits.OutputLimits, optional):
+            Budgets for the size of the captured outputs. Outputs over
+            budget are truncated as they arrive.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to ``nbclient.NotebookClient``.
+
+    Returns:
+        nbformat.NotebookNode: The executed notebook node.
+    """
+    notebook_path, _ = os.path.split(filepath)
+    notebook_node = get_notebook_from_filepath(filepath)
+
+    return await async_run_notebook_node(
         notebook_node,
         notebook_path=notebook_path,
         input_string_replacements=input_string_replacements,
+        semaphore=semaphore,
+        profile=profile,
+        notebook_timeout=notebook_timeout,
+        on_cell=on_cell,
+        output_limits=output_limits,
         **execute_kwargs)
 
 
@@ -112,10 +282,21 @@ def run_notebook_node(
         notebook_node,
         notebook_path=None,
         input_string_replacements=None,
+        kernel_pool=None,
+        cache=None,
+        profile=False,
+        notebook_timeout=None,
+        cancel_event=None,
+        on_cell=None,
+        output_limits=None,
         **execute_kwargs
 ):
     """Execute a notebook node
 
+    Cells can override the cell timeout with
+    ``metadata["nbsampleutils"]["timeout"]``. See
+    :func:`nbsampleutils.deadlines.cell_timeout`.
+
     Args:
         notebook_node (nbformat.v4.NotebookNode): A notebook node to execute
         notebook_path (str, optional):
@@ -123,6 +304,31 @@ def run_notebook_node(
         input_string_replacements (dict(str, str), optional):
             Mapping of strings in cell inputs to replace before the notebook is
             executed.
+        kernel_pool (nbsampleutils.kernels.KernelPool, optional):
+            Pool to take a warm kernel from instead of starting a new one.
+            The kernel's namespace is reset when it is returned to the pool.
+        cache (nbsampleutils.cache.ExecutionCache, optional):
+            Cache of executed notebooks. On a hit, the stored outputs are
+            copied into ``notebook_node`` and no kernel is started. Not used
+            when ``profile`` is :data:`True`.
+        profile (bool):
+            If :data:`True`, record per-cell timings in the notebook's
+            metadata. See :class:`nbsampleutils.profiling.CellProfiler`.
+        notebook_timeout (float, optional):
+            Maximum time in seconds for executing the whole notebook. Each
+            cell's timeout is shortened to the time left.
+        cancel_event (threading.Event, optional):
+            Event which cancels execution when set. A running cell is
+            stopped by killing its kernel, and
+            :class:`nbsampleutils.deadlines.ExecutionCancelled` is raised.
+        on_cell (callable, optional):
+            Called with ``cell`` and ``cell_index`` as soon as each code cell
+            finishes executing. Raise
+            :class:`nbsampleutils.progress.StopExecution` from it to stop
+            early and return the cells executed so far.
+        output_limits (nbsampleutils.limits.OutputLimits, optional):
+            Budgets for the size of the captured outputs. Outputs over
+            budget are truncated as they arrive.
         execute_kwargs (dict, optional):
             Key word arguments to pass to
             ``nbconvert.preprocessors.execute.ExecutePreprocessor``.
@@ -130,6 +336,31 @@ def run_notebook_node(
     Returns:
         nbformat.NotebookNode: The executed notebook node.
     """
+    if profile:
+        # Profiles time this run, so neither reuse nor store cached results
+        cache = None
+
+    if cache is not None:
+        key_kwargs = execute_kwargs
+        if output_limits is not None:
+            key_kwargs = dict(execute_kwargs, output_limits=output_limits)
+        cache_key = cache.key(
+            notebook_node,
+            input_string_replacements=input_string_replacements,
+            kernel_name=execute_kwargs.get("kernel_name"),
+            execute_kwargs=key_kwargs,
+        )
+        cached_node = cache.get(cache_key)
+        if cached_node is not None:
+            notebook_node.clear()
+            notebook_node.update(cached_node)
+            if on_cell is not None:
+                try:
+                    progress.replay(notebook_node, on_cell)
+                except progress.StopExecution:
+                    pass
+            return notebook_node
+
     # Create notebook resources, setting the path to run the notebook from
     if notebook_path:
         resources = {"metadata": {"path": notebook_path}}
@@ -143,8 +374,310 @@ def run_notebook_node(
         )
         preprocessor.preprocess(notebook_node, resources)
 
+    try:
+        _execute(
+            notebook_node,
+            resources,
+            kernel_pool,
+            profile,
+            notebook_timeout,
+            cancel_event,
+            on_cell,
+            output_limits,
+            execute_kwargs,
+        )
+    except progress.StopExecution:
+        # A partly executed notebook is not cached
+        return notebook_node
+
+    if cache is not None:
+        cache.put(cache_key, notebook_node)
+
+    return notebook_node
+
+
+def iter_cells(notebook_node, **kwargs):
+    """Execute a notebook node, yielding each code cell as it finishes
+
+    The notebook executes in a background thread. Each code cell is yielded
+    with its outputs as soon as it finishes, so callers can show progress,
+    write outputs or export the finished part of the notebook while later
+    cells still run. Closing the generator early (for example by breaking
+    out of the loop) kills the kernel and stops execution.
+
+    Example::
+
+        for cell_index, cell in utils.iter_cells(notebook_node):
+            if "Traceback" in utils.get_output_text(cell):
+                break
+
+    Args:
+        notebook_node (nbformat.v4.NotebookNode): A notebook node to execute.
+        kwargs (dict, optional):
+            Key word arguments to pass to :func:`run_notebook_node`, other
+            than ``on_cell`` and ``cancel_event``.
+
+    Yields:
+        tuple(int, nbformat.NotebookNode): The index and executed cell.
+
+    Raises:
+        Exception: Any error raised while executing the notebook, after the
+            cells executed before it were yielded.
+    """
+    finished = object()
+    cells = queue.Queue()
+    cancel_event = threading.Event()
+
+    def on_cell(cell, cell_index):
+        cells.put((cell_index, cell))
+
+    def run():
+        try:
+            run_notebook_node(
+                notebook_node,
+                on_cell=on_cell,
+                cancel_event=cancel_event,
+                **kwargs)
+        except Exception as exc:
+            cells.put(exc)
+        else:
+            cells.put(finished)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = cells.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancel_event.set()
+        thread.join()
+
+
+def _execute(
+        notebook_node,
+        resources,
+        kernel_pool,
+        profile,
+        notebook_timeout,
+        cancel_event,
+        on_cell,
+        output_limits,
+        execute_kwargs,
+):
     processor = nbconvert.preprocessors.execute.ExecutePreprocessor(
         **execute_kwargs)
-    processor.preprocess(notebook_node, resources)
+    deadline = deadlines.Deadline(
+        cell_timeout=processor.timeout,
+        notebook_timeout=notebook_timeout,
+        cancel_event=cancel_event,
+    )
+    if processor.timeout_func is None:
+        processor.timeout_func = deadline.timeout_func
+    if output_limits is not None:
+        output_limits.attach(processor)
+    if profile:
+        profiling.CellProfiler().attach(processor)
+    if on_cell is not None:
+        progress.attach_callback(processor, on_cell)
+
+    deadline.check()
+    if kernel_pool is None:
+        with deadline.watch(processor):
+            processor.preprocess(notebook_node, resources)
+        return
 
+    kernel_name = (
+        processor.kernel_name
+        or notebook_node.metadata.get("kernelspec", {}).get("name")
+        or kernels.DEFAULT_KERNEL_NAME
+    )
+    notebook_path = resources.get("metadata", {}).get("path")
+    with kernel_pool.kernel(kernel_name, cwd=notebook_path) as kernel_manager:
+        try:
+            with deadline.watch(processor):
+                processor.preprocess(
+                    notebook_node, resources, km=kernel_manager)
+        finally:
+            # The preprocessor only cleans up clients for kernels it owns
+            if processor.kc is not None:
+                processor.kc.stop_channels()
+
+
+async def async_run_notebook_node(
+        notebook_node,
+        notebook_path=None,
+        input_string_replacements=None,
+        semaphore=None,
+        profile=False,
+        notebook_timeout=None,
+        on_cell=None,
+        output_limits=None,
+        **execute_kwargs
+):
+    """Asynchronously execute a notebook node
+
+    Kernel I/O runs on the event loop, so many notebooks can execute
+    concurrently from one thread. If the task is cancelled, the notebook's
+    kernel is shut down before the cancellation propagates.
+
+    Args:
+        notebook_node (nbformat.v4.NotebookNode): A notebook node to execute
+        notebook_path (str, optional):
+            File path to use for executing the notebook.
+        input_string_replacements (dict(str, str), optional):
+            Mapping of strings in cell inputs to replace before the notebook is
+            executed.
+        semaphore (asyncio.Semaphore, optional):
+            Semaphore to hold while the notebook executes. Share one semaphore
+            between calls to limit how many kernels run at once.
+        profile (bool):
+            If :data:`True`, record per-cell timings in the notebook's
+            metadata. See :class:`nbsampleutils.profiling.CellProfiler`.
+        notebook_timeout (float, optional):
+            Maximum time in seconds for executing the whole notebook. Each
+            cell's timeout is shortened to the time left.
+        on_cell (callable, optional):
+            Called with ``cell`` and ``cell_index`` as soon as each code cell
+            finishes executing, and awaited if it is a coroutine function.
+            Raise :class:`nbsampleutils.progress.StopExecution` from it to
+            stop early and return the cells executed so far.
+        output_limits (nbsampleutils.limits.OutputLimits, optional):
+            Budgets for the size of the captured outputs. Outputs over
+            budget are truncated as they arrive.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to ``nbclient.NotebookClient``.
+
+    Returns:
+        nbformat.NotebookNode: The executed notebook node.
+    """
+    if notebook_path:
+        resources = {"metadata": {"path": notebook_path}}
+    else:
+        resources = {}
+
+    if input_string_replacements:
+        preprocessor = preprocessors.ReplaceCodeInputStringsPreprocessor(
+            string_replacements=input_string_replacements
+        )
+        preprocessor.preprocess(notebook_node, resources)
+
+    client = nbclient.NotebookClient(
+        notebook_node, resources=resources, **execute_kwargs)
+    if output_limits is not None:
+        output_limits.attach(client)
+    if profile:
+        profiling.CellProfiler().attach(client)
+    if on_cell is not None:
+        progress.attach_callback(client, on_cell)
+    try:
+        if semaphore is None:
+            await _execute_cancellable(client, notebook_timeout)
+        else:
+            async with semaphore:
+                await _execute_cancellable(client, notebook_timeout)
+    except progress.StopExecution:
+        pass
+
+    return notebook_node
+
+
+async def _execute_cancellable(client, notebook_timeout):
+    # Start the deadline once the notebook is allowed to run
+    deadline = deadlines.Deadline(
+        cell_timeout=client.timeout, notebook_timeout=notebook_timeout)
+    if client.timeout_func is None:
+        client.timeout_func = deadline.timeout_func
+
+    # nbclient reports a cancelled execution as a dead kernel, so run it in a
+    # separate task and re-raise the cancellation once the kernel is shut down
+    execution = asyncio.ensure_future(client.async_execute())
+    try:
+        with deadline.watch(client):
+            await asyncio.shield(execution)
+    except asyncio.CancelledError:
+        execution.cancel()
+        try:
+            await execution
+        except Exception:
+            pass
+        raise
+
+
+def _loads_json(contents):
+    if orjson is not None:
+        return orjson.loads(contents)
+    return json.loads(contents.decode("utf-8"))
+
+
+def _normalize(notebook_node):
+    # Join multiline text and drop transient metadata, as nbformat.read does
+    nbformat.v4.rwbase.rejoin_lines(notebook_node)
+    nbformat.v4.rwbase.strip_transient(notebook_node)
     return notebook_node
+
+
+def _validate(nbdict, version_minor=None):
+    # Log schema errors instead of raising, as nbformat.read does
+    try:
+        nbformat.validate(nbdict, version=4, version_minor=version_minor)
+    except nbformat.ValidationError as exc:
+        nbformat.get_logger().error("Notebook JSON is invalid: %s", exc)
+
+
+def _lazy_cell(cell, outputs, validate, version_minor):
+    cell = _LazyCell(cell)
+    if outputs is not None:
+        dict.__setitem__(
+            cell, "outputs", _RawOutputs(outputs, validate, version_minor))
+    return cell
+
+
+class _RawOutputs(list):
+    # Parsed outputs of a cell that have not been converted to nodes yet
+
+    def __init__(self, outputs, validate, version_minor):
+        super().__init__(outputs)
+        self.validate = validate
+        self.version_minor = version_minor
+
+    def materialize(self):
+        cell = nbformat.v4.new_code_cell()
+        cell.outputs = nbformat.from_dict(list(self))
+        if self.version_minor is not None and self.version_minor < 5:
+            del cell["id"]
+        notebook_node = nbformat.v4.new_notebook(
+            nbformat_minor=self.version_minor)
+        notebook_node.cells = [cell]
+        if self.validate:
+            # Validating a whole notebook reuses nbformat's cached validator,
+            # which is much faster than validating the outputs on their own
+            _validate(notebook_node, version_minor=self.version_minor)
+        _normalize(notebook_node)
+        return cell.outputs
+
+
+class _LazyCell(nbformat.NotebookNode):
+    # Cell whose outputs are converted to nodes when first accessed
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, _RawOutputs):
+            value = value.materialize()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
@@ -0,0 +1,234 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Check that notebooks still produce the outputs saved in them"""
+
+import collections
+import concurrent.futures
+import difflib
+import os
+import time
+
+from nbsampleutils import METADATA_KEY
+from nbsampleutils import batch
+from nbsampleutils import replace
+from nbsampleutils import utils
+
+
+# Regular expressions for output text that changes from run to run
+DEFAULT_NORMALIZERS = {
+    # Memory addresses, as in "<object at 0x7f3a2c1b9d30>"
+    r"\b0x[0-9a-fA-F]{6,}\b": "0x...",
+    # ISO 8601 timestamps
+    r"\b\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?"
+    r"(?:Z|[+-]\d{2}:?\d{2})?": "<timestamp>",
+    # Timings printed by the %time and %timeit magics
+    r"(CPU times|Wall time): [^\n]*": r"\1: <time>",
+    r"[\d.]+ [mun]?s \xb1 [\d.]+ [mun]?s per loop[^\n]*": "<timeit>",
+}
+
+
+CellDiff = collections.namedtuple(
+    "CellDiff", ["cell_index", "expected", "actual", "diff"])
+CellDiff.__doc__ = """A cell whose fresh output differs from its saved output
+
+Attributes:
+    cell_index (int): Index of the cell in the notebook.
+    expected (str): Normalized output text saved in the notebook.
+    actual (str): Normalized output text after executing the notebook.
+    diff (str): Unified diff from ``expected`` to ``actual``.
+"""
+
+VerifyResult = collections.namedtuple(
+    "VerifyResult", ["filepath", "diffs", "error", "duration"])
+VerifyResult.__doc__ = """Outcome of verifying a single notebook in a batch
+
+Attributes:
+    filepath (str): Path to the verified notebook.
+    diffs (list(CellDiff)): Cells whose output changed.
+    error (str):
+        Description of the error raised while executing the notebook, or
+        :data:`None` if execution succeeded.
+    duration (float): Wall time in seconds spent verifying the notebook.
+"""
+
+
+def _should_verify(cell):
+    if cell.cell_type != "code":
+        return False
+    return cell.metadata.get(METADATA_KEY, {}).get("verify", True)
+
+
+def compare_text(expected, actual, normalizers=None):
+    """Compare the output text of a cell with its expected text
+
+    Identical text is accepted without normalizing it. Otherwise both are
+    normalized, and a diff is only computed if they still differ.
+
+    Args:
+        expected (str): Saved output text.
+        actual (str): Fresh output text.
+        normalizers (dict(str, str) or nbsampleutils.replace.StringReplacer):
+            Regular expressions for volatile text and their replacements.
+            Defaults to :data:`DEFAULT_NORMALIZERS`.
+
+    Returns:
+        CellDiff:
+            The difference, with ``cell_index`` set to :data:`None`, or
+            :data:`None` if the texts match.
+    """
+    if expected == actual:
+        return None
+    normalizer = _normalizer(normalizers)
+    expected = normalizer.replace(expected)
+    actual = normalizer.replace(actual)
+    if expected == actual:
+        return None
+    diff = "".join(difflib.unified_diff(
+        expected.splitlines(True),
+        actual.splitlines(True),
+        fromfile="expected",
+        tofile="actual",
+    ))
+    return CellDiff(
+        cell_index=None, expected=expected, actual=actual, diff=diff)
+
+
+def _normalizer(normalizers):
+    if normalizers is None:
+        normalizers = DEFAULT_NORMALIZERS
+    return replace.as_replacer(normalizers, regex=True)
+
+
+def verify_notebook_node(notebook_node, normalizers=None, **execute_kwargs):
+    """Execute a notebook and compare its outputs with the saved ones
+
+    The text of each code cell's outputs (see
+    :func:`nbsampleutils.utils.get_output_text`) is compared before and
+    after execution. Cells with ``metadata["nbsampleutils"]["verify"]`` set
+    to :data:`False` are not compared. Other outputs, such as images, are
+    not compared.
+
+    Args:
+        notebook_node (nbformat.NotebookNode):
+            A notebook with saved outputs. It is executed in place.
+        normalizers (dict(str, str) or nbsampleutils.replace.StringReplacer):
+            Regular expressions for volatile text and their replacements.
+            Defaults to :data:`DEFAULT_NORMALIZERS`.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to
+            :func:`nbsampleutils.utils.run_notebook_node`.
+
+    Returns:
+        list(CellDiff): The cells whose output changed.
+    """
+    expected = [
+        utils.get_output_text(cell) if _should_verify(cell) else None
+        for cell in notebook_node.cells
+    ]
+    utils.run_notebook_node(notebook_node, **execute_kwargs)
+
+    normalizer = _normalizer(normalizers)
+    diffs = []
+    for cell_index, (cell, text) in enumerate(
+            zip(notebook_node.cells, expected)):
+        if text is None:
+            continue
+        diff = compare_text(text, utils.get_output_text(cell), normalizer)
+        if diff is not None:
+            diffs.append(diff._replace(cell_index=cell_index))
+    return diffs
+
+
+def verify_from_filepath(filepath, normalizers=None, **execute_kwargs):
+    """Execute a notebook file and compare its outputs with the saved ones
+
+    Args:
+        filepath (str): Path to the notebook file to verify.
+        normalizers (dict(str, str) or nbsampleutils.replace.StringReplacer):
+            Regular expressions for volatile text and their replacements.
+            Defaults to :data:`DEFAULT_NORMALIZERS`.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to
+            :func:`nbsampleutils.utils.run_notebook_node`.
+
+    Returns:
+        list(CellDiff): The cells whose output changed.
+    """
+    notebook_path, _ = os.path.split(filepath)
+    return verify_notebook_node(
+        utils.get_notebook_from_filepath(filepath),
+        normalizers=normalizers,
+        notebook_path=notebook_path,
+        **execute_kwargs)
+
+
+def verify_batch(
+        paths, max_workers=None, normalizers=None, **execute_kwargs):
+    """Verify many notebooks in a pool of worker processes
+
+    Each worker executes and compares its notebook, and only sends the
+    differences back, so the executed notebooks are never copied between
+    processes.
+
+    Args:
+        paths (str or list(str)):
+            Notebook paths, directories or glob patterns. See
+            :func:`nbsampleutils.batch.find_notebooks`.
+        max_workers (int, optional):
+            Maximum number of notebooks to verify at once. Defaults to the
+            number of processors on the machine.
+        normalizers (dict(str, str) or nbsampleutils.replace.StringReplacer):
+            Regular expressions for volatile text and their replacements.
+            Defaults to :data:`DEFAULT_NORMALIZERS`.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to
+            :func:`nbsampleutils.utils.run_notebook_node`.
+
+    Returns:
+        list(VerifyResult): One result per notebook, in path order.
+    """
+    filepaths = batch.find_notebooks(paths)
+    if not filepaths:
+        return []
+
+    execute_kwargs.setdefault("shutdown_kernel", "immediate")
+    normalizer = _normalizer(normalizers)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_verify, filepath, normalizer, execute_kwargs)
+            for filepath in filepaths
+        ]
+        return [future.result() for future in futures]
+
+
+def _verify(filepath, normalizer, execute_kwargs):
+    # Runs in a worker process, like nbsampleutils.batch._run_notebook
+    start = time.perf_counter()
+    try:
+        diffs = verify_from_filepath(
+            filepath, normalizers=normalizer, **execute_kwargs)
+    except Exception as exc:
+        return VerifyResult(
+            filepath=filepath,
+            diffs=[],
+            error="{}: {}".format(type(exc).__name__, exc),
+            duration=time.perf_counter() - start,
+        )
+    return VerifyResult(
+        filepath=filepath,
+        diffs=diffs,
+        error=None,
+        duration=time.perf_counter() - start,
+    )
@@ -0,0 +1,358 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Re-execute and re-export notebooks when they change on disk"""
+
+import collections
+import hashlib
+import json
+import os
+import time
+
+from nbsampleutils import batch
+from nbsampleutils import export
+from nbsampleutils import incremental
+from nbsampleutils import manifest as manifest_module
+from nbsampleutils import utils
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+STATE_DIRNAME = ".nbsampleutils-watch"
+
+
+BuildResult = collections.namedtuple(
+    "BuildResult", ["filepath", "error", "duration", "executed_from"])
+BuildResult.__doc__ = """Outcome of rebuilding a changed notebook
+
+Attributes:
+    filepath (str): Path to the notebook.
+    error (str):
+        Description of the error raised while rebuilding the notebook, or
+        :data:`None` if it succeeded.
+    duration (float): Wall time in seconds spent rebuilding the notebook.
+    executed_from (int):
+        Index of the first cell that was executed, or the number of cells if
+        none had to be, or :data:`None` if the notebook was not executed.
+"""
+
+
+def _signature(filepath):
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class NotebookWatcher(object):
+    """Keeps the markdown exports of a directory of notebooks up to date
+
+    Every notebook below ``root`` gets an
+    :class:`nbsampleutils.incremental.IncrementalRunner` with its own warm
+    kernel. When a notebook is saved, only the cells from the first changed
+    code cell onwards are executed again, and the export is written through
+    a :class:`nbsampleutils.manifest.BuildManifest` so only the markdown and
+    resource files whose bytes changed are rewritten. Recorded outputs are
+    kept in a ``.nbsampleutils-watch`` directory, so restarting the watcher
+    does not execute unchanged notebooks again.
+
+    Changes are detected with inotify if the ``inotify_simple`` package is
+    installed, and by polling file modification times otherwise. Bursts of
+    saves are debounced, so a notebook is rebuilt once the files have been
+    quiet for ``debounce`` seconds.
+
+    Args:
+        root (str): Directory of notebooks to watch, including subdirectories.
+        output_dir (str, optional):
+            Directory to write markdown files to. Defaults to each notebook's
+            directory.
+        execute (bool):
+            Whether to execute notebooks before exporting them. Defaults to
+            :data:`True`.
+        input_string_replacements (dict(str, str), optional):
+            Mapping of strings in cell inputs to replace before execution.
+        output_string_replacements (dict(str, str), optional):
+            Mapping of strings to replace in the markdown files.
+        debounce (float): Seconds without changes to wait before rebuilding.
+        poll_interval (float):
+            Seconds between checks for changes when polling, and the longest
+            :meth:`watch` takes to notice that it should stop.
+        use_inotify (bool, optional):
+            Whether to use inotify. Defaults to using it if available.
+        execute_kwargs (dict, optional):
+            Key word arguments to pass to
+            :class:`nbsampleutils.incremental.IncrementalRunner`.
+    """
+
+    def __init__(
+            self,
+            root,
+            output_dir=None,
+            execute=True,
+            input_string_replacements=None,
+            output_string_replacements=None,
+            debounce=0.5,
+            poll_interval=1.0,
+            use_inotify=None,
+            **execute_kwargs
+    ):
+        if use_inotify is None:
+            use_inotify = inotify_simple is not None
+        elif use_inotify and inotify_simple is None:
+            raise ImportError(
+                "Watching with inotify requires the inotify_simple package")
+        self.root = root
+        self.output_dir = output_dir
+        self.execute = execute
+        self.input_string_replacements = input_string_replacements
+        self.output_string_replacements = output_string_replacements
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.execute_kwargs = execute_kwargs
+        self.manifest = manifest_module.BuildManifest(output_dir or root)
+        self.exporter = export.Exporter()
+        self._state_dir = os.path.join(output_dir or root, STATE_DIRNAME)
+        self._runners = {}
+        self._built = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Shut down the kernels and save the manifest"""
+        for runner in self._runners.values():
+            runner.shutdown()
+        self._runners.clear()
+        self.manifest.save()
+
+    def build_changed(self):
+        """Rebuild every notebook that changed since it was last built
+
+        Notebooks that were exported with the same inputs by an earlier
+        watcher are not rebuilt when first seen.
+
+        Returns:
+            list(BuildResult): Results of the rebuilt notebooks.
+        """
+        current = {
+            filepath: _signature(filepath)
+            for filepath in batch.find_notebooks(self.root)
+        }
+        for filepath in set(self._built) - set(current):
+            del self._built[filepath]
+            runner = self._runners.pop(filepath, None)
+            if runner is not None:
+                runner.shutdown()
+
+        results = []
+        for filepath, signature in sorted(current.items()):
+            if signature is None or self._built.get(filepath) == signature:
+                continue
+            self._built[filepath] = signature
+            result = self.build(filepath)
+            if result is not None:
+                results.append(result)
+        if results:
+            self.manifest.save()
+        return results
+
+    def build(self, filepath):
+        """Re-execute and re-export one notebook
+
+        Args:
+            filepath (str): Path to the notebook.
+
+        Returns:
+            BuildResult:
+                The result, or :data:`None` if the recorded export is
+                already up to date.
+        """
+        md_name, output_dir = export._output_location(
+            filepath, self.output_dir)
+        inputs_hash = manifest_module.hash_inputs(
+            filepath,
+            self.execute,
+            self.output_string_replacements,
+            extra=self._execute_inputs(),
+        )
+        if filepath not in self._runners and self.manifest.is_current(
+                output_dir, md_name, inputs_hash):
+            return None
+
+        start = time.perf_counter()
+        executed_from = None
+        try:
+            notebook_node = utils.get_notebook_from_filepath(filepath)
+            if self.execute:
+                runner = self._runner(filepath)
+                runner.run(notebook_node, self.input_string_replacements)
+                executed_from = runner.executed_from
+            self.exporter.export_from_node(
+                notebook_node,
+                md_name,
+                output_dir,
+                self.output_string_replacements,
+                manifest=self.manifest,
+                inputs_hash=inputs_hash,
+            )
+        except Exception as exc:
+            return BuildResult(
+                filepath=filepath,
+                error="{}: {}".format(type(exc).__name__, exc),
+                duration=time.perf_counter() - start,
+                executed_from=executed_from,
+            )
+        return BuildResult(
+            filepath=filepath,
+            error=None,
+            duration=time.perf_counter() - start,
+            executed_from=executed_from,
+        )
+
+    def watch(self, on_build=None, stop_event=None):
+        """Build changed notebooks until stopped
+
+        Args:
+            on_build (callable, optional):
+                Called with each :class:`BuildResult`.
+            stop_event (threading.Event, optional):
+                Event which stops watching when set. Without one, watching
+                continues until interrupted, for example by
+                ``KeyboardInterrupt``.
+        """
+        if self.use_inotify:
+            waiter = _InotifyWaiter(self.root)
+        else:
+            waiter = _PollingWaiter(self.root, self.poll_interval)
+        try:
+            while stop_event is None or not stop_event.is_set():
+                for result in self.build_changed():
+                    if on_build is not None:
+                        on_build(result)
+                if not waiter.wait(self.poll_interval):
+                    continue
+                # Wait for a burst of saves to finish
+                while waiter.wait(self.debounce):
+                    pass
+        finally:
+            waiter.close()
+
+    def _execute_inputs(self):
+        # Inputs that change what executing a notebook produces
+        if not self.execute:
+            return None
+        return {
+            "input_string_replacements": sorted(
+                (self.input_string_replacements or {}).items()),
+            "execute_kwargs": self.execute_kwargs,
+        }
+
+    def _runner(self, filepath):
+        runner = self._runners.get(filepath)
+        if runner is None:
+            os.makedirs(self._state_dir, exist_ok=True)
+            # Recorded outputs are only reused with the same kernel options
+            key = hashlib.sha256(json.dumps(
+                [os.path.abspath(filepath), self.execute_kwargs],
+                sort_keys=True,
+            ).encode("utf-8")).hexdigest()[:16]
+            runner = incremental.IncrementalRunner(
+                state_path=os.path.join(self._state_dir, key + ".json"),
+                notebook_path=os.path.dirname(filepath),
+                **self.execute_kwargs)
+            self._runners[filepath] = runner
+        return runner
+
+
+class _PollingWaiter(object):
+    # Detects changes by comparing notebook modification times
+
+    def __init__(self, root, interval):
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        return {
+            filepath: _signature(filepath)
+            for filepath in batch.find_notebooks(self.root)
+        }
+
+    def wait(self, timeout):
+        """Return whether notebooks changed within ``timeout`` seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            if snapshot != self._snapshot:
+                self._snapshot = snapshot
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+class _InotifyWaiter(object):
+    # Blocks on inotify events for the directories below root
+
+    def __init__(self, root):
+        self.root = root
+        flags = inotify_simple.flags
+        self._mask = (
+            flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM
+            | flags.CREATE | flags.DELETE
+        )
+        self._inotify = inotify_simple.INotify()
+        self._watched = set()
+        self._add_watches()
+
+    def _add_watches(self):
+        for directory, dirnames, _ in os.walk(self.root):
+            dirnames[:] = [
+                name for name in dirnames
+                if name not in (".ipynb_checkpoints", STATE_DIRNAME)
+            ]
+            if directory not in self._watched:
+                self._inotify.add_watch(directory, self._mask)
+                self._watched.add(directory)
+
+    def wait(self, timeout):
+        """Return whether notebooks changed within ``timeout`` seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            events = self._inotify.read(timeout=int(remaining * 1000))
+            if any(event.mask & inotify_simple.flags.ISDIR
+                   for event in events):
+                self._add_watches()
+            # Ignore the markdown and resource files written by exports
+            if any(event.name.endswith(".ipynb") or
+                   event.mask & inotify_simple.flags.ISDIR
+                   for event in events):
+                return True
+
+    def close(self):
+        self._inotify.close()
@@ -55,3 +55,21 @@ def tests(session):
         '--cov-fail-under=97',
         'tests',
     )
+
+
+@nox.session(python='3.6')
+def benchmark(session):
+    """Run the benchmark suite and compare it against the stored baseline.
+    Returns a failure if any benchmark is more than 25% slower than
+    benchmarks/baseline.json. Refresh the baseline on the benchmark machine
+    with ``python benchmarks/suite.py --save benchmarks/baseline.json``.
+    """
+    session.install('-r', 'requirements.txt')
+    session.install('.')
+    session.run(
+        'python',
+        'benchmarks/suite.py',
+        '--baseline',
+        'benchmarks/baseline.json',
+        *session.posargs
+    )
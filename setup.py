@@ -27,6 +27,13 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/alixhami/nbsampleutils",
     packages=setuptools.find_packages(),
+    extras_require={
+        "fast": ["orjson"],
+        "watch": ["inotify_simple"],
+    },
+    entry_points={
+        "console_scripts": ["nbsampleutils=nbsampleutils.cli:main"],
+    },
     license="Apache Software License",
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -0,0 +1,139 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for parallel notebook execution"""
+import asyncio
+import time
+
+from nbsampleutils import batch
+
+
+def test_find_notebooks_searches_directories(tmp_path, write_notebook):
+    subdir = tmp_path / "nested"
+    subdir.mkdir()
+    checkpoints = tmp_path / ".ipynb_checkpoints"
+    checkpoints.mkdir()
+    first = write_notebook(tmp_path, "first.ipynb", ["1 + 1"])
+    second = write_notebook(subdir, "second.ipynb", ["2 + 2"])
+    write_notebook(checkpoints, "first-checkpoint.ipynb", ["1 + 1"])
+    (tmp_path / "notes.txt").write_text("not a notebook")
+
+    filepaths = batch.find_notebooks(str(tmp_path))
+
+    assert filepaths == sorted([first, second])
+
+
+def test_find_notebooks_expands_globs(tmp_path, write_notebook):
+    first = write_notebook(tmp_path, "first.ipynb", ["1 + 1"])
+    write_notebook(tmp_path, "second.ipynb", ["2 + 2"])
+
+    filepaths = batch.find_notebooks(str(tmp_path / "f*.ipynb"))
+
+    assert filepaths == [first]
+
+
+def test_find_notebooks_keeps_files_with_glob_characters(
+        tmp_path, write_notebook):
+    subdir = tmp_path / "[drafts]"
+    subdir.mkdir()
+    filepath = write_notebook(subdir, "Sample [draft].ipynb", ["1 + 1"])
+
+    assert batch.find_notebooks([filepath]) == [filepath]
+    assert batch.find_notebooks(str(subdir)) == [filepath]
+
+
+def test_run_batch_collects_failures(tmp_path, write_notebook):
+    passing = write_notebook(tmp_path, "passing.ipynb", ["2 + 2"])
+    failing = write_notebook(tmp_path, "failing.ipynb", ["undefined_variable"])
+
+    results = batch.run_batch(str(tmp_path), max_workers=2)
+
+    assert [result.filepath for result in results] == [failing, passing]
+    failed, passed = results
+    assert failed.notebook_node is None
+    assert "CellExecutionError" in failed.error
+    assert passed.error is None
+    assert passed.notebook_node.cells[0].outputs[0].data["text/plain"] == "4"
+
+
+def test_run_batch_replaces_input_strings(tmp_path, write_notebook):
+    write_notebook(tmp_path, "replace.ipynb", ['value = "PLACEHOLDER"\nvalue'])
+
+    results = batch.run_batch(
+        str(tmp_path), input_string_replacements={"PLACEHOLDER": "secret"})
+
+    output = results[0].notebook_node.cells[0].outputs[0]
+    assert output.data["text/plain"] == "'secret'"
+
+
+def test_run_batch_fail_fast_cancels_other_notebooks(tmp_path, write_notebook):
+    failing = write_notebook(
+        tmp_path, "a_failing.ipynb", ["undefined_variable"])
+    hanging = write_notebook(
+        tmp_path, "b_hanging.ipynb", ["import time; time.sleep(60)"])
+    queued = write_notebook(tmp_path, "c_queued.ipynb", ["2 + 2"])
+
+    start = time.perf_counter()
+    results = batch.run_batch(str(tmp_path), max_workers=2, fail_fast=True)
+
+    assert time.perf_counter() - start < 45
+    assert [result.filepath for result in results] == [
+        failing, hanging, queued]
+    assert "CellExecutionError" in results[0].error
+    assert "ExecutionCancelled" in results[1].error
+    # The queued notebook may have finished before the failure
+    assert results[2].error is None or (
+        "ExecutionCancelled" in results[2].error)
+
+
+def test_run_batch_notebook_timeout(tmp_path, write_notebook):
+    write_notebook(
+        tmp_path, "slow.ipynb", ["import time"] + ["time.sleep(1)"] * 10)
+
+    results = batch.run_batch(str(tmp_path), notebook_timeout=2.5)
+
+    assert "NotebookTimeoutError" in results[0].error
+
+
+def test_run_batch_with_no_notebooks(tmp_path):
+    assert batch.run_batch(str(tmp_path)) == []
+
+
+def test_async_run_batch_collects_failures(tmp_path, write_notebook):
+    passing = write_notebook(tmp_path, "passing.ipynb", ["2 + 2"])
+    failing = write_notebook(tmp_path, "failing.ipynb", ["undefined_variable"])
+
+    results = asyncio.run(batch.async_run_batch(
+        str(tmp_path), max_concurrency=1))
+
+    assert [result.filepath for result in results] == [failing, passing]
+    failed, passed = results
+    assert "CellExecutionError" in failed.error
+    assert passed.notebook_node.cells[0].outputs[0].data["text/plain"] == "4"
+
+
+def test_async_run_batch_fail_fast_cancels_other_notebooks(
+        tmp_path, write_notebook):
+    failing = write_notebook(
+        tmp_path, "a_failing.ipynb", ["undefined_variable"])
+    hanging = write_notebook(
+        tmp_path, "b_hanging.ipynb", ["import time; time.sleep(60)"])
+
+    start = time.perf_counter()
+    results = asyncio.run(batch.async_run_batch(
+        str(tmp_path), max_concurrency=2, fail_fast=True))
+
+    assert time.perf_counter() - start < 45
+    assert [result.filepath for result in results] == [failing, hanging]
+    assert "CellExecutionError" in results[0].error
+    assert "ExecutionCancelled" in results[1].error
@@ -0,0 +1,157 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the execution cache"""
+import os
+import time
+
+import pytest
+
+from nbsampleutils import cache
+from nbsampleutils import profiling
+from nbsampleutils import utils
+
+
+@pytest.fixture
+def execution_cache(tmp_path):
+    return cache.ExecutionCache(str(tmp_path / "cache"))
+
+
+def test_key_is_stable(execution_cache):
+    first = utils.make_notebook_node(["1 + 1"])
+    second = utils.make_notebook_node(["1 + 1"])
+
+    assert execution_cache.key(first) == execution_cache.key(second)
+
+
+@pytest.mark.parametrize("key_kwargs", [
+    {"input_string_replacements": {"1": "2"}},
+    {"kernel_name": "other"},
+    {"execute_kwargs": {"allow_errors": True}},
+])
+def test_key_changes_with_inputs(execution_cache, key_kwargs):
+    notebook_node = utils.make_notebook_node(["1 + 1"])
+
+    assert (
+        execution_cache.key(notebook_node)
+        != execution_cache.key(notebook_node, **key_kwargs))
+
+
+def test_key_changes_with_source_and_fingerprint(tmp_path, execution_cache):
+    notebook_node = utils.make_notebook_node(["1 + 1"])
+    changed_node = utils.make_notebook_node(["1 + 2"])
+    fingerprinted = cache.ExecutionCache(
+        str(tmp_path / "cache"), fingerprint="numpy==1.0")
+
+    key = execution_cache.key(notebook_node)
+
+    assert key != execution_cache.key(changed_node)
+    assert key != fingerprinted.key(notebook_node)
+
+
+def test_get_missing_key(execution_cache):
+    assert execution_cache.get("0" * 64) is None
+
+
+def test_put_and_get(execution_cache):
+    notebook_node = utils.make_notebook_node(["1 + 1"])
+    key = execution_cache.key(notebook_node)
+
+    execution_cache.put(key, notebook_node)
+
+    assert execution_cache.get(key) == notebook_node
+
+
+def test_max_age_evicts_old_entries(tmp_path):
+    execution_cache = cache.ExecutionCache(str(tmp_path), max_age=60)
+    notebook_node = utils.make_notebook_node(["1 + 1"])
+    key = execution_cache.key(notebook_node)
+    execution_cache.put(key, notebook_node)
+    path = execution_cache._path(key)
+    old = time.time() - 120
+    os.utime(path, (old, old))
+
+    assert execution_cache.get(key) is None
+    assert not os.path.exists(path)
+
+
+def test_max_size_evicts_least_recently_used(tmp_path):
+    execution_cache = cache.ExecutionCache(str(tmp_path))
+    nodes = [utils.make_notebook_node([str(num)]) for num in range(3)]
+    keys = [execution_cache.key(node) for node in nodes]
+    for age, (key, node) in enumerate(zip(keys, nodes)):
+        execution_cache.put(key, node)
+        old = time.time() - 100 + age
+        os.utime(execution_cache._path(key), (old, old))
+    entry_size = os.path.getsize(execution_cache._path(keys[0]))
+    # Using the oldest entry makes the second entry least recently used
+    execution_cache.get(keys[0])
+
+    execution_cache.max_size = entry_size * 2
+    execution_cache.evict()
+
+    assert execution_cache.get(keys[0]) is not None
+    assert execution_cache.get(keys[1]) is None
+    assert execution_cache.get(keys[2]) is not None
+
+
+def test_clear(execution_cache):
+    notebook_node = utils.make_notebook_node(["1 + 1"])
+    key = execution_cache.key(notebook_node)
+    execution_cache.put(key, notebook_node)
+
+    execution_cache.clear()
+
+    assert execution_cache.get(key) is None
+
+
+def test_run_notebook_node_uses_cached_result(execution_cache):
+    code = ['value = "PLACEHOLDER"\nimport random\n(value, random.random())']
+    replacements = {"PLACEHOLDER": "secret"}
+    first = utils.make_notebook_node(code)
+    utils.run_notebook_node(
+        first,
+        input_string_replacements=replacements,
+        cache=execution_cache)
+
+    second = utils.make_notebook_node(code)
+    utils.run_notebook_node(
+        second,
+        input_string_replacements=replacements,
+        cache=execution_cache)
+
+    assert "secret" in second.cells[0].source
+    assert second.cells[0].outputs == first.cells[0].outputs
+
+
+def test_run_notebook_node_cache_miss_executes(execution_cache):
+    code = ["import random\nrandom.random()"]
+    first = utils.make_notebook_node(code)
+    utils.run_notebook_node(first, cache=execution_cache)
+
+    second = utils.make_notebook_node(code)
+    utils.run_notebook_node(second, cache=execution_cache, timeout=30)
+
+    assert second.cells[0].outputs != first.cells[0].outputs
+
+
+def test_run_notebook_node_profile_skips_cache(execution_cache):
+    code = ["import random\nrandom.random()"]
+    first = utils.make_notebook_node(code)
+    utils.run_notebook_node(first, cache=execution_cache)
+
+    second = utils.make_notebook_node(code)
+    utils.run_notebook_node(second, cache=execution_cache, profile=True)
+
+    assert second.cells[0].outputs != first.cells[0].outputs
+    assert profiling.cell_profiles(second)
@@ -0,0 +1,147 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the command line interface"""
+import json
+import os
+
+import pytest
+
+from nbsampleutils import cli
+
+
+def test_run_reports_success(tmp_path, capsys, write_notebook):
+    write_notebook(tmp_path, "passing.ipynb", ["2 + 2"])
+
+    exit_code = cli.main(["run", str(tmp_path), "--jobs", "1"])
+
+    assert exit_code == 0
+    assert "1 notebooks, 0 failed" in capsys.readouterr().out
+
+
+def test_run_reports_failures(tmp_path, capsys, write_notebook):
+    write_notebook(tmp_path, "passing.ipynb", ["2 + 2"])
+    write_notebook(tmp_path, "failing.ipynb", ["undefined_variable"])
+
+    exit_code = cli.main(["run", str(tmp_path)])
+
+    assert exit_code == 1
+    out = capsys.readouterr().out
+    assert "FAILED" in out
+    assert "2 notebooks, 1 failed" in out
+
+
+def test_run_notebook_timeout(tmp_path, capsys, write_notebook):
+    write_notebook(
+        tmp_path, "slow.ipynb", ["import time"] + ["time.sleep(1)"] * 10)
+
+    exit_code = cli.main(
+        ["run", str(tmp_path), "--notebook-timeout", "2.5", "--fail-fast"])
+
+    assert exit_code == 1
+    assert "NotebookTimeoutError" in capsys.readouterr().out
+
+
+def test_run_with_dependencies(tmp_path, capsys, write_notebook):
+    write_notebook(tmp_path, "first.ipynb", ["open('data.txt', 'w')"])
+    write_notebook(
+        tmp_path,
+        "second.ipynb",
+        ["open('data.txt').read()"],
+        metadata={"nbsampleutils": {"depends_on": ["first.ipynb"]}},
+    )
+
+    exit_code = cli.main(["run", str(tmp_path), "--dependencies"])
+
+    assert exit_code == 0
+    out = capsys.readouterr().out
+    assert "critical path" in out
+    assert "first.ipynb -> " in out
+
+
+def test_run_shards_and_merge(tmp_path, capsys, write_notebook):
+    notebooks = tmp_path / "notebooks"
+    notebooks.mkdir()
+    write_notebook(notebooks, "first.ipynb", ["1 + 1"])
+    write_notebook(notebooks, "second.ipynb", ["undefined_variable"])
+    results = []
+    for shard_index in range(2):
+        results.append(str(tmp_path / "shard{}.json".format(shard_index)))
+        cli.main([
+            "run", str(notebooks),
+            "--shard-index", str(shard_index),
+            "--shard-count", "2",
+            "--results", results[-1],
+        ])
+        assert "1 notebooks" in capsys.readouterr().out
+
+    timings = str(tmp_path / "timings.json")
+    exit_code = cli.main(["merge"] + results + ["--timings", timings])
+
+    assert exit_code == 1
+    assert "2 notebooks, 1 failed" in capsys.readouterr().out
+    with open(timings) as timings_file:
+        recorded = json.load(timings_file)["notebooks"]
+    assert [os.path.basename(path) for path in recorded] == ["first.ipynb"]
+
+
+def test_run_replaces_input_strings(tmp_path, write_notebook):
+    write_notebook(
+        tmp_path, "replace.ipynb", ['assert "PLACEHOLDER" == "secret"'])
+
+    exit_code = cli.main(
+        ["run", str(tmp_path), "--replace", "PLACEHOLDER=secret"])
+
+    assert exit_code == 0
+
+
+def test_run_rejects_malformed_replacement(tmp_path):
+    with pytest.raises(SystemExit):
+        cli.main(["run", str(tmp_path), "--replace", "no-separator"])
+
+
+def test_profile_ranks_slowest_cells(tmp_path, capsys, write_notebook):
+    write_notebook(
+        tmp_path, "slow.ipynb", ["import time", "time.sleep(0.5)", "1 + 1"])
+    write_notebook(tmp_path, "fast.ipynb", ["2 + 2"])
+    json_path = str(tmp_path / "profile.json")
+    csv_path = str(tmp_path / "profile.csv")
+
+    exit_code = cli.main([
+        "profile", str(tmp_path),
+        "--top", "2",
+        "--json", json_path,
+        "--csv", csv_path,
+    ])
+
+    assert exit_code == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert "slow.ipynb:1  time.sleep(0.5)" in lines[1]
+    assert len(lines) == 4
+    assert lines[-1] == "4 cells in 2 notebooks, 0 failed"
+    with open(json_path) as json_file:
+        assert len(json.load(json_file)) == 4
+    with open(csv_path) as csv_file:
+        assert len(csv_file.read().splitlines()) == 5
+
+
+def test_watch_accepts_kernel_options(tmp_path):
+    args = cli.make_parser().parse_args([
+        "watch", str(tmp_path),
+        "--timeout", "5",
+        "--kernel-name", "python3",
+        "--allow-errors",
+    ])
+
+    assert cli._kernel_kwargs(args) == {
+        "timeout": 5, "kernel_name": "python3", "allow_errors": True}
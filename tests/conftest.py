@@ -0,0 +1,49 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared test fixtures"""
+import os
+
+import nbformat
+import pytest
+
+from nbsampleutils import utils
+
+
+def _write_notebook(directory, name, notebook, metadata=None):
+    """Save a notebook file and return its path
+
+    Args:
+        directory (str or pathlib.Path): Directory to write the notebook to.
+        name (str): File name of the notebook.
+        notebook (list(str) or nbformat.NotebookNode):
+            Code cell contents to make a notebook from, or a notebook node.
+        metadata (dict, optional): Notebook metadata to add.
+
+    Returns:
+        str: Path to the notebook file.
+    """
+    if not isinstance(notebook, nbformat.NotebookNode):
+        notebook = utils.make_notebook_node(notebook)
+    if metadata:
+        notebook.metadata.update(metadata)
+    filepath = os.path.join(str(directory), name)
+    with open(filepath, "w") as notebook_file:
+        nbformat.write(notebook, notebook_file)
+    return filepath
+
+
+@pytest.fixture
+def write_notebook():
+    """Function to save a notebook file, see :func:`_write_notebook`"""
+    return _write_notebook
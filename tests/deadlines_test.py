@@ -0,0 +1,123 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for cell timeouts, notebook deadlines and cancellation"""
+import asyncio
+import threading
+import time
+
+import nbformat
+import pytest
+from nbclient.exceptions import CellTimeoutError
+
+from nbsampleutils import METADATA_KEY
+from nbsampleutils import deadlines
+from nbsampleutils import utils
+
+
+def make_cell(timeout=None):
+    cell = nbformat.v4.new_code_cell("1 + 1")
+    if timeout is not None:
+        cell.metadata[METADATA_KEY] = {"timeout": timeout}
+    return cell
+
+
+def test_cell_timeout_uses_metadata_override():
+    assert deadlines.cell_timeout(make_cell(), default=5) == 5
+    assert deadlines.cell_timeout(make_cell(timeout=60), default=5) == 60
+    assert deadlines.cell_timeout(make_cell(timeout=-1), default=5) is None
+
+
+def test_deadline_shortens_timeout_to_time_left():
+    deadline = deadlines.Deadline(cell_timeout=600, notebook_timeout=10)
+
+    timeout = deadline.timeout_func(make_cell())
+
+    assert 9 < timeout <= 10
+
+
+def test_deadline_raises_after_it_expires():
+    deadline = deadlines.Deadline(notebook_timeout=0)
+
+    with pytest.raises(deadlines.NotebookTimeoutError):
+        deadline.timeout_func(make_cell())
+
+
+def test_deadline_raises_when_cancelled():
+    cancel_event = threading.Event()
+    deadline = deadlines.Deadline(cancel_event=cancel_event)
+    assert deadline.timeout_func(make_cell()) is None
+
+    cancel_event.set()
+
+    with pytest.raises(deadlines.ExecutionCancelled):
+        deadline.check()
+
+
+def test_run_notebook_node_honours_cell_timeout_override():
+    notebook_node = utils.make_notebook_node(
+        ["import time", "time.sleep(2)", "time.sleep(30)"])
+    notebook_node.cells[1].metadata[METADATA_KEY] = {"timeout": 10}
+
+    start = time.perf_counter()
+    with pytest.raises(CellTimeoutError):
+        utils.run_notebook_node(notebook_node, timeout=1)
+
+    assert time.perf_counter() - start < 20
+    assert notebook_node.cells[1].execution_count is not None
+
+
+def test_run_notebook_node_enforces_notebook_timeout():
+    notebook_node = utils.make_notebook_node(
+        ["import time"] + ["time.sleep(1)"] * 10)
+
+    with pytest.raises(deadlines.NotebookTimeoutError):
+        utils.run_notebook_node(notebook_node, notebook_timeout=2.5)
+
+
+def test_run_notebook_node_does_not_start_when_cancelled():
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    with pytest.raises(deadlines.ExecutionCancelled):
+        utils.run_notebook_node(
+            utils.make_notebook_node(["1 + 1"]), cancel_event=cancel_event)
+
+
+def test_cancel_event_kills_running_cell():
+    cancel_event = threading.Event()
+    notebook_node = utils.make_notebook_node(["import time; time.sleep(60)"])
+    timer = threading.Timer(2, cancel_event.set)
+    timer.start()
+
+    start = time.perf_counter()
+    try:
+        with pytest.raises(deadlines.ExecutionCancelled):
+            utils.run_notebook_node(
+                notebook_node,
+                cancel_event=cancel_event,
+                shutdown_kernel="immediate",
+            )
+    finally:
+        timer.cancel()
+
+    assert time.perf_counter() - start < 30
+
+
+def test_async_run_notebook_node_enforces_notebook_timeout():
+    notebook_node = utils.make_notebook_node(
+        ["import time"] + ["time.sleep(1)"] * 10)
+
+    with pytest.raises(deadlines.NotebookTimeoutError):
+        asyncio.run(utils.async_run_notebook_node(
+            notebook_node, notebook_timeout=2.5))
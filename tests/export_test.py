@@ -12,8 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Tests for notebook export functions"""
+import asyncio
+import concurrent.futures
+
+import nbformat
 
 from nbsampleutils import export
+from nbsampleutils import manifest
+from nbsampleutils import utils
 
 
 DF_HTML = """\
@@ -78,3 +84,169 @@ def test_strip_styles_with_markdown_only_input():
     result = export.strip_styles(markdown)
 
     assert result == markdown
+
+
+def test_strip_styles_only_rewrites_styled_tags():
+    html = (
+        "<style>\n.dataframe { color: red; }\n</style>\n"
+        """<TABLE border="1" data-note='a > b'>\n"""
+        '<tr style="text-align: right;"><td>1</td></tr>\n'
+        '<trail class="kept">\n'
+        "</TABLE>"
+    )
+
+    result = export.strip_styles(html)
+
+    assert result == (
+        "\n"
+        "<table>\n"
+        "<tr><td>1</td></tr>\n"
+        '<trail class="kept">\n'
+        "</TABLE>"
+    )
+
+
+def test_strip_styles_leaves_markdown_code_untouched():
+    markdown = "```python\nif a < b and c & d:\n    pass\n```\n"
+
+    result = export.strip_styles(DF_HTML + markdown)
+
+    assert result.endswith(markdown)
+
+
+def test_async_export_from_filepath(tmp_path, write_notebook):
+    filepath = write_notebook(tmp_path, "My Notebook.ipynb", ["2 + 2"])
+
+    asyncio.run(export.async_export_from_filepath(
+        filepath,
+        execute=True,
+        output_string_replacements={"2 \\+ 2": "two plus two"},
+    ))
+
+    with open(str(tmp_path / "my-notebook.md")) as markdown_file:
+        markdown = markdown_file.read()
+    assert "two plus two" in markdown
+    assert "4" in markdown
+
+
+def test_export_from_node_strips_output_styles(tmp_path):
+    notebook_node = utils.make_notebook_node(["df"])
+    notebook_node.cells[0].outputs = [nbformat.v4.new_output(
+        "execute_result",
+        data={"text/html": DF_HTML, "text/plain": "df"},
+        execution_count=1,
+    )]
+
+    export.export_from_node(notebook_node, "styled", str(tmp_path))
+
+    with open(str(tmp_path / "styled.md")) as markdown_file:
+        markdown = markdown_file.read()
+    assert "<table>" in markdown
+    assert "<style" not in markdown
+    assert "style=" not in markdown
+
+
+def test_exporter_reuses_instances(tmp_path):
+    session = export.Exporter()
+    markdown_exporter = session.markdown_exporter
+    writer = session.writer
+
+    for name in ["first", "second"]:
+        session.export_from_node(
+            utils.make_notebook_node(["'{}'".format(name)]),
+            name,
+            str(tmp_path / name),
+        )
+
+    assert session.markdown_exporter is markdown_exporter
+    assert session.writer is writer
+    assert (tmp_path / "first" / "first.md").exists()
+    assert (tmp_path / "second" / "second.md").exists()
+
+
+def test_exporter_is_safe_to_share_between_threads(tmp_path):
+    session = export.Exporter()
+    names = ["notebook{}".format(num) for num in range(8)]
+
+    def export_notebook(name):
+        session.export_from_node(
+            utils.make_notebook_node(["print('{}')".format(name)]),
+            name,
+            str(tmp_path),
+            output_string_replacements={"print": "show"},
+        )
+        return session.markdown_exporter
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        exporters = list(executor.map(export_notebook, names))
+
+    assert len(set(map(id, exporters))) <= 4
+    for name in names:
+        with open(str(tmp_path / "{}.md".format(name))) as markdown_file:
+            assert "show('{}')".format(name) in markdown_file.read()
+
+
+def test_exporter_export_from_filepath(tmp_path, write_notebook):
+    filepath = write_notebook(tmp_path, "Source Notebook.ipynb", ["1 + 1"])
+
+    export.Exporter().export_from_filepath(
+        filepath, output_dir=str(tmp_path / "out"))
+
+    assert (tmp_path / "out" / "source-notebook.md").exists()
+
+
+PNG_DATA = "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk"
+
+
+def make_image_notebook(images):
+    notebook_node = utils.make_notebook_node(["plot()"])
+    notebook_node.cells[0].outputs = [
+        nbformat.v4.new_output(
+            "display_data",
+            data={"image/png": PNG_DATA, "image/svg+xml": "<svg></svg>"},
+        )
+        for _ in range(images)
+    ]
+    return notebook_node
+
+
+def read_tree(directory):
+    files = {}
+    for path in sorted(directory.rglob("*")):
+        if path.is_file():
+            files[str(path.relative_to(directory))] = path.read_bytes()
+    return files
+
+
+def test_exporter_stream_outputs_matches_default_export(tmp_path):
+    notebook_node = make_image_notebook(images=3)
+
+    export.Exporter().export_from_node(
+        notebook_node, "images", str(tmp_path / "default"))
+    export.Exporter(stream_outputs=True).export_from_node(
+        notebook_node, "images", str(tmp_path / "streamed"))
+
+    default_files = read_tree(tmp_path / "default")
+    assert "images-resources/images_0_2.png" in default_files
+    assert read_tree(tmp_path / "streamed") == default_files
+    # The caller's notebook keeps its output data
+    assert notebook_node.cells[0].outputs[0].data["image/png"] == PNG_DATA
+
+
+def test_exporter_stream_outputs_with_manifest(tmp_path):
+    exporter = export.Exporter(stream_outputs=True)
+    stale = tmp_path / "images-resources" / "images_0_1.png"
+
+    with manifest.BuildManifest(str(tmp_path)) as build_manifest:
+        exporter.export_from_node(
+            make_image_notebook(images=2), "images", str(tmp_path),
+            manifest=build_manifest)
+    assert stale.exists()
+    with manifest.BuildManifest(str(tmp_path)) as build_manifest:
+        exporter.export_from_node(
+            make_image_notebook(images=1), "images", str(tmp_path),
+            manifest=build_manifest)
+
+    # Only the markdown changed, and the second image is gone
+    assert build_manifest.written == [str(tmp_path / "images.md")]
+    assert not stale.exists()
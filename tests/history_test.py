@@ -0,0 +1,165 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the execution result store"""
+
+import nbformat
+import pytest
+
+from nbsampleutils import history
+from nbsampleutils import utils
+
+
+@pytest.fixture
+def store(tmp_path):
+    with history.ResultStore(str(tmp_path / "history.sqlite")) as store:
+        yield store
+
+
+def make_executed_notebook(outputs=("4",), durations=(1.0,), sources=None):
+    sources = sources or ["2 + 2"] * len(outputs)
+    notebook_node = utils.make_notebook_node(list(sources))
+    for index, (cell, text, duration) in enumerate(
+            zip(notebook_node.cells, outputs, durations)):
+        cell.execution_count = index + 1
+        if text == "error":
+            cell.outputs = [nbformat.v4.new_output(
+                "error", ename="NameError", evalue="boom", traceback=[])]
+        else:
+            cell.outputs = [nbformat.v4.new_output(
+                "execute_result",
+                data={"text/plain": text},
+                execution_count=index + 1,
+            )]
+        cell.metadata["nbsampleutils"] = {"profile": {"wall_time": duration}}
+    return notebook_node
+
+
+def record_runs(store, runs, notebook="sample.ipynb"):
+    for started, kwargs in enumerate(runs):
+        store.record(
+            notebook,
+            make_executed_notebook(**kwargs),
+            duration=1.0,
+            started=float(started),
+        )
+
+
+def test_record_and_query_runs(store):
+    notebook_node = make_executed_notebook(
+        outputs=("4", "5"), durations=(1.5, 0.5), sources=["2 + 2", "2 + 3"])
+
+    run_id = store.record("sample.ipynb", notebook_node, duration=2.5)
+
+    runs = store.runs()
+    assert [run.run_id for run in runs] == [run_id]
+    assert runs[0].notebook == "sample.ipynb"
+    assert runs[0].notebook_hash == history.notebook_hash(notebook_node)
+    assert runs[0].status == "ok"
+    cells = store.cells(run_id)
+    assert [cell.cell_index for cell in cells] == [0, 1]
+    assert [cell.duration for cell in cells] == [1.5, 0.5]
+    assert cells[0].output_hash != cells[1].output_hash
+
+
+def test_record_skips_unexecuted_cells(store):
+    notebook_node = make_executed_notebook()
+    notebook_node.cells.append(nbformat.v4.new_code_cell("never_run()"))
+    notebook_node.cells.append(nbformat.v4.new_markdown_cell("# Notes"))
+
+    run_id = store.record("sample.ipynb", notebook_node)
+
+    assert len(store.cells(run_id)) == 1
+
+
+def test_runs_filters_and_orders(store):
+    record_runs(store, [{}, {}, {}])
+    record_runs(store, [{}], notebook="other.ipynb")
+
+    runs = store.runs(notebook="sample.ipynb", since=1.0)
+
+    assert [run.started for run in runs] == [2.0, 1.0]
+    assert len(store.runs(limit=2)) == 2
+    assert store.notebooks() == ["other.ipynb", "sample.ipynb"]
+
+
+def test_cell_history(store):
+    record_runs(store, [
+        {"durations": (1.0,)}, {"durations": (2.0,)}, {"durations": (3.0,)}])
+
+    cells = store.cell_history("sample.ipynb", 0, limit=2)
+
+    assert [cell.duration for cell in cells] == [3.0, 2.0]
+
+
+def test_changes_flags_slower_cells(store):
+    record_runs(store, [{"durations": (1.0,)}] * 5 + [{"durations": (2.0,)}])
+
+    changes = store.changes()
+
+    assert [(change.kind, change.baseline, change.current)
+            for change in changes] == [("duration", 1.0, 2.0)]
+
+
+def test_changes_ignores_small_slowdowns(store):
+    record_runs(store, [{"durations": (0.01,)}, {"durations": (0.05,)}])
+
+    assert store.changes() == []
+
+
+def test_changes_flags_output_and_status_changes(store):
+    record_runs(store, [
+        {"outputs": ("4", "4"), "durations": (1.0, 1.0),
+         "sources": ["a", "b"]},
+        {"outputs": ("5", "error"), "durations": (1.0, 1.0),
+         "sources": ["a", "b"]},
+    ])
+
+    changes = store.changes("sample.ipynb")
+
+    assert [(change.cell_index, change.kind) for change in changes] == [
+        (0, "output"), (1, "status")]
+
+
+def test_changes_ignores_edited_cells(store):
+    record_runs(store, [
+        {"outputs": ("4",), "sources": ["2 + 2"]},
+        {"outputs": ("5",), "sources": ["2 + 3"]},
+    ])
+
+    assert store.changes() == []
+
+
+def test_changes_ignores_execution_counts(store):
+    first = make_executed_notebook()
+    second = make_executed_notebook()
+    second.cells[0].execution_count = 7
+    second.cells[0].outputs[0].execution_count = 7
+    store.record("sample.ipynb", first, started=0.0)
+    store.record("sample.ipynb", second, started=1.0)
+
+    assert store.changes() == []
+
+
+def test_run_from_filepath_records_runs(store, tmp_path, write_notebook):
+    filepath = write_notebook(
+        tmp_path, "sample.ipynb", ["2 + 2", "undefined_variable"])
+
+    with pytest.raises(Exception):
+        utils.run_from_filepath(filepath, result_store=store)
+
+    run = store.runs(notebook=filepath)[0]
+    assert run.status == "error"
+    cells = store.cells(run.run_id)
+    assert [cell.status for cell in cells] == ["ok", "error"]
+    assert cells[0].duration is not None
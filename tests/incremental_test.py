@@ -0,0 +1,169 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for incremental notebook execution"""
+import nbformat
+from nbconvert.preprocessors.execute import CellExecutionError
+import pytest
+
+from nbsampleutils import incremental
+from nbsampleutils import utils
+
+
+COUNTER = 'counter = globals().get("counter", 0) + 1'
+
+
+@pytest.fixture
+def runner():
+    with incremental.IncrementalRunner() as runner:
+        yield runner
+
+
+def output_text(cell):
+    return utils.get_output_text(cell)
+
+
+def test_cell_hashes_chain_code_cells():
+    notebook_node = utils.make_notebook_node(["a = 1", "b = 2"])
+    notebook_node.cells.insert(1, nbformat.v4.new_markdown_cell("# Title"))
+    changed_first = utils.make_notebook_node(["a = 3", "b = 2"])
+    changed_first.cells.insert(1, nbformat.v4.new_markdown_cell("# Other"))
+
+    hashes = incremental.cell_hashes(notebook_node)
+    changed_hashes = incremental.cell_hashes(changed_first)
+
+    assert hashes[0] == hashes[1]
+    assert hashes[1] != hashes[2]
+    assert all(
+        old != new for old, new in zip(hashes, changed_hashes))
+
+
+def test_cell_hashes_include_replacements():
+    notebook_node = utils.make_notebook_node(["a = 1"])
+
+    assert (
+        incremental.cell_hashes(notebook_node)
+        != incremental.cell_hashes(notebook_node, {"1": "2"}))
+
+
+def test_run_executes_only_changed_cells(runner):
+    runner.run(utils.make_notebook_node([COUNTER, "counter"]))
+    assert runner.executed_from == 0
+
+    notebook_node = utils.make_notebook_node([COUNTER, "counter * 10"])
+    runner.run(notebook_node)
+
+    assert runner.executed_from == 1
+    assert output_text(notebook_node.cells[1]) == "10"
+
+
+def test_run_unchanged_notebook_restores_outputs(runner):
+    runner.run(utils.make_notebook_node([COUNTER, "counter"]))
+
+    notebook_node = utils.make_notebook_node([COUNTER, "counter"])
+    runner.run(notebook_node)
+
+    assert runner.executed_from == 2
+    assert output_text(notebook_node.cells[1]) == "1"
+
+
+def test_run_restarts_kernel_when_early_cell_changes(runner):
+    runner.run(utils.make_notebook_node([COUNTER, "counter"]))
+
+    notebook_node = utils.make_notebook_node([COUNTER + " + 1", "counter"])
+    runner.run(notebook_node)
+
+    assert runner.executed_from == 0
+    assert output_text(notebook_node.cells[1]) == "2"
+
+
+def test_run_replays_prefix_in_fresh_kernel(runner):
+    runner.run(utils.make_notebook_node([COUNTER, "counter += 5"]))
+
+    notebook_node = utils.make_notebook_node([COUNTER, "counter"])
+    runner.run(notebook_node)
+
+    assert runner.executed_from == 1
+    assert output_text(notebook_node.cells[1]) == "1"
+
+
+def test_run_changed_cell_matches_fresh_run(runner):
+    runner.run(utils.make_notebook_node(["x = 0", "x += 1\nx"]))
+
+    notebook_node = utils.make_notebook_node(["x = 0", "x += 1\nx * 10"])
+    runner.run(notebook_node)
+
+    assert output_text(notebook_node.cells[1]) == "10"
+
+
+def test_execution_counts_match_fresh_run(tmp_path):
+    def execution_counts(notebook_node):
+        return [cell.execution_count for cell in notebook_node.cells]
+
+    fresh = utils.run_notebook_node(
+        utils.make_notebook_node(["1", "2", "30"]))
+    state_path = str(tmp_path / "state.json")
+    with incremental.IncrementalRunner(state_path=state_path) as runner:
+        runner.run(utils.make_notebook_node(["1", "20", "3"]))
+        edited = runner.run(utils.make_notebook_node(["1", "2", "3"]))
+    with incremental.IncrementalRunner(state_path=state_path) as runner:
+        replayed = runner.run(utils.make_notebook_node(["1", "2", "30"]))
+
+    assert execution_counts(fresh) == [1, 2, 3]
+    assert execution_counts(edited) == [1, 2, 3]
+    assert execution_counts(replayed) == [1, 2, 3]
+    assert replayed.cells[2].outputs[0].execution_count == 3
+
+
+def test_non_strict_run_does_not_record_outputs(tmp_path):
+    state_path = str(tmp_path / "state.json")
+    with incremental.IncrementalRunner(
+            state_path=state_path, strict=False) as runner:
+        runner.run(utils.make_notebook_node(["x = 0", "x += 1\nx"]))
+        notebook_node = utils.make_notebook_node(["x = 0", "x += 1\nx * 10"])
+        runner.run(notebook_node)
+
+    # Executed on top of the earlier run, as in Jupyter
+    assert output_text(notebook_node.cells[1]) == "20"
+
+    notebook_node = utils.make_notebook_node(["x = 0", "x += 1\nx * 10"])
+    with incremental.IncrementalRunner(state_path=state_path) as runner:
+        runner.run(notebook_node)
+
+    assert runner.executed_from == 1
+    assert output_text(notebook_node.cells[1]) == "10"
+
+
+def test_state_path_persists_outputs_between_runners(tmp_path):
+    state_path = str(tmp_path / "state.json")
+    with incremental.IncrementalRunner(state_path=state_path) as runner:
+        runner.run(utils.make_notebook_node(['print("first")', "1"]))
+
+    notebook_node = utils.make_notebook_node(['print("first")', "2"])
+    with incremental.IncrementalRunner(state_path=state_path) as runner:
+        runner.run(notebook_node)
+
+    assert runner.executed_from == 1
+    assert output_text(notebook_node.cells[0]) == "first\n"
+    assert output_text(notebook_node.cells[1]) == "2"
+
+
+def test_run_reexecutes_failed_cell(runner):
+    with pytest.raises(CellExecutionError):
+        runner.run(utils.make_notebook_node(["a = 1", "undefined_variable"]))
+
+    notebook_node = utils.make_notebook_node(["a = 1", "a"])
+    runner.run(notebook_node)
+
+    assert runner.executed_from == 1
+    assert output_text(notebook_node.cells[1]) == "1"
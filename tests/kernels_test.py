@@ -0,0 +1,133 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the kernel pool"""
+from nbconvert.preprocessors.execute import CellExecutionError
+import pytest
+
+from nbsampleutils import kernels
+from nbsampleutils import utils
+
+
+@pytest.fixture
+def kernel_pool():
+    pool = kernels.KernelPool(max_size=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_acquire_reuses_released_kernel(kernel_pool):
+    first = kernel_pool.acquire()
+    kernel_pool.release(first)
+    assert kernel_pool.idle_count() == 1
+
+    second = kernel_pool.acquire()
+
+    assert second is first
+    assert kernel_pool.idle_count() == 0
+    kernel_pool.release(second)
+
+
+def test_prestart_fills_pool(kernel_pool):
+    kernel_pool.prestart(count=3)
+
+    assert kernel_pool.idle_count() == 1
+
+
+def test_release_beyond_max_size_shuts_down_kernel(kernel_pool):
+    first = kernel_pool.acquire()
+    second = kernel_pool.acquire()
+
+    kernel_pool.release(first)
+    kernel_pool.release(second)
+
+    assert kernel_pool.idle_count() == 1
+    assert not second.is_alive()
+
+
+def test_release_recycles_after_max_uses():
+    with kernels.KernelPool(max_uses=1) as pool:
+        kernel_manager = pool.acquire()
+        pool.release(kernel_manager)
+
+        assert pool.idle_count() == 0
+        assert not kernel_manager.is_alive()
+
+
+def test_acquire_shuts_down_expired_idle_kernels():
+    with kernels.KernelPool(max_idle=0) as pool:
+        first = pool.acquire()
+        pool.release(first)
+
+        second = pool.acquire()
+
+        assert second is not first
+        assert not first.is_alive()
+        pool.release(second)
+
+
+def test_run_notebook_node_resets_namespace_between_notebooks(kernel_pool):
+    first = utils.make_notebook_node(["leftover = 1"])
+    utils.run_notebook_node(first, kernel_pool=kernel_pool)
+
+    second = utils.make_notebook_node(["'leftover' in dir()"])
+    utils.run_notebook_node(second, kernel_pool=kernel_pool)
+
+    assert second.cells[0].outputs[0].data["text/plain"] == "False"
+    assert kernel_pool.idle_count() == 1
+
+
+def test_run_notebook_node_uses_notebook_path(kernel_pool, tmp_path):
+    notebook_node = utils.make_notebook_node(["import os\nos.getcwd()"])
+
+    utils.run_notebook_node(
+        notebook_node, notebook_path=str(tmp_path), kernel_pool=kernel_pool)
+
+    output = notebook_node.cells[0].outputs[0]
+    assert output.data["text/plain"] == repr(str(tmp_path))
+
+
+def test_run_notebook_node_returns_kernel_after_cell_error(kernel_pool):
+    notebook_node = utils.make_notebook_node(["undefined_variable"])
+
+    with pytest.raises(CellExecutionError):
+        utils.run_notebook_node(notebook_node, kernel_pool=kernel_pool)
+
+    assert kernel_pool.idle_count() == 1
+
+
+def test_acquire_missing_cwd_raises(kernel_pool, tmp_path, monkeypatch):
+    started = []
+    start_kernel = kernel_pool._start_kernel
+
+    def counting_start_kernel(kernel_name):
+        started.append(kernel_name)
+        return start_kernel(kernel_name)
+
+    monkeypatch.setattr(kernel_pool, "_start_kernel", counting_start_kernel)
+
+    with pytest.raises(RuntimeError):
+        kernel_pool.acquire(cwd=str(tmp_path / "missing"))
+
+    assert len(started) == 2
+
+
+def test_run_notebook_node_resets_execution_count(kernel_pool):
+    utils.run_notebook_node(
+        utils.make_notebook_node(["1", "2"]), kernel_pool=kernel_pool)
+
+    second = utils.make_notebook_node(["1", "2"])
+    utils.run_notebook_node(second, kernel_pool=kernel_pool)
+
+    assert [cell.execution_count for cell in second.cells] == [1, 2]
+    assert kernel_pool.idle_count() == 1
@@ -0,0 +1,178 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for limiting the size of captured outputs"""
+import os
+
+from nbconvert.preprocessors.execute import CellExecutionError
+import pytest
+
+from nbsampleutils import METADATA_KEY
+from nbsampleutils import cache
+from nbsampleutils import cli
+from nbsampleutils import limits
+from nbsampleutils import utils
+
+
+PRINT_LINES = "for i in range({}):\n    print('x' * 99)"
+
+
+def run(code_cell_contents, **limit_kwargs):
+    notebook_node = utils.make_notebook_node(code_cell_contents)
+    utils.run_notebook_node(
+        notebook_node, output_limits=limits.OutputLimits(**limit_kwargs))
+    return notebook_node
+
+
+def cell_limits(cell):
+    return cell.metadata.get(METADATA_KEY, {}).get("output_limits")
+
+
+def test_cell_stream_is_truncated_with_marker():
+    notebook_node = run([PRINT_LINES.format(10000), "print('ok')"],
+                        cell_bytes=1000)
+
+    text = utils.get_output_text(notebook_node.cells[0])
+    assert text.startswith("x" * 99 + "\n")
+    assert "[output truncated: cell output limit of 1000 bytes" in text
+    assert len(text) < 1200
+    assert utils.get_output_text(notebook_node.cells[1]) == "ok\n"
+
+    counters = cell_limits(notebook_node.cells[0])
+    assert counters["omitted_bytes"] == 10000 * 100 - 1000
+    assert cell_limits(notebook_node.cells[1]) is None
+
+    usage = limits.output_usage(notebook_node)
+    assert usage.omitted_bytes == 10000 * 100 - 1000
+    assert usage.truncated_cells == [0]
+    assert usage.bytes < 1300
+
+
+def test_notebook_budget_spans_cells():
+    notebook_node = run(
+        [PRINT_LINES.format(10), PRINT_LINES.format(10),
+         PRINT_LINES.format(10)],
+        notebook_bytes=1500,
+    )
+
+    assert "truncated" not in utils.get_output_text(notebook_node.cells[0])
+    second = utils.get_output_text(notebook_node.cells[1])
+    assert second.startswith("x" * 99)
+    assert "notebook output limit of 1500 bytes" in second
+    third = utils.get_output_text(notebook_node.cells[2])
+    assert "x" not in third.split("[")[0]
+    assert limits.output_usage(notebook_node).truncated_cells == [1, 2]
+
+
+def test_rich_output_is_spilled(tmp_path):
+    notebook_node = run(
+        [
+            "from IPython.display import HTML, Image, display\n"
+            "display(HTML('<td>' * 5000))\n"
+            "display(Image(data=b'\\x89PNG' + b'\\x00' * 5000, "
+            "format='png'))",
+        ],
+        cell_bytes=1000,
+        spill_dir=str(tmp_path),
+    )
+
+    outputs = notebook_node.cells[0].outputs
+    assert len(outputs) == 1
+    assert list(outputs[0].data) == ["text/plain"]
+    assert str(tmp_path) in outputs[0].data["text/plain"]
+
+    spilled = cell_limits(notebook_node.cells[0])["spilled"]
+    by_extension = {
+        os.path.splitext(path)[1]: path for path in spilled}
+    with open(by_extension[".html"]) as html_file:
+        assert html_file.read() == "<td>" * 5000
+    with open(by_extension[".png"], "rb") as png_file:
+        assert png_file.read() == b"\x89PNG" + b"\x00" * 5000
+    assert cell_limits(notebook_node.cells[0])["omitted_outputs"] == 2
+
+
+def test_spilled_stream_keeps_all_text(tmp_path):
+    notebook_node = run(
+        [PRINT_LINES.format(1000)], cell_bytes=500, spill_dir=str(tmp_path))
+
+    kept = utils.get_output_text(notebook_node.cells[0]).split("\n[")[0]
+    (spilled,) = cell_limits(notebook_node.cells[0])["spilled"]
+    with open(spilled) as spill_file:
+        assert kept + spill_file.read() == ("x" * 99 + "\n") * 1000
+
+
+def test_errors_are_kept():
+    notebook_node = utils.make_notebook_node(
+        [PRINT_LINES.format(100) + "\nraise ValueError('boom')"])
+
+    with pytest.raises(CellExecutionError):
+        utils.run_notebook_node(
+            notebook_node, output_limits=limits.OutputLimits(cell_bytes=100))
+
+    output_types = [
+        output.output_type for output in notebook_node.cells[0].outputs]
+    assert output_types[-1] == "error"
+
+
+def test_cleared_outputs_free_budget():
+    notebook_node = run(
+        [
+            "from IPython.display import clear_output\n"
+            "for i in range(20):\n"
+            "    clear_output()\n"
+            "    print('x' * 600)",
+        ],
+        cell_bytes=1000,
+    )
+
+    assert "truncated" not in utils.get_output_text(notebook_node.cells[0])
+    assert limits.output_usage(notebook_node).omitted_bytes == 0
+
+
+def test_limits_are_part_of_cache_key(tmp_path):
+    execution_cache = cache.ExecutionCache(str(tmp_path))
+    utils.run_notebook_node(
+        utils.make_notebook_node([PRINT_LINES.format(100)]),
+        cache=execution_cache)
+
+    notebook_node = utils.make_notebook_node([PRINT_LINES.format(100)])
+    utils.run_notebook_node(
+        notebook_node,
+        cache=execution_cache,
+        output_limits=limits.OutputLimits(cell_bytes=1000))
+
+    assert limits.output_usage(notebook_node).omitted_bytes > 0
+
+
+def test_output_usage_without_limits():
+    notebook_node = utils.run_notebook_node(utils.make_notebook_node(["1"]))
+
+    assert limits.output_usage(notebook_node) is None
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("100", 100),
+    ("2K", 2048),
+    ("1.5m", 1536 * 1024),
+])
+def test_parse_size(value, expected):
+    assert cli._parse_size(value) == expected
+
+
+def test_cli_run_reports_truncation(tmp_path, capsys, write_notebook):
+    filepath = write_notebook(
+        tmp_path, "sample.ipynb", [PRINT_LINES.format(100)])
+
+    assert cli.main(
+        ["run", filepath, "--max-cell-output", "1K", "--jobs", "1"]) == 0
+    assert "output truncated in 1 cells" in capsys.readouterr().out
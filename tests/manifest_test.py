@@ -0,0 +1,180 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for skipping unchanged exports with a build manifest"""
+import os
+import stat
+
+import nbformat
+import pytest
+
+from nbsampleutils import export
+from nbsampleutils import manifest
+from nbsampleutils import utils
+
+
+PNG_DATA = (
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk"
+    "+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+
+def make_notebook(markdown="# Title", images=1):
+    notebook_node = utils.make_notebook_node(["plot()"])
+    notebook_node.cells.insert(0, nbformat.v4.new_markdown_cell(markdown))
+    notebook_node.cells[1].outputs = [
+        nbformat.v4.new_output("display_data", data={"image/png": PNG_DATA})
+        for _ in range(images)
+    ]
+    return notebook_node
+
+
+@pytest.fixture
+def notebook_path(tmp_path, write_notebook):
+    return write_notebook(tmp_path, "Sample.ipynb", make_notebook())
+
+
+def export_with_manifest(filepath, output_dir, **export_kwargs):
+    with manifest.BuildManifest(output_dir) as build_manifest:
+        export.export_from_filepath(
+            filepath,
+            output_dir=output_dir,
+            manifest=build_manifest,
+            **export_kwargs)
+    return build_manifest
+
+
+def test_export_writes_manifest(notebook_path, tmp_path):
+    output_dir = str(tmp_path / "out")
+
+    build_manifest = export_with_manifest(notebook_path, output_dir)
+
+    assert os.path.exists(os.path.join(output_dir, "sample.md"))
+    assert os.path.exists(
+        os.path.join(output_dir, "sample-resources", "sample_1_0.png"))
+    assert os.path.exists(
+        os.path.join(output_dir, manifest.MANIFEST_FILENAME))
+    assert len(build_manifest.written) == 2
+
+
+def test_written_files_use_default_permissions(notebook_path, tmp_path):
+    output_dir = str(tmp_path / "out")
+    reference_path = str(tmp_path / "reference.txt")
+    with open(reference_path, "w"):
+        pass
+    expected_mode = stat.S_IMODE(os.stat(reference_path).st_mode)
+
+    export_with_manifest(notebook_path, output_dir)
+
+    for path in [
+        os.path.join(output_dir, "sample.md"),
+        os.path.join(output_dir, "sample-resources", "sample_1_0.png"),
+        os.path.join(output_dir, manifest.MANIFEST_FILENAME),
+    ]:
+        assert stat.S_IMODE(os.stat(path).st_mode) == expected_mode
+
+
+def test_rewritten_files_keep_their_permissions(notebook_path, tmp_path):
+    output_dir = str(tmp_path / "out")
+    export_with_manifest(notebook_path, output_dir)
+    markdown_path = os.path.join(output_dir, "sample.md")
+    os.chmod(markdown_path, 0o640)
+
+    export_with_manifest(
+        notebook_path,
+        output_dir,
+        output_string_replacements={"Title": "Heading"},
+    )
+
+    assert stat.S_IMODE(os.stat(markdown_path).st_mode) == 0o640
+
+
+def test_unchanged_export_is_skipped(notebook_path, tmp_path):
+    output_dir = str(tmp_path / "out")
+    export_with_manifest(notebook_path, output_dir)
+
+    build_manifest = export_with_manifest(notebook_path, output_dir)
+
+    assert build_manifest.skipped == ["sample"]
+    assert build_manifest.written == []
+
+
+def test_changed_replacements_are_exported(notebook_path, tmp_path):
+    output_dir = str(tmp_path / "out")
+    export_with_manifest(notebook_path, output_dir)
+
+    build_manifest = export_with_manifest(
+        notebook_path,
+        output_dir,
+        output_string_replacements={"Title": "Heading"},
+    )
+
+    assert build_manifest.skipped == []
+    with open(os.path.join(output_dir, "sample.md")) as markdown_file:
+        assert "# Heading" in markdown_file.read()
+
+
+def test_only_changed_files_are_rewritten(
+        notebook_path, tmp_path, write_notebook):
+    output_dir = str(tmp_path / "out")
+    export_with_manifest(notebook_path, output_dir)
+    write_notebook(
+        tmp_path, "Sample.ipynb", make_notebook(markdown="# New title"))
+
+    build_manifest = export_with_manifest(notebook_path, output_dir)
+
+    assert build_manifest.written == [os.path.join(output_dir, "sample.md")]
+
+
+def test_stale_resource_files_are_removed(
+        notebook_path, tmp_path, write_notebook):
+    output_dir = str(tmp_path / "out")
+    write_notebook(tmp_path, "Sample.ipynb", make_notebook(images=2))
+    export_with_manifest(notebook_path, output_dir)
+    stale = os.path.join(output_dir, "sample-resources", "sample_1_1.png")
+    assert os.path.exists(stale)
+    write_notebook(tmp_path, "Sample.ipynb", make_notebook(images=1))
+
+    export_with_manifest(notebook_path, output_dir)
+
+    assert not os.path.exists(stale)
+
+
+def test_missing_output_is_exported_again(notebook_path, tmp_path):
+    output_dir = str(tmp_path / "out")
+    export_with_manifest(notebook_path, output_dir)
+    os.remove(os.path.join(output_dir, "sample.md"))
+
+    build_manifest = export_with_manifest(notebook_path, output_dir)
+
+    assert build_manifest.skipped == []
+    assert build_manifest.written == [os.path.join(output_dir, "sample.md")]
+
+
+def test_export_from_node_with_manifest(tmp_path):
+    output_dir = str(tmp_path)
+    with manifest.BuildManifest(output_dir) as build_manifest:
+        for _ in range(2):
+            export.export_from_node(
+                make_notebook(), "node", output_dir, manifest=build_manifest)
+
+    assert len(build_manifest.written) == 2
+
+
+def test_hash_inputs(notebook_path):
+    base = manifest.hash_inputs(notebook_path)
+
+    assert base == manifest.hash_inputs(notebook_path)
+    assert base != manifest.hash_inputs(notebook_path, execute=True)
+    assert base != manifest.hash_inputs(
+        notebook_path, output_string_replacements={"a": "b"})
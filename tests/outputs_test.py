@@ -0,0 +1,108 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for indexed notebook output text"""
+
+import re
+
+import pytest
+
+from nbsampleutils import outputs
+from nbsampleutils import utils
+
+
+@pytest.fixture(scope="module")
+def executed_notebook():
+    notebook_node = utils.make_notebook_node([
+        'print("rows: 10")\n2 + 2',
+        "x = 1",
+        'print("rows: 25")',
+        'raise ValueError("bad value")',
+    ])
+    notebook_node.cells[0].metadata["tags"] = ["check"]
+    notebook_node.cells[2].metadata["tags"] = ["check"]
+    return utils.run_notebook_node(notebook_node, allow_errors=True)
+
+
+def test_output_index_matches_get_output_text(executed_notebook):
+    index = outputs.OutputIndex(executed_notebook, include_errors=False)
+
+    assert len(index) == 4
+    for cell_index, cell in enumerate(executed_notebook.cells):
+        assert index[cell_index] == utils.get_output_text(cell)
+
+
+def test_output_index_includes_errors(executed_notebook):
+    index = outputs.OutputIndex(executed_notebook)
+
+    assert index[3] == "ValueError: bad value"
+    assert index[-1] == "ValueError: bad value"
+    assert index[1] == ""
+
+
+def test_output_index_lookup_by_tag(executed_notebook):
+    index = outputs.OutputIndex(executed_notebook)
+
+    assert index.cells_with_tag("check") == [0, 2]
+    assert index.cells_with_tag("missing") == []
+
+
+def test_output_index_contains(executed_notebook):
+    index = outputs.OutputIndex(executed_notebook)
+
+    assert index.contains("rows: 25")
+    assert index.contains("4", cell_index=0)
+    assert not index.contains("rows: 25", cell_index=0)
+    assert index.contains("rows: 25", tag="check")
+    assert not index.contains("bad value", tag="check")
+
+
+def test_output_index_search(executed_notebook):
+    index = outputs.OutputIndex(executed_notebook)
+
+    matches = index.search(r"rows: (\d+)")
+
+    assert [(match.cell_index, match.text) for match in matches] == [
+        (0, "rows: 10"), (2, "rows: 25")]
+    assert index[0][matches[0].start:matches[0].end] == "rows: 10"
+    assert index.search(r"rows: \d+", cell_index=2)[0].start == 0
+    assert index.search("VALUE") == []
+    assert len(index.search("VALUE", flags=re.IGNORECASE)) == 2
+
+
+def test_output_index_search_does_not_span_cells(executed_notebook):
+    index = outputs.OutputIndex(executed_notebook)
+
+    assert index.search(r"4\n[\s\S]*rows") == []
+
+
+def test_output_index_search_greedy_pattern_stops_at_cell(executed_notebook):
+    index = outputs.OutputIndex(executed_notebook)
+
+    matches = index.search(r"rows: .*", flags=re.DOTALL)
+
+    assert [(match.cell_index, match.text) for match in matches] == [
+        (0, "rows: 10\n4"), (2, "rows: 25\n")]
+    assert [match.text for match in index.search(r"Error: .*")] == [
+        "Error: bad value"]
+
+
+def test_output_index_search_anchors_match_cell_start(executed_notebook):
+    index = outputs.OutputIndex(executed_notebook)
+
+    matches = index.search(r"^rows: \d+$", flags=re.MULTILINE)
+
+    assert [match.cell_index for match in matches] == [0, 2]
+    assert [match.cell_index for match in index.search(r"^rows")] == [0, 2]
+    assert index.search(r"^rows", cell_index=2)[0].start == 0
+    assert index.search(r"^ValueError", tag="check") == []
@@ -0,0 +1,96 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for fused notebook processing pipelines"""
+
+import os
+
+from nbsampleutils import pipeline
+from nbsampleutils import preprocessors
+from nbsampleutils import utils
+
+
+def test_apply_transforms_in_one_traversal():
+    visited = []
+
+    def record(cell, resources, index):
+        visited.append(("record", index))
+        return cell, resources
+
+    notebook_node = utils.make_notebook_node(
+        ['print("PROJECT")', "# TEST_CELL", "x = 1"])
+    processor = pipeline.Pipeline(prepare=[
+        preprocessors.ReplaceCodeInputStringsPreprocessor(
+            string_replacements={"PROJECT": "my-project"}),
+        preprocessors.RemoveTaggedCellsPreprocessor(tag_string="# TEST_CELL"),
+        record,
+    ])
+
+    processor.run(notebook_node)
+
+    assert [cell.source for cell in notebook_node.cells] == [
+        'print("my-project")', "x = 1"]
+    # Removed cells are not passed to later transforms
+    assert visited == [("record", 0), ("record", 2)]
+
+
+def test_timings_per_stage():
+    notebook_node = utils.make_notebook_node(["1 + 1"])
+    processor = pipeline.Pipeline(
+        prepare=[preprocessors.RemoveTaggedCellsPreprocessor(tag_string="#")],
+        clean=[preprocessors.StripStylesPreprocessor()],
+    )
+
+    processor.run(notebook_node)
+    processor.run(notebook_node)
+
+    assert list(processor.timings) == [
+        "RemoveTaggedCellsPreprocessor", "StripStylesPreprocessor"]
+    assert all(seconds >= 0 for seconds in processor.timings.values())
+
+    processor.reset_timings()
+
+    assert processor.timings == {}
+
+
+def test_execute_clean_and_export(tmp_path, write_notebook):
+    filepath = write_notebook(tmp_path, "Pipeline Sample.ipynb", [
+        'html = "<style>p {color: red}</style><p>VALUE</p>"',
+        "from IPython.display import HTML\nHTML(html)",
+        "# TEST_CELL\nassert True",
+    ])
+    processor = pipeline.Pipeline(
+        prepare=[
+            preprocessors.RemoveTaggedCellsPreprocessor(
+                tag_string="# TEST_CELL"),
+        ],
+        clean=[preprocessors.StripStylesPreprocessor()],
+        execute=True,
+    )
+
+    notebook_node = processor.run_from_filepath(
+        filepath, output_string_replacements={"VALUE": "replaced"})
+
+    assert len(notebook_node.cells) == 2
+    html = notebook_node.cells[1].outputs[0].data["text/html"]
+    assert "<style>" not in html
+    with open(os.path.join(str(tmp_path), "pipeline-sample.md")) as md_file:
+        markdown = md_file.read()
+    assert "<p>replaced</p>" in markdown
+    assert "# TEST_CELL" not in markdown
+    assert set(processor.timings) == {
+        "RemoveTaggedCellsPreprocessor",
+        "execute",
+        "StripStylesPreprocessor",
+        "export",
+    }
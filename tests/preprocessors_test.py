@@ -13,9 +13,13 @@
 # limitations under the License.
 """Tests for custom nbconvert preprocessors"""
 
+import collections
+
 import nbformat
 
 from nbsampleutils import preprocessors
+from nbsampleutils import replace
+from nbsampleutils import styles
 from nbsampleutils import utils
 
 
@@ -112,3 +116,192 @@ def test_remove_tagged_cells_skips_markdown_cells():
     assert len(notebook_node.cells) == 2
     processed_cell_sources = set(cell.source for cell in notebook_node.cells)
     assert processed_cell_sources == original_cell_sources
+
+
+def test_replace_code_input_strings_accepts_compiled_replacer():
+    notebook_node = utils.make_notebook_node(['print("PROJECT", "REGION")'])
+    replacer = replace.StringReplacer(
+        {"PROJECT": "my-project", "REGION": "us-east1"})
+    processor = preprocessors.ReplaceCodeInputStringsPreprocessor(
+        string_replacements=replacer
+    )
+
+    processor.preprocess(notebook_node, {})
+
+    assert notebook_node.cells[0].source == (
+        'print("my-project", "us-east1")')
+
+
+STYLED_HTML = (
+    '<style scoped="">.dataframe { color: red; }</style>'
+    '<table border="1" class="dataframe"><tr style="text-align: right;">'
+    "<td>CONTENT</td></tr></table>"
+)
+
+
+def make_html_output(html):
+    return nbformat.v4.new_output(
+        "display_data", data={"text/html": html, "text/plain": "table"})
+
+
+def test_strip_styles_preprocessor_cleans_html_outputs():
+    notebook_node = utils.make_notebook_node(["df"])
+    notebook_node.cells[0].outputs = [
+        make_html_output(STYLED_HTML.replace("CONTENT", "outputs"))]
+    processor = preprocessors.StripStylesPreprocessor()
+
+    processor.preprocess(notebook_node, {})
+
+    data = notebook_node.cells[0].outputs[0].data
+    assert data["text/html"] == "<table><tr><td>outputs</td></tr></table>"
+    assert data["text/plain"] == "table"
+
+
+def test_strip_styles_preprocessor_cleans_markdown_cells():
+    notebook_node = utils.make_notebook_node([])
+    notebook_node.cells.append(nbformat.v4.new_markdown_cell(
+        "# Title\n" + STYLED_HTML.replace("CONTENT", "markdown")))
+    processor = preprocessors.StripStylesPreprocessor()
+
+    processor.preprocess(notebook_node, {})
+
+    assert notebook_node.cells[0].source == (
+        "# Title\n<table><tr><td>markdown</td></tr></table>")
+
+
+def test_strip_styles_preprocessor_caches_cleaned_outputs(monkeypatch):
+    calls = []
+    strip_styles = styles.strip_styles
+
+    def counting_strip_styles(html):
+        calls.append(html)
+        return strip_styles(html)
+
+    monkeypatch.setattr(
+        preprocessors.styles, "strip_styles", counting_strip_styles)
+    html = STYLED_HTML.replace("CONTENT", "cached")
+
+    for _ in range(3):
+        notebook_node = utils.make_notebook_node(["df"])
+        notebook_node.cells[0].outputs = [make_html_output(html)]
+        preprocessors.StripStylesPreprocessor().preprocess(notebook_node, {})
+
+    assert calls == [html]
+    data = notebook_node.cells[0].outputs[0].data
+    assert data["text/html"] == "<table><tr><td>cached</td></tr></table>"
+
+
+def test_strip_styles_cache_is_bounded_by_size(monkeypatch):
+    cls = preprocessors.StripStylesPreprocessor
+    monkeypatch.setattr(cls, "_cache", collections.OrderedDict())
+    monkeypatch.setattr(cls, "_cache_used", 0)
+    monkeypatch.setattr(cls, "cache_bytes", 100)
+    processor = cls()
+
+    for content in ("first", "second", "third"):
+        processor.strip_styles(STYLED_HTML.replace("CONTENT", content))
+    processor.strip_styles("<p>" + "x" * 200 + "</p>")
+
+    assert cls._cache_used <= 100
+    assert cls._cache_used == sum(len(html) for html in cls._cache.values())
+    assert list(cls._cache.values())[-1] == (
+        "<table><tr><td>third</td></tr></table>")
+
+
+def test_remove_cells_with_any_of_several_tag_strings():
+    cell_contents = [
+        "# TEST_CELL\nassert True",
+        "print(2 + 2)",
+        "# SETUP_CELL\nimport os",
+    ]
+    notebook_node = utils.make_notebook_node(cell_contents)
+    processor = preprocessors.RemoveTaggedCellsPreprocessor(
+        tag_string=["# TEST_CELL", "# SETUP_CELL"]
+    )
+
+    processor.preprocess(notebook_node, {})
+
+    assert [cell.source for cell in notebook_node.cells] == [cell_contents[1]]
+
+
+def test_remove_cells_with_metadata_tags():
+    notebook_node = utils.make_notebook_node(["1 + 1", "print(2 + 2)"])
+    notebook_node.cells[0].metadata["tags"] = ["remove_cell"]
+    notebook_node.cells.append(nbformat.v4.new_markdown_cell(
+        source="Note for testers", metadata={"tags": ["remove_cell"]}))
+    processor = preprocessors.RemoveTaggedCellsPreprocessor(
+        tags=["remove_cell"]
+    )
+
+    processor.preprocess(notebook_node, {})
+
+    assert [cell.source for cell in notebook_node.cells] == ["print(2 + 2)"]
+
+
+def test_remove_tagged_cells_preprocessor_is_reusable():
+    processor = preprocessors.RemoveTaggedCellsPreprocessor(
+        tag_string="# TEST_CELL"
+    )
+    first = utils.make_notebook_node(["# TEST_CELL", "1 + 1", "# TEST_CELL"])
+    second = utils.make_notebook_node(["print(2 + 2)", "3 + 3"])
+
+    processor.preprocess(first, {})
+    processor.preprocess(second, {})
+
+    assert [cell.source for cell in first.cells] == ["1 + 1"]
+    assert [cell.source for cell in second.cells] == ["print(2 + 2)", "3 + 3"]
+
+
+def test_remove_tagged_cells_from_large_notebook():
+    cell_contents = [
+        "# TEST_CELL" if index % 2 else "x = {}".format(index)
+        for index in range(20000)
+    ]
+    notebook_node = utils.make_notebook_node(cell_contents)
+    processor = preprocessors.RemoveTaggedCellsPreprocessor(
+        tag_string="# TEST_CELL"
+    )
+
+    processor.preprocess(notebook_node, {})
+
+    assert len(notebook_node.cells) == 10000
+    assert notebook_node.cells[-1].source == "x = 19998"
+
+
+class RecordingWriter(object):
+
+    def __init__(self):
+        self.files = {}
+
+    def write(self, filename, data):
+        assert filename not in self.files
+        self.files[filename] = data
+
+
+def test_spill_outputs_preprocessor_writes_each_output():
+    notebook_node = utils.make_notebook_node(["plot()", "plot()"])
+    for cell in notebook_node.cells:
+        cell.outputs = [nbformat.v4.new_output(
+            "display_data",
+            data={"image/png": "iVBORw0KGgo=", "text/plain": "x"},
+        )]
+    writer = RecordingWriter()
+    resources = {
+        "unique_key": "sample",
+        "output_files_dir": "sample-resources",
+        "outputs": {},
+        "output_writer": writer,
+    }
+    processor = preprocessors.SpillOutputsPreprocessor()
+
+    processor.preprocess(notebook_node, resources)
+
+    assert writer.files == {
+        "sample-resources/sample_0_0.png": b"\x89PNG\r\n\x1a\n",
+        "sample-resources/sample_1_0.png": b"\x89PNG\r\n\x1a\n",
+    }
+    output = notebook_node.cells[1].outputs[0]
+    assert output.data["image/png"] == ""
+    assert output.data["text/plain"] == "x"
+    assert output.metadata.filenames == {
+        "image/png": "sample-resources/sample_1_0.png"}
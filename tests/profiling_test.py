@@ -0,0 +1,93 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for per-cell execution profiling"""
+
+import asyncio
+import csv
+import io
+import json
+
+import nbconvert
+import pytest
+
+from nbsampleutils import profiling
+from nbsampleutils import utils
+
+
+@pytest.fixture(scope="module")
+def profiled_notebook():
+    notebook_node = utils.make_notebook_node([
+        "import time\ntime.sleep(0.2)",
+        "data = bytearray(20 * 1024 * 1024)",
+        "print('x' * 1000)",
+    ])
+    return utils.run_notebook_node(notebook_node, profile=True)
+
+
+def test_profile_records_cell_metadata(profiled_notebook):
+    profiles = profiling.cell_profiles(profiled_notebook, filepath="nb.ipynb")
+
+    assert [profile.cell_index for profile in profiles] == [0, 1, 2]
+    assert profiles[0].source == "import time"
+    assert profiles[0].filepath == "nb.ipynb"
+    assert profiles[0].wall_time >= 0.2
+    assert all(profile.queue_wait >= 0 for profile in profiles)
+    assert profiles[1].peak_memory >= 20 * 1024 * 1024
+    assert profiles[2].output_size > 1000
+    assert profiling.kernel_startup(profiled_notebook) > 0
+
+
+def test_profile_is_opt_in():
+    notebook_node = utils.run_notebook_node(utils.make_notebook_node(["1"]))
+
+    assert profiling.cell_profiles(notebook_node) == []
+    assert profiling.kernel_startup(notebook_node) is None
+
+
+def test_profiler_calls_existing_hooks():
+    executed = []
+    notebook_node = utils.make_notebook_node(["1", "2"])
+    processor = nbconvert.preprocessors.ExecutePreprocessor(
+        on_cell_executed=lambda cell, cell_index, execute_reply: (
+            executed.append(cell_index)))
+    profiling.CellProfiler(memory=False).attach(processor)
+
+    processor.preprocess(notebook_node, {})
+
+    assert executed == [0, 1]
+    assert profiling.cell_profiles(notebook_node)[0].peak_memory is None
+
+
+def test_async_run_notebook_node_profile():
+    notebook_node = utils.make_notebook_node(["1 + 1"])
+
+    asyncio.run(utils.async_run_notebook_node(notebook_node, profile=True))
+
+    assert len(profiling.cell_profiles(notebook_node)) == 1
+
+
+def test_slowest_and_export(profiled_notebook):
+    profiles = profiling.cell_profiles(profiled_notebook)
+
+    ranked = profiling.slowest(profiles, count=2)
+
+    assert len(ranked) == 2
+    assert ranked[0].cell_index == 0
+    json_file = io.StringIO()
+    profiling.write_json(profiles, json_file)
+    assert json.loads(json_file.getvalue())[0]["source"] == "import time"
+    csv_file = io.StringIO()
+    profiling.write_csv(profiles, csv_file)
+    rows = list(csv.DictReader(io.StringIO(csv_file.getvalue())))
+    assert [row["cell_index"] for row in rows] == ["0", "1", "2"]
@@ -0,0 +1,121 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for cell-by-cell execution callbacks"""
+import asyncio
+import time
+
+import nbformat
+import pytest
+from nbconvert.preprocessors.execute import CellExecutionError
+
+from nbsampleutils import cache
+from nbsampleutils import progress
+from nbsampleutils import utils
+
+
+def test_on_cell_sees_outputs_before_next_cell():
+    notebook_node = utils.make_notebook_node(["print('first')", "2 + 2"])
+    notebook_node.cells.insert(1, nbformat.v4.new_markdown_cell("# Notes"))
+    seen = []
+
+    def on_cell(cell, cell_index):
+        later = notebook_node.cells[-1]
+        seen.append((cell_index, utils.get_output_text(cell), later.outputs))
+
+    utils.run_notebook_node(notebook_node, on_cell=on_cell)
+
+    assert [(index, text) for index, text, _ in seen] == [
+        (0, "first\n"), (2, "4")]
+    # The last cell had not run when the first callback was made
+    assert seen[0][2] == []
+
+
+def test_stop_execution_returns_partial_notebook():
+    notebook_node = utils.make_notebook_node(["1", "2", "3"])
+
+    def on_cell(cell, cell_index):
+        if cell_index == 1:
+            raise progress.StopExecution()
+
+    result = utils.run_notebook_node(notebook_node, on_cell=on_cell)
+
+    assert result is notebook_node
+    assert [cell.execution_count for cell in notebook_node.cells] == [
+        1, 2, None]
+
+
+def test_on_cell_replays_cache_hits(tmp_path):
+    execution_cache = cache.ExecutionCache(str(tmp_path))
+    utils.run_notebook_node(
+        utils.make_notebook_node(["1", "2"]), cache=execution_cache)
+    seen = []
+
+    utils.run_notebook_node(
+        utils.make_notebook_node(["1", "2"]),
+        cache=execution_cache,
+        on_cell=lambda cell, cell_index: seen.append(cell_index))
+
+    assert seen == [0, 1]
+
+
+def test_iter_cells_yields_cells_as_they_finish():
+    notebook_node = utils.make_notebook_node(
+        ["'first'", "import time; time.sleep(3)", "'last'"])
+
+    start = time.perf_counter()
+    yielded = []
+    for cell_index, cell in utils.iter_cells(notebook_node):
+        yielded.append((cell_index, time.perf_counter() - start))
+    total = time.perf_counter() - start
+
+    assert [index for index, _ in yielded] == [0, 1, 2]
+    assert yielded[0][1] < total - 2.5
+    assert notebook_node.cells[2].outputs[0].data["text/plain"] == "'last'"
+
+
+def test_iter_cells_stops_when_closed():
+    notebook_node = utils.make_notebook_node(
+        ["1", "import time; time.sleep(60)", "3"])
+
+    start = time.perf_counter()
+    for cell_index, _ in utils.iter_cells(notebook_node):
+        break
+
+    assert cell_index == 0
+    assert time.perf_counter() - start < 30
+    assert notebook_node.cells[2].execution_count is None
+
+
+def test_iter_cells_raises_after_yielding_earlier_cells():
+    notebook_node = utils.make_notebook_node(["1", "undefined_variable"])
+    yielded = []
+
+    with pytest.raises(CellExecutionError):
+        for cell_index, _ in utils.iter_cells(notebook_node):
+            yielded.append(cell_index)
+
+    assert yielded[0] == 0
+
+
+def test_async_on_cell_coroutine():
+    notebook_node = utils.make_notebook_node(["1", "2"])
+    seen = []
+
+    async def on_cell(cell, cell_index):
+        await asyncio.sleep(0)
+        seen.append(cell_index)
+
+    asyncio.run(utils.async_run_notebook_node(notebook_node, on_cell=on_cell))
+
+    assert seen == [0, 1]
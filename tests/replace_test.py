@@ -0,0 +1,111 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the string replacement engine"""
+import pytest
+
+from nbsampleutils import replace
+
+
+def test_literal_replacements():
+    replacer = replace.StringReplacer(
+        {"PROJECT": "my-project", "REGION": "us-east1"})
+
+    result = replacer.replace("gcloud --project=PROJECT --region=REGION")
+
+    assert result == "gcloud --project=my-project --region=us-east1"
+
+
+def test_literal_replacements_escape_special_characters():
+    replacer = replace.StringReplacer({"a.b": "x", "(c)": "y"})
+
+    assert replacer.replace("a.b acb (c) c") == "x acb y c"
+
+
+def test_literal_replacements_prefer_longest_key():
+    replacer = replace.StringReplacer(
+        {"DATASET": "short", "DATASET_ID": "long"})
+
+    assert replacer.replace("DATASET_ID DATASET") == "long short"
+
+
+def test_literal_replacements_are_not_chained():
+    replacer = replace.StringReplacer({"a": "b", "b": "c"})
+
+    assert replacer.replace("ab") == "bc"
+
+
+def test_empty_mapping_leaves_text_unchanged():
+    replacer = replace.StringReplacer({})
+
+    assert not replacer
+    assert replacer.replace("text") == "text"
+
+
+def test_empty_keys_are_ignored():
+    replacer = replace.StringReplacer({"": "x", "a": "b"})
+
+    assert replacer.replace("aa") == "bb"
+
+
+def test_regex_replacements():
+    replacer = replace.StringReplacer(
+        {r"key-[0-9]+": "REDACTED", r"\bfoo\b": "bar"}, regex=True)
+
+    assert replacer.replace("key-123 foo food") == "REDACTED bar food"
+
+
+def test_regex_replacements_expand_templates():
+    replacer = replace.StringReplacer(
+        {r"[a-z]+@example\.com": r"<\g<0>>", "tab": r"\t"}, regex=True)
+
+    assert replacer.replace("me@example.com tab") == "<me@example.com> \t"
+
+
+@pytest.mark.parametrize("replacements", [
+    {r"(\w+)@example\.com": r"\1 at example", "zzz": "y"},
+    {r"(?i)(user)@example\.com": "USER at example", "zzz": "y"},
+    {"zzz": "y", r"(?i)user@example\.com": "USER at example"},
+])
+def test_regex_replacements_support_groups_and_flags(replacements):
+    replacer = replace.StringReplacer(replacements, regex=True)
+
+    assert replacer.replace("USER@example.com zzz") == "USER at example y"
+
+
+def test_as_replacer_reuses_compiled_replacer():
+    replacer = replace.StringReplacer({"a": "b"})
+
+    assert replace.as_replacer(replacer) is replacer
+    assert replace.as_replacer({"a": "b"}).replace("a") == "b"
+
+
+def test_regex_mode_applies_keys_in_mapping_order():
+    replacer = replace.StringReplacer(
+        {"my-project": "PROJECT", r"PROJ\w+": "<redacted>"}, regex=True)
+
+    assert replacer.replace("my-project") == "<redacted>"
+
+
+def test_regex_mode_applies_patterns_before_later_literal_keys():
+    replacer = replace.StringReplacer(
+        {"foo.bar": "x", "abc": "foo.bar"}, regex=True)
+
+    assert replacer.replace("abc") == "foo.bar"
+
+
+def test_many_literal_keys_share_prefixes():
+    replacements = {"KEY_{}".format(num): str(num) for num in range(300)}
+    replacer = replace.StringReplacer(replacements)
+
+    assert replacer.replace("KEY_1 KEY_12 KEY_123 KEY_") == "1 12 123 KEY_"
@@ -0,0 +1,165 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for dependency-aware notebook scheduling"""
+import os
+import time
+
+import pytest
+
+from nbsampleutils import METADATA_KEY
+from nbsampleutils import schedule
+
+
+def depends_on(*paths):
+    return {METADATA_KEY: {"depends_on": list(paths)}}
+
+
+def test_read_dependencies_resolves_relative_paths(tmp_path, write_notebook):
+    subdir = tmp_path / "nested"
+    subdir.mkdir()
+    filepath = write_notebook(
+        subdir, "child.ipynb", ["1"], metadata=depends_on("../parent.ipynb"))
+
+    assert schedule.read_dependencies(filepath) == [
+        os.path.join(str(tmp_path), "parent.ipynb")]
+
+
+def test_build_graph_orders_prerequisites_first(tmp_path, write_notebook):
+    last = write_notebook(
+        tmp_path, "a_last.ipynb", ["1"], metadata=depends_on("c_middle.ipynb"))
+    middle = write_notebook(
+        tmp_path, "c_middle.ipynb", ["1"],
+        metadata=depends_on("b_first.ipynb"))
+    first = write_notebook(tmp_path, "b_first.ipynb", ["1"])
+
+    graph = schedule.build_graph(str(tmp_path))
+
+    assert list(graph) == [first, middle, last]
+    assert graph[last] == [middle]
+
+
+def test_build_graph_adds_prerequisites_outside_paths(
+        tmp_path, write_notebook):
+    child = write_notebook(
+        tmp_path, "child.ipynb", ["1"], metadata=depends_on("parent.ipynb"))
+    parent = write_notebook(tmp_path, "parent.ipynb", ["1"])
+
+    graph = schedule.build_graph(child)
+
+    assert list(graph) == [parent, child]
+
+
+def test_build_graph_with_explicit_dependencies(tmp_path, write_notebook):
+    child = write_notebook(tmp_path, "child.ipynb", ["1"])
+    parent = write_notebook(tmp_path, "parent.ipynb", ["1"])
+
+    graph = schedule.build_graph(
+        str(tmp_path), dependencies={child: [parent]})
+
+    assert list(graph) == [parent, child]
+
+
+def test_build_graph_rejects_missing_prerequisites(tmp_path, write_notebook):
+    write_notebook(
+        tmp_path, "child.ipynb", ["1"], metadata=depends_on("missing.ipynb"))
+
+    with pytest.raises(ValueError, match="missing.ipynb"):
+        schedule.build_graph(str(tmp_path))
+
+
+def test_build_graph_rejects_cycles(tmp_path, write_notebook):
+    write_notebook(tmp_path, "a.ipynb", ["1"], metadata=depends_on("b.ipynb"))
+    write_notebook(tmp_path, "b.ipynb", ["1"], metadata=depends_on("a.ipynb"))
+    write_notebook(tmp_path, "c.ipynb", ["1"])
+
+    with pytest.raises(ValueError, match="cycle"):
+        schedule.build_graph(str(tmp_path))
+
+
+def test_critical_path():
+    graph = schedule._sort_graph({
+        "prepare": [],
+        "train": ["prepare"],
+        "plot": ["prepare"],
+        "report": ["train", "plot"],
+    })
+
+    path, total = schedule.critical_path(
+        graph, {"prepare": 1.0, "train": 5.0, "plot": 2.0, "report": 1.0})
+
+    assert path == ["prepare", "train", "report"]
+    assert total == 7.0
+    path, total = schedule.critical_path(graph)
+    assert len(path) == 3
+    assert total == 3.0
+
+
+def test_run_graph_runs_dependents_after_prerequisites(
+        tmp_path, write_notebook):
+    write_notebook(
+        tmp_path,
+        "a_read.ipynb",
+        ["assert open('data.txt').read() == 'ready'"],
+        metadata=depends_on("b_write.ipynb"),
+    )
+    write_notebook(
+        tmp_path,
+        "b_write.ipynb",
+        ["import time; time.sleep(1)", "open('data.txt', 'w').write('ready')"],
+    )
+
+    results = schedule.run_graph(str(tmp_path), max_workers=2)
+
+    assert [os.path.basename(result.filepath) for result in results] == [
+        "b_write.ipynb", "a_read.ipynb"]
+    assert [result.error for result in results] == [None, None]
+
+
+def test_run_graph_skips_dependents_of_failures(tmp_path, write_notebook):
+    failing = write_notebook(tmp_path, "failing.ipynb", ["undefined_variable"])
+    write_notebook(
+        tmp_path, "child.ipynb", ["1"], metadata=depends_on("failing.ipynb"))
+    write_notebook(
+        tmp_path, "grandchild.ipynb", ["1"],
+        metadata=depends_on("child.ipynb"))
+    independent = write_notebook(tmp_path, "independent.ipynb", ["1"])
+
+    results = {
+        os.path.basename(result.filepath): result
+        for result in schedule.run_graph(str(tmp_path), max_workers=2)
+    }
+
+    assert "CellExecutionError" in results["failing.ipynb"].error
+    assert results["child.ipynb"].error == (
+        "Skipped: prerequisite {} failed".format(failing))
+    assert results["grandchild.ipynb"].error.startswith("Skipped")
+    assert results[os.path.basename(independent)].error is None
+
+
+def test_run_graph_runs_independent_chains_in_parallel(
+        tmp_path, write_notebook):
+    sleep = ["import time; time.sleep(2)"]
+    for chain in ("a", "b"):
+        write_notebook(tmp_path, chain + "1.ipynb", sleep)
+        write_notebook(
+            tmp_path, chain + "2.ipynb", sleep,
+            metadata=depends_on(chain + "1.ipynb"))
+
+    start = time.perf_counter()
+    results = schedule.run_graph(str(tmp_path), max_workers=2)
+    elapsed = time.perf_counter() - start
+
+    assert all(result.error is None for result in results)
+    serial = sum(result.duration for result in results)
+    assert elapsed < serial
@@ -0,0 +1,122 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for sharded execution"""
+import os
+
+import pytest
+
+from nbsampleutils import batch
+from nbsampleutils import shards
+
+
+FILEPATHS = ["nb{}.ipynb".format(index) for index in range(10)]
+
+
+def make_result(filepath, error=None, duration=1.0):
+    return batch.NotebookResult(
+        filepath=filepath, notebook_node=None, error=error, duration=duration)
+
+
+def test_partition_covers_every_notebook_once():
+    partitioned = shards.partition(FILEPATHS, 3)
+
+    assert len(partitioned) == 3
+    assert sorted(sum(partitioned, [])) == sorted(FILEPATHS)
+    assert [len(shard) for shard in partitioned] == [4, 3, 3]
+
+
+def test_partition_is_deterministic():
+    timings = {"nb1.ipynb": 5.0, "nb2.ipynb": 3.0}
+
+    assert shards.partition(FILEPATHS, 3, timings) == shards.partition(
+        list(reversed(FILEPATHS)), 3, dict(timings))
+
+
+def test_partition_balances_by_timings():
+    timings = {"nb0.ipynb": 10.0, "nb1.ipynb": 6.0, "nb2.ipynb": 4.0}
+
+    partitioned = shards.partition(
+        ["nb0.ipynb", "nb1.ipynb", "nb2.ipynb"], 2, timings)
+
+    assert partitioned == [["nb0.ipynb"], ["nb1.ipynb", "nb2.ipynb"]]
+
+
+def test_partition_uses_average_for_unknown_notebooks():
+    timings = {"nb0.ipynb": 4.0, "nb1.ipynb": 4.0}
+
+    partitioned = shards.partition(
+        ["nb0.ipynb", "nb1.ipynb", "new.ipynb"], 2, timings)
+
+    assert partitioned == [["nb0.ipynb", "new.ipynb"], ["nb1.ipynb"]]
+
+
+def test_select_shard_rejects_bad_index():
+    with pytest.raises(ValueError):
+        shards.select_shard(FILEPATHS, 3, 3)
+
+
+def test_timings_round_trip(tmp_path):
+    path = str(tmp_path / "timings.json")
+    assert shards.load_timings(path) == {}
+
+    shards.write_timings([make_result("a.ipynb", duration=2.5)], path)
+    shards.write_timings([make_result("b.ipynb", duration=1.5)], path)
+
+    assert shards.load_timings(path) == {"a.ipynb": 2.5, "b.ipynb": 1.5}
+
+
+def test_write_timings_keeps_timings_of_failed_notebooks(tmp_path):
+    path = str(tmp_path / "timings.json")
+    shards.write_timings([
+        make_result("a.ipynb", duration=2.5),
+        make_result("b.ipynb", duration=1.5),
+    ], path)
+    shards.write_timings([
+        make_result("a.ipynb", duration=0.0, error="ExecutionCancelled"),
+        make_result("b.ipynb", duration=3.0),
+        make_result("c.ipynb", duration=0.5, error="CellExecutionError"),
+    ], path)
+
+    assert shards.load_timings(path) == {"a.ipynb": 2.5, "b.ipynb": 3.0}
+
+
+def test_merge_results(tmp_path):
+    first = str(tmp_path / "0.json")
+    second = str(tmp_path / "1.json")
+    shards.write_results(
+        [make_result("b.ipynb", error="CellExecutionError: boom")],
+        first, shard_index=0, shard_count=2)
+    shards.write_results(
+        [make_result("a.ipynb")], second, shard_index=1, shard_count=2)
+
+    merged = shards.merge_results([first, second])
+
+    assert [result.filepath for result in merged] == ["a.ipynb", "b.ipynb"]
+    assert merged[1].error == "CellExecutionError: boom"
+
+
+def test_merge_results_rejects_missing_shards(tmp_path):
+    path = str(tmp_path / "0.json")
+    shards.write_results([], path, shard_index=0, shard_count=2)
+
+    with pytest.raises(ValueError, match="Missing"):
+        shards.merge_results([path])
+
+
+def test_merge_results_rejects_duplicate_shards(tmp_path):
+    path = str(tmp_path / "0.json")
+    shards.write_results([], path, shard_index=0, shard_count=1)
+
+    with pytest.raises(ValueError, match="more than once"):
+        shards.merge_results([path, os.path.join(str(tmp_path), "0.json")])
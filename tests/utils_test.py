@@ -12,9 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Tests for notebook utilities"""
+import asyncio
+import json
 import os
+import time
 
 from nbconvert.preprocessors.execute import CellExecutionError
+import nbformat
 import pytest
 
 from nbsampleutils import utils
@@ -110,3 +114,138 @@ def test_run_notebook_node():
 
     output = notebook_node.cells[0].outputs[0]
     assert output.data["text/plain"] == "4"
+
+
+def test_async_run_notebook_node():
+    notebook_node = utils.make_notebook_node(["2 + 2"])
+
+    asyncio.run(utils.async_run_notebook_node(notebook_node))
+
+    output = notebook_node.cells[0].outputs[0]
+    assert output.data["text/plain"] == "4"
+
+
+def test_async_run_from_filepath_replaces_input_strings():
+    notebook_path = os.path.join(RESOURCES_DIR, "Variables.ipynb")
+
+    notebook_node = asyncio.run(utils.async_run_from_filepath(
+        notebook_path, input_string_replacements={"Pizza": "Cheese"}))
+
+    assert sum("Pizza" in cell.source for cell in notebook_node.cells) == 0
+    assert sum("Cheese" in cell.source for cell in notebook_node.cells) == 2
+
+
+def test_async_run_notebook_node_disallows_errors_by_default():
+    notebook_node = utils.make_notebook_node(["undefined_variable"])
+
+    with pytest.raises(CellExecutionError):
+        asyncio.run(utils.async_run_notebook_node(notebook_node))
+
+
+def test_async_run_notebook_node_limits_concurrency():
+    async def run_all():
+        semaphore = asyncio.Semaphore(2)
+        notebook_nodes = [
+            utils.make_notebook_node(["import time\ntime.sleep(0.5)"])
+            for _ in range(3)
+        ]
+        await asyncio.gather(*[
+            utils.async_run_notebook_node(node, semaphore=semaphore)
+            for node in notebook_nodes
+        ])
+        return notebook_nodes
+
+    notebook_nodes = asyncio.run(run_all())
+
+    for notebook_node in notebook_nodes:
+        assert notebook_node.cells[0].execution_count == 1
+
+
+def test_async_run_notebook_node_can_be_cancelled():
+    notebook_node = utils.make_notebook_node(["import time\ntime.sleep(60)"])
+    start = time.perf_counter()
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(
+            utils.async_run_notebook_node(notebook_node), timeout=3))
+
+    assert time.perf_counter() - start < 30
+
+
+def make_notebook_with_outputs():
+    notebook_node = utils.make_notebook_node(["print('hi')\n1 + 1", "x = 1"])
+    notebook_node.cells[0].metadata["tags"] = ["output"]
+    notebook_node.cells[0].outputs = [
+        nbformat.v4.new_output("stream", text="hi\n"),
+        nbformat.v4.new_output(
+            "execute_result",
+            data={"text/plain": "2", "image/png": "iVBORw0KGgo="},
+            execution_count=1,
+        ),
+    ]
+    notebook_node.metadata["orig_nbformat"] = 3
+    return notebook_node
+
+
+@pytest.mark.parametrize(
+    "load_kwargs",
+    [{}, {"validate": False}, {"lazy_outputs": True}],
+)
+def test_get_notebook_from_filepath_matches_nbformat(
+        tmp_path, write_notebook, load_kwargs):
+    filepath = write_notebook(
+        tmp_path, "outputs.ipynb", make_notebook_with_outputs())
+    expected = nbformat.read(filepath, as_version=4)
+
+    notebook_node = utils.get_notebook_from_filepath(filepath, **load_kwargs)
+
+    assert notebook_node.cells[0].source == "print('hi')\n1 + 1"
+    assert utils.get_output_text(notebook_node.cells[0]) == "hi\n2"
+    assert nbformat.writes(notebook_node) == nbformat.writes(expected)
+
+
+def test_get_notebook_from_filepath_lazy_outputs(tmp_path, write_notebook):
+    filepath = write_notebook(
+        tmp_path, "outputs.ipynb", make_notebook_with_outputs())
+
+    notebook_node = utils.get_notebook_from_filepath(
+        filepath, lazy_outputs=True)
+    cell = notebook_node.cells[0]
+
+    assert cell.metadata.tags == ["output"]
+    # Outputs stay unconverted until they are accessed
+    assert type(dict.__getitem__(cell, "outputs")) is not list
+    assert cell.outputs[1].data["text/plain"] == "2"
+    assert type(dict.__getitem__(cell, "outputs")) is list
+
+
+def test_get_notebook_from_filepath_logs_invalid_outputs(tmp_path, caplog):
+    filepath = str(tmp_path / "invalid.ipynb")
+    notebook_node = utils.make_notebook_node(["1 + 1"])
+    notebook_node.cells[0].outputs = [{"output_type": "stream"}]
+    with open(filepath, "w") as notebook_file:
+        json.dump(notebook_node, notebook_file)
+
+    notebook_node = utils.get_notebook_from_filepath(
+        filepath, lazy_outputs=True)
+    assert "invalid" not in caplog.text
+
+    notebook_node.cells[0].outputs
+
+    assert "Notebook JSON is invalid" in caplog.text
+
+
+def test_get_notebook_from_filepath_converts_old_formats(tmp_path):
+    filepath = str(tmp_path / "v3.ipynb")
+    notebook_node = nbformat.v3.new_notebook(worksheets=[
+        nbformat.v3.new_worksheet(cells=[
+            nbformat.v3.new_code_cell(input="1 + 1"),
+        ]),
+    ])
+    with open(filepath, "w") as notebook_file:
+        notebook_file.write(nbformat.v3.writes_json(notebook_node))
+
+    notebook_node = utils.get_notebook_from_filepath(filepath)
+
+    assert notebook_node.nbformat == 4
+    assert notebook_node.cells[0].source == "1 + 1"
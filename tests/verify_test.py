@@ -0,0 +1,123 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for verifying outputs against saved outputs"""
+from nbsampleutils import METADATA_KEY
+from nbsampleutils import cli
+from nbsampleutils import utils
+from nbsampleutils import verify
+
+
+def executed_notebook(code_cell_contents, edit=None):
+    """Execute a notebook and optionally edit its outputs"""
+    notebook_node = utils.run_notebook_node(
+        utils.make_notebook_node(code_cell_contents))
+    if edit is not None:
+        edit(notebook_node)
+    return notebook_node
+
+
+def test_compare_text_identical():
+    assert verify.compare_text("same\n", "same\n") is None
+
+
+def test_compare_text_normalizes_volatile_content():
+    expected = (
+        "<Model object at 0x7f3a2c1b9d30>\n"
+        "started 2019-05-01T12:00:00.123456Z\n"
+        "Wall time: 1.5 s\n"
+    )
+    actual = (
+        "<Model object at 0x7f00deadbeef>\n"
+        "started 2024-01-31 08:15:42\n"
+        "Wall time: 880 ms\n"
+    )
+
+    assert verify.compare_text(expected, actual) is None
+
+
+def test_compare_text_reports_diff():
+    diff = verify.compare_text("a\nb\n", "a\nc\n")
+
+    assert diff.expected == "a\nb\n"
+    assert diff.actual == "a\nc\n"
+    assert "-b\n+c\n" in diff.diff
+
+
+def test_compare_text_with_custom_normalizers():
+    normalizers = {r"run \d+": "run N"}
+
+    assert verify.compare_text("run 1", "run 2", normalizers) is None
+    assert verify.compare_text("0x7f3a2c1b9d30", "0x7f00deadbeef",
+                               normalizers) is not None
+
+
+def test_verify_notebook_node_finds_changed_cells():
+    notebook_node = utils.run_notebook_node(
+        utils.make_notebook_node(["print('same')", "2 + 2", "object()"]))
+    notebook_node.cells[1].outputs[0].data["text/plain"] = "5"
+
+    diffs = verify.verify_notebook_node(notebook_node)
+
+    assert [diff.cell_index for diff in diffs] == [1]
+    assert diffs[0].expected == "5"
+    assert diffs[0].actual == "4"
+
+
+def test_verify_notebook_node_skips_opted_out_cells():
+    notebook_node = utils.run_notebook_node(
+        utils.make_notebook_node(["import random; random.random()"]))
+    notebook_node.cells[0].metadata[METADATA_KEY] = {"verify": False}
+
+    assert verify.verify_notebook_node(notebook_node) == []
+
+
+def test_verify_batch(tmp_path, write_notebook):
+    def edit(notebook_node):
+        notebook_node.cells[0].outputs[0].text = "stale\n"
+
+    same = write_notebook(
+        tmp_path, "same.ipynb", executed_notebook(["print('ok')"]))
+    changed = write_notebook(
+        tmp_path,
+        "changed.ipynb",
+        executed_notebook(["print('fresh')"], edit=edit),
+    )
+
+    results = verify.verify_batch(str(tmp_path), max_workers=2)
+
+    assert [result.filepath for result in results] == [changed, same]
+    assert [diff.cell_index for diff in results[0].diffs] == [0]
+    assert "-stale\n+fresh\n" in results[0].diffs[0].diff
+    assert results[1].diffs == []
+    assert results[1].error is None
+
+
+def test_cli_verify(tmp_path, capsys, write_notebook):
+    def edit(notebook_node):
+        notebook_node.cells[0].outputs[0].text = "run 1\n"
+
+    write_notebook(
+        tmp_path,
+        "sample.ipynb",
+        executed_notebook(["print('run 2')"], edit=edit),
+    )
+
+    assert cli.main(["verify", str(tmp_path)]) == 1
+    assert "DIFF" in capsys.readouterr().out
+
+    exit_code = cli.main(
+        ["verify", str(tmp_path), "--normalize", r"run \d+=run N"])
+
+    assert exit_code == 0
+    assert "1 notebooks, 0 differ or failed" in capsys.readouterr().out
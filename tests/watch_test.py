@@ -0,0 +1,149 @@
+# Copyright 2019 Alix Hamilton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for rebuilding notebooks when they change"""
+import os
+import threading
+import time
+
+import pytest
+
+from nbsampleutils import watch
+
+
+def read_markdown(directory, name):
+    with open(os.path.join(str(directory), name)) as markdown_file:
+        return markdown_file.read()
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    (tmp_path / "notebooks").mkdir()
+    with watch.NotebookWatcher(
+            str(tmp_path / "notebooks"),
+            output_dir=str(tmp_path / "docs"),
+            debounce=0.1,
+            poll_interval=0.1,
+            use_inotify=False,
+    ) as watcher:
+        yield watcher
+
+
+def test_build_changed_skips_unchanged_notebooks(watcher, write_notebook):
+    filepath = write_notebook(watcher.root, "sample.ipynb", ["1 + 1"])
+
+    results = watcher.build_changed()
+
+    assert [(result.filepath, result.error) for result in results] == [
+        (filepath, None)]
+    assert results[0].executed_from == 0
+    assert "2" in read_markdown(watcher.output_dir, "sample.md")
+    assert watcher.build_changed() == []
+
+
+def test_edit_executes_from_changed_cell(watcher, write_notebook):
+    filepath = write_notebook(watcher.root, "sample.ipynb", ["a = 1", "a + 1"])
+    watcher.build_changed()
+
+    write_notebook(watcher.root, "sample.ipynb", ["a = 1", "a + 20"])
+    results = watcher.build_changed()
+
+    assert [result.filepath for result in results] == [filepath]
+    assert results[0].executed_from == 1
+    assert "21" in read_markdown(watcher.output_dir, "sample.md")
+
+
+def test_restarted_watcher_skips_current_exports(watcher, write_notebook):
+    write_notebook(watcher.root, "sample.ipynb", ["1 + 1"])
+    watcher.build_changed()
+    watcher.close()
+
+    with watch.NotebookWatcher(
+            watcher.root,
+            output_dir=watcher.output_dir,
+            use_inotify=False,
+    ) as restarted:
+        assert restarted.build_changed() == []
+
+
+def test_restarted_watcher_rebuilds_with_new_replacements(
+        watcher, write_notebook):
+    write_notebook(watcher.root, "sample.ipynb", ["'old'"])
+    watcher.build_changed()
+    watcher.close()
+
+    with watch.NotebookWatcher(
+            watcher.root,
+            output_dir=watcher.output_dir,
+            input_string_replacements={"old": "new"},
+            use_inotify=False,
+    ) as restarted:
+        assert len(restarted.build_changed()) == 1
+    assert "'new'" in read_markdown(watcher.output_dir, "sample.md")
+
+
+def test_restarted_watcher_rebuilds_with_new_kernel_options(
+        watcher, write_notebook):
+    write_notebook(watcher.root, "sample.ipynb", ["1 + 1"])
+    watcher.build_changed()
+    watcher.close()
+
+    with watch.NotebookWatcher(
+            watcher.root,
+            output_dir=watcher.output_dir,
+            use_inotify=False,
+            allow_errors=True,
+    ) as restarted:
+        (result,) = restarted.build_changed()
+    assert result.executed_from == 0
+
+
+def test_build_reports_errors(watcher, write_notebook):
+    filepath = write_notebook(
+        watcher.root, "broken.ipynb", ["undefined_variable"])
+
+    results = watcher.build_changed()
+
+    assert [result.filepath for result in results] == [filepath]
+    assert "CellExecutionError" in results[0].error
+
+
+def test_watch_rebuilds_edited_notebook(watcher, write_notebook):
+    write_notebook(watcher.root, "sample.ipynb", ["'before'"])
+    results = []
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=watcher.watch,
+        kwargs={"on_build": results.append, "stop_event": stop_event})
+    thread.start()
+    try:
+        deadline = time.monotonic() + 60
+        while not results and time.monotonic() < deadline:
+            time.sleep(0.1)
+        write_notebook(watcher.root, "sample.ipynb", ["'after'"])
+        while len(results) < 2 and time.monotonic() < deadline:
+            time.sleep(0.1)
+    finally:
+        stop_event.set()
+        thread.join(timeout=30)
+
+    assert not thread.is_alive()
+    assert len(results) == 2
+    assert "after" in read_markdown(watcher.output_dir, "sample.md")
+
+
+@pytest.mark.skipif(
+    watch.inotify_simple is not None, reason="inotify_simple is installed")
+def test_use_inotify_requires_package(tmp_path):
+    with pytest.raises(ImportError):
+        watch.NotebookWatcher(str(tmp_path), use_inotify=True)